@@ -139,8 +139,9 @@ class AIChatService:
     def get_agent(agent_id: str) -> Optional[Dict]:
         """Get agent configuration by ID"""
         try:
-            from models import AIAgentService
-            agent = AIAgentService.get_ai_agent(agent_id)
+            # Repeated lookups within one request share a single query
+            from loaders import get_loaders
+            agent = get_loaders().ai_agents.load(agent_id)
             if agent:
                 return agent
         except Exception as e:
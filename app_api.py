@@ -1,5 +1,5 @@
 import logging
-from flask import request, jsonify
+from flask import request, jsonify, Response
 from datetime import datetime
 import os
 import sys
@@ -14,21 +14,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _export_response(chunks, export_format, name):
+    """
+    Stream export chunks as a file download
+    
+    The first chunk is produced before the response starts, so a failing
+    first query still turns into an error response instead of an empty file.
+    A later failure is re-raised, which makes the server abort the
+    connection so the client sees an incomplete download, not a short file.
+    """
+    from lead_export import EXPORT_FORMATS
+    first = next(chunks, '')
+    
+    def generate():
+        yield first
+        try:
+            yield from chunks
+        except Exception as e:
+            # Headers are already sent; ending the stream normally would pass
+            # a truncated file off as complete
+            logger.error(f"{name} export aborted: {e}")
+            raise
+    
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    return Response(generate(), mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename={name}.{extension}'
+    })
+
 def register_api_routes(app):
     """Register all API routes for the application"""
     
     @app.route('/api/leads', methods=['GET'])
     def api_get_leads():
-        """Get all leads from database"""
+        """Get leads from database, one keyset page at a time"""
         try:
             from models import LeadService
             lead_service = LeadService()
-            leads = lead_service.get_leads(limit=request.args.get('limit', 50, type=int))
+            try:
+                page = lead_service.get_leads_page(
+                    limit=min(max(request.args.get('limit', 50, type=int), 1), 500),
+                    status=request.args.get('status'),
+                    agent_id=request.args.get('agent_id'),
+                    cursor=request.args.get('cursor'),
+                    view=request.args.get('view', 'list')
+                )
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            leads = page['leads']
+            
+            # Related entities are resolved with one query per type
+            include = set(filter(None, request.args.get('include', '').split(',')))
+            if include & {'agent', 'interactions'}:
+                from loaders import get_loaders
+                loaders = get_loaders()
+                lead_ids = [lead.get('id') for lead in leads]
+                agent_ids = [lead.get('agent_id') for lead in leads]
+                if 'agent' in include:
+                    for lead, agent in zip(leads, loaders.agents.load_many(agent_ids)):
+                        lead['agent'] = agent
+                if 'interactions' in include:
+                    for lead, interactions in zip(leads, loaders.interactions.load_many(lead_ids)):
+                        lead['interactions'] = interactions
             
             return jsonify({
                 'success': True,
                 'leads': leads,
-                'count': len(leads)
+                'count': len(leads),
+                'next_cursor': page['next_cursor']
             })
         except Exception as e:
             logger.error(f"API get leads error: {e}")
@@ -43,34 +98,47 @@ def register_api_routes(app):
         try:
             data = request.get_json() or {}
             
-            # Support both field name variations for compatibility
-            customer_name = data.get('customer_name') or data.get('name')
-            customer_phone = data.get('customer_phone') or data.get('phone')
+            from models import LeadService
+            lead_service = LeadService()
             
-            if not customer_name:
+            try:
+                lead_data = lead_service.normalize_lead_data(data)
+            except ValueError as e:
                 return jsonify({
                     'success': False,
-                    'error': 'Customer name is required'
+                    'error': str(e)
                 }), 400
+            lead_data['status'] = 'new'
+            if request.headers.get('Idempotency-Key'):
+                lead_data['idempotency_key'] = request.headers['Idempotency-Key'][:128]
             
-            from models import LeadService
-            lead_service = LeadService()
+            lead = lead_service.create_lead(lead_data)
+            if not lead:
+                return jsonify({
+                    'success': False,
+                    'error': 'Lead was not created'
+                }), 500
             
-            lead_data = {
-                'customer_name': customer_name,
-                'customer_phone': customer_phone or 'Не указан',
-                'customer_email': data.get('customer_email') or data.get('email') or 'Не указан',
-                'source': data.get('source', 'website'),
-                'interest': data.get('interest') or data.get('tour_interest') or 'Общий интерес',
-                'notes': data.get('notes') or data.get('details', ''),
-                'status': 'new'
-            }
-            # For now, return success without database creation since DB is unavailable
-            lead_id = f"lead_{int(datetime.now().timestamp())}"
+            if lead.get('duplicate'):
+                return jsonify({
+                    'success': True,
+                    'lead_id': lead.get('id'),
+                    'duplicate': True,
+                    'message': 'Lead with this phone or email already exists'
+                })
+            
+            if lead.get('sync_status') == 'pending':
+                # Database unreachable: accepted and queued for replay
+                return jsonify({
+                    'success': True,
+                    'lead_id': None,
+                    'idempotency_key': lead.get('idempotency_key'),
+                    'message': 'Lead accepted and will be saved when the database is available'
+                }), 202
             
             return jsonify({
                 'success': True,
-                'lead_id': lead_id,
+                'lead_id': lead.get('id'),
                 'message': 'Lead created successfully'
             })
             
@@ -81,6 +149,338 @@ def register_api_routes(app):
                 'error': str(e)
             }), 500
 
+    @app.route('/api/leads/stats', methods=['GET'])
+    def api_lead_stats():
+        """Get grouped lead statistics for the dashboard"""
+        try:
+            from models import LeadStatsService
+            days = min(max(request.args.get('days', 30, type=int), 1), 366)
+            stats = LeadStatsService.get_lead_stats(days=days)
+            
+            return jsonify({
+                'success': True,
+                'stats': stats
+            })
+        except Exception as e:
+            logger.error(f"API lead stats error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/cache-stats', methods=['GET'])
+    def api_lead_cache_stats():
+        """Get hit/miss metrics of the lead cache"""
+        try:
+            from models import LeadService
+            
+            return jsonify({
+                'success': True,
+                'cache': LeadService.get_cache_stats()
+            })
+        except Exception as e:
+            logger.error(f"API lead cache stats error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/import', methods=['POST'])
+    def api_import_leads():
+        """Bulk import leads from a CSV or NDJSON request body"""
+        try:
+            from models import LeadService
+            from lead_import import detect_import_format, iter_import_rows
+            
+            try:
+                import_format = detect_import_format(request.content_type, request.args.get('format'))
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 415
+            
+            chunk_size = min(max(request.args.get('chunk_size', 500, type=int), 1), 1000)
+            report = LeadService.create_leads_bulk(
+                iter_import_rows(request.stream, import_format),
+                chunk_size=chunk_size,
+                dedupe=request.args.get('dedupe') not in ('0', 'false')
+            )
+            
+            return jsonify({
+                'success': report['failed'] == 0,
+                'format': import_format,
+                **report
+            })
+        except Exception as e:
+            logger.error(f"API import leads error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/export', methods=['GET'])
+    def api_export_leads():
+        """Stream all leads as CSV or NDJSON, one keyset page at a time"""
+        try:
+            from models import LeadService, LEAD_VIEWS, select_columns
+            from lead_export import detect_export_format, iter_export_chunks
+            
+            try:
+                export_format = detect_export_format(request.args.get('format'), request.headers.get('Accept'))
+                view = request.args.get('view', 'full')
+                columns = select_columns(LEAD_VIEWS, view)
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            
+            leads = LeadService.iter_leads(
+                batch_size=min(max(request.args.get('batch_size', 1000, type=int), 1), 5000),
+                status=request.args.get('status'),
+                agent_id=request.args.get('agent_id'),
+                view=view
+            )
+            fields = None if columns == '*' else columns.split(', ')
+            return _export_response(iter_export_chunks(leads, export_format, fields), export_format, 'leads')
+        except Exception as e:
+            logger.error(f"API export leads error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/interactions/export', methods=['GET'])
+    def api_export_lead_interactions():
+        """Stream the interactions of all leads as CSV or NDJSON in ID order"""
+        try:
+            from models import LeadService
+            from lead_export import detect_export_format, iter_export_chunks
+            
+            try:
+                export_format = detect_export_format(request.args.get('format'), request.headers.get('Accept'))
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            
+            interactions = LeadService.iter_interactions(
+                batch_size=min(max(request.args.get('batch_size', 1000, type=int), 1), 5000)
+            )
+            return _export_response(iter_export_chunks(interactions, export_format), export_format,
+                                    'lead_interactions')
+        except Exception as e:
+            logger.error(f"API export lead interactions error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/search', methods=['GET'])
+    def api_search_leads():
+        """Search leads by partial name, phone, email or notes"""
+        try:
+            from models import LeadService
+            try:
+                leads = LeadService.search_leads(
+                    request.args.get('q', ''),
+                    limit=min(max(request.args.get('limit', 20, type=int), 1), 100),
+                    view=request.args.get('view', 'list')
+                )
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            
+            return jsonify({
+                'success': True,
+                'leads': leads,
+                'count': len(leads)
+            })
+        except Exception as e:
+            logger.error(f"API lead search error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/dedupe', methods=['POST'])
+    def api_dedupe_leads():
+        """Backfill normalized phone/email keys and report duplicate clusters"""
+        try:
+            from models import LeadService
+            data = request.get_json(silent=True) or {}
+            batch_size = min(max(int(data.get('batch_size', 1000)), 1), 5000)
+            
+            report = LeadService.backfill_dedupe_keys(batch_size=batch_size,
+                                                      dry_run=bool(data.get('dry_run', False)))
+            
+            return jsonify({
+                'success': True,
+                **report
+            })
+        except Exception as e:
+            logger.error(f"API lead dedupe error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/bookings', methods=['GET'])
+    def api_get_bookings():
+        """Get bookings in a check-in or creation date range, one keyset page at a time"""
+        try:
+            from models import BookingService
+            date_field = request.args.get('date_field', 'checkin_date')
+            date_from = request.args.get('from')
+            date_to = request.args.get('to')
+            status = request.args.get('status')
+            try:
+                page = BookingService.get_bookings_page(
+                    limit=min(max(request.args.get('limit', 50, type=int), 1), 500),
+                    date_field=date_field,
+                    date_from=date_from,
+                    date_to=date_to,
+                    status=status,
+                    cursor=request.args.get('cursor'),
+                    descending=request.args.get('order', 'asc') == 'desc',
+                    view=request.args.get('view', 'list')
+                )
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            
+            response = {
+                'success': True,
+                'bookings': page['bookings'],
+                'count': len(page['bookings']),
+                'next_cursor': page['next_cursor']
+            }
+            if request.args.get('totals') in ('1', 'true'):
+                response['totals'] = BookingService.get_booking_totals(date_field, date_from, date_to, status)
+            return jsonify(response)
+        except Exception as e:
+            logger.error(f"API get bookings error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/bookings/reconcile', methods=['POST'])
+    def api_reconcile_bookings():
+        """Compare local bookings with SAMO and repair the drift"""
+        try:
+            from models import BookingService
+            data = request.get_json(silent=True) or {}
+            try:
+                report = BookingService.reconcile_with_samo(
+                    date_from=data.get('date_from'),
+                    date_to=data.get('date_to'),
+                    dry_run=bool(data.get('dry_run', False))
+                )
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            
+            return jsonify({
+                'success': report['failed'] == 0,
+                **report
+            })
+        except Exception as e:
+            logger.error(f"API booking reconciliation error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/<lead_id>/assign', methods=['POST'])
+    def api_assign_lead(lead_id):
+        """Assign a lead to the least loaded agent on duty"""
+        try:
+            from models import AssignmentService
+            lead = AssignmentService.assign_lead(lead_id)
+            
+            if not lead:
+                return jsonify({
+                    'success': False,
+                    'error': 'Lead not found or no agent available'
+                }), 409
+            
+            return jsonify({
+                'success': True,
+                'lead': lead
+            })
+        except Exception as e:
+            logger.error(f"API assign lead error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/agents/assignment', methods=['GET', 'POST'])
+    def api_agent_assignment():
+        """Open-lead load per agent; POST reloads it from the database"""
+        try:
+            from models import AssignmentService
+            
+            state = AssignmentService.resync() if request.method == 'POST' else AssignmentService.get_agent_loads()
+            return jsonify({
+                'success': True,
+                **state
+            })
+        except Exception as e:
+            logger.error(f"API agent assignment error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
+    @app.route('/api/leads/bulk-status', methods=['POST'])
+    def api_bulk_update_lead_status():
+        """Apply many lead status transitions in one request"""
+        try:
+            data = request.get_json() or {}
+            updates = data.get('updates')
+            
+            if not isinstance(updates, list) or not updates:
+                return jsonify({
+                    'success': False,
+                    'error': 'updates must be a non-empty list of {lead_id, status}'
+                }), 400
+            
+            if len(updates) > 1000:
+                return jsonify({
+                    'success': False,
+                    'error': 'At most 1000 updates per request'
+                }), 413
+            
+            from models import LeadService
+            results = LeadService.update_lead_statuses(
+                (item.get('lead_id'), item.get('status')) if isinstance(item, dict) else (None, None)
+                for item in updates
+            )
+            failed = len([r for r in results if not r['success']])
+            
+            return jsonify({
+                'success': failed == 0,
+                'updated': len(results) - failed,
+                'failed': failed,
+                'results': results
+            })
+        except Exception as e:
+            logger.error(f"API bulk lead status error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
     @app.route('/api/chat/history/<lead_id>', methods=['GET'])
     def api_get_chat_history(lead_id):
         """Get chat history for a specific lead"""
@@ -204,14 +604,12 @@ def register_api_routes(app):
             
             from models import SettingsService
             
-            # Update each setting
-            updated_settings = {}
-            for key, value in data.items():
-                if key in ['api_url', 'oauth_token', 'timeout', 'user_agent']:
-                    success = SettingsService.update_samo_setting(key, str(value))
-                    updated_settings[key] = value
-                    if not success:
-                        logger.warning(f"Failed to save setting {key} to database, using memory storage")
+            # Save all known settings in one bulk upsert
+            updated_settings = {key: value for key, value in data.items()
+                                if key in SettingsService.SAMO_SETTING_KEYS}
+            success = SettingsService.update_samo_settings(updated_settings)
+            if not success:
+                logger.warning("Failed to save SAMO settings to database, using memory storage")
             
             return jsonify({
                 'success': True,
@@ -460,6 +858,23 @@ def register_api_routes(app):
             logger.error(f"Server diagnostics error: {e}")
             return jsonify({"error": str(e)}), 500
     
+    @app.route('/api/diagnostics/outbox', methods=['GET', 'POST'])
+    def api_diagnostics_outbox():
+        """Deferred write queue status; POST replays it immediately"""
+        try:
+            from models import LeadService
+            
+            replayed = LeadService.replay_outbox() if request.method == 'POST' else None
+            return jsonify({
+                "timestamp": datetime.now().isoformat(),
+                "replayed": replayed,
+                "outbox": LeadService.get_outbox_stats()
+            })
+            
+        except Exception as e:
+            logger.error(f"Outbox diagnostics error: {e}")
+            return jsonify({"error": str(e)}), 500
+    
     @app.route('/api/diagnostics/curl', methods=['GET'])
     def api_diagnostics_curl():
         """Генерация curl команды"""
@@ -678,6 +1093,13 @@ def register_api_routes(app):
             limit = request.args.get('limit', 50, type=int)
             
             conversations = messaging_hub.get_conversations(channel, limit)
+            
+            # Linked leads are resolved with one query for the whole page
+            if 'lead' in request.args.get('include', '').split(','):
+                from loaders import get_loaders
+                leads = get_loaders().leads.load_many(conversation.get('lead_id') for conversation in conversations)
+                # Copies: the in-memory store hands out its own dicts
+                conversations = [{**conversation, 'lead': lead} for conversation, lead in zip(conversations, leads)]
             return jsonify({
                 'success': True,
                 'conversations': conversations,
@@ -714,6 +1136,24 @@ def register_api_routes(app):
                 'count': 0
             })
     
+    @app.route('/api/messages/conversations/<conversation_id>/read', methods=['POST'])
+    def api_mark_conversation_read(conversation_id):
+        """Mark the unread messages of a conversation as read"""
+        try:
+            from messaging_service import messaging_hub
+            marked = messaging_hub.mark_read(conversation_id)
+            return jsonify({
+                'success': True,
+                'conversation_id': conversation_id,
+                'marked': marked
+            })
+        except Exception as e:
+            logger.error(f"Mark read error: {e}")
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 500
+    
     @app.route('/api/messages/send', methods=['POST'])
     def api_send_message():
         """Send message through specified channel"""
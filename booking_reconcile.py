@@ -0,0 +1,206 @@
+"""
+Booking reconciliation for Crystal Bay Travel
+Compares local bookings with SAMO by content hash and reports the drift between them
+"""
+
+import json
+import hashlib
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Local booking columns SAMO is the source of truth for, with the SAMO
+# response keys they may come under (matched case-insensitively)
+SAMO_FIELDS = {
+    'status': ('status', 'claim_status', 'state'),
+    'checkin_date': ('checkin_date', 'checkin', 'date_beg', 'datebeg'),
+    'nights': ('nights', 'night'),
+    'adults': ('adults', 'adult'),
+    'children': ('children', 'child'),
+    'price': ('price', 'amount', 'cost'),
+    'currency': ('currency', 'currency_alias')
+}
+SAMO_ID_KEYS = ('booking_id', 'claim', 'id')
+
+# SAMO claim statuses (lower case) -> local booking statuses. Statuses not
+# listed here are never written; the local status is kept instead
+SAMO_STATUS_MAP = {
+    'new': 'pending',
+    'pending': 'pending',
+    'wait': 'pending',
+    'waiting': 'pending',
+    'not confirmed': 'pending',
+    'unconfirmed': 'pending',
+    'в работе': 'pending',
+    'ожидание': 'pending',
+    'не подтверждено': 'pending',
+    'confirmed': 'confirmed',
+    'ok': 'confirmed',
+    'paid': 'confirmed',
+    'подтверждено': 'confirmed',
+    'оплачено': 'confirmed',
+    'cancelled': 'cancelled',
+    'canceled': 'cancelled',
+    'annulled': 'cancelled',
+    'annul': 'cancelled',
+    'rejected': 'cancelled',
+    'аннулировано': 'cancelled',
+    'отменено': 'cancelled'
+}
+
+RECONCILED_FIELDS = tuple(SAMO_FIELDS)
+
+# Fields that must all match to link an unlinked local booking to SAMO
+LINK_FIELDS = tuple(field for field in RECONCILED_FIELDS if field != 'status')
+
+
+def _lookup(record: Dict[str, Any], keys: Iterable[str]) -> Any:
+    lowered = {str(key).lower(): value for key, value in record.items()}
+    for key in keys:
+        if lowered.get(key) not in (None, ''):
+            return lowered[key]
+    return None
+
+
+def _normalize_date(value: Any) -> Optional[str]:
+    if value in (None, ''):
+        return None
+    text = str(value).strip()
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y', '%Y%m%d'):
+        try:
+            return datetime.strptime(text[:10], date_format).date().isoformat()
+        except ValueError:
+            continue
+    return text
+
+
+def _normalize_int(value: Any) -> Optional[int]:
+    if value in (None, ''):
+        return None
+    try:
+        return int(Decimal(str(value)))
+    except InvalidOperation:
+        return None
+
+
+def _normalize_price(value: Any) -> Optional[str]:
+    if value in (None, ''):
+        return None
+    try:
+        return str(Decimal(str(value).replace(' ', '').replace(',', '.')).quantize(Decimal('0.01')))
+    except InvalidOperation:
+        return None
+
+
+def normalize_booking(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce a local row or a mapped SAMO booking to comparable values
+    
+    Dates become ISO dates, counts integers, prices two-decimal strings,
+    statuses lower case and currencies upper case, so that formatting
+    differences between the two systems do not count as drift.
+    """
+    return {
+        'status': str(record['status']).strip().lower() if record.get('status') not in (None, '') else None,
+        'checkin_date': _normalize_date(record.get('checkin_date')),
+        'nights': _normalize_int(record.get('nights')),
+        'adults': _normalize_int(record.get('adults')),
+        'children': _normalize_int(record.get('children')) or 0,
+        'price': _normalize_price(record.get('price')),
+        'currency': str(record['currency']).strip().upper() if record.get('currency') else None
+    }
+
+
+def booking_hash(normalized: Dict[str, Any]) -> str:
+    """Content hash of a normalized booking"""
+    payload = json.dumps([normalized[field] for field in RECONCILED_FIELDS], default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def map_samo_status(value: Any) -> Optional[str]:
+    """Translate a SAMO status to a local one (None if it is not known)"""
+    if value in (None, ''):
+        return None
+    return SAMO_STATUS_MAP.get(' '.join(str(value).lower().split()))
+
+
+def map_samo_booking(samo: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Map a SAMO booking to local column names and statuses
+    
+    Returns:
+        dict: {'samo_booking_id', 'samo_status', <RECONCILED_FIELDS>}, or
+            None without an ID; 'status' is None if SAMO's is not mapped
+    """
+    samo_id = _lookup(samo, SAMO_ID_KEYS)
+    if samo_id is None:
+        return None
+    mapped = {field: _lookup(samo, keys) for field, keys in SAMO_FIELDS.items()}
+    mapped['samo_status'] = mapped['status']
+    mapped['status'] = map_samo_status(mapped['status'])
+    mapped['samo_booking_id'] = str(samo_id)
+    return mapped
+
+
+def extract_samo_bookings(response: Any) -> List[Dict[str, Any]]:
+    """
+    Get the booking records out of a GetBookings / GetBookingDetails response
+    
+    Raises:
+        RuntimeError: If SAMO returned an error
+    """
+    if isinstance(response, list):
+        return [row for row in response if isinstance(row, dict)]
+    if not isinstance(response, dict):
+        return []
+    if response.get('error'):
+        raise RuntimeError(f"SAMO error: {response['error']}")
+    for key in ('bookings', 'booking', 'claims', 'data', 'items', 'result'):
+        value = response.get(key)
+        if isinstance(value, (list, dict)):
+            return extract_samo_bookings(value)
+    if _lookup(response, SAMO_ID_KEYS) is not None:
+        return [response]
+    return []
+
+
+def keep_local_status(local: Dict[str, Any], remote: Dict[str, Any]) -> Dict[str, Any]:
+    """Use the local status where SAMO's could not be mapped"""
+    if remote['status'] is None:
+        return dict(remote, status=local['status'])
+    return remote
+
+
+def link_key(normalized: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+    """Values a local booking and a SAMO booking must share to be linked"""
+    if normalized['checkin_date'] is None or normalized['price'] is None:
+        return None
+    return tuple(normalized[field] for field in LINK_FIELDS)
+
+
+def diff_fields(local: Dict[str, Any], remote: Dict[str, Any]) -> Dict[str, List[Any]]:
+    """Get {field: [local value, SAMO value]} for the fields that differ"""
+    return {field: [local[field], remote[field]] for field in RECONCILED_FIELDS
+            if local[field] != remote[field]}
+
+
+def merge_by_id(local: Iterable[Tuple[str, Any]], remote: Iterable[Tuple[str, Any]]
+                ) -> Iterator[Tuple[str, Any, Any]]:
+    """
+    Walk two streams sorted by SAMO booking ID in one pass
+    
+    Yields:
+        tuple: (samo_booking_id, local item or None, remote item or None)
+    """
+    local, remote = iter(local), iter(remote)
+    local_item, remote_item = next(local, None), next(remote, None)
+    while local_item is not None or remote_item is not None:
+        if remote_item is None or (local_item is not None and local_item[0] < remote_item[0]):
+            yield local_item[0], local_item[1], None
+            local_item = next(local, None)
+        elif local_item is None or remote_item[0] < local_item[0]:
+            yield remote_item[0], None, remote_item[1]
+            remote_item = next(remote, None)
+        else:
+            yield local_item[0], local_item[1], remote_item[1]
+            local_item, remote_item = next(local, None), next(remote, None)
@@ -0,0 +1,84 @@
+"""
+In-process caches for Crystal Bay Travel services
+Small thread-safe helpers used to avoid repeated database round trips
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Returned by get() when a key is absent or expired (None is a cacheable value)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe key/value cache where every entry expires after `ttl` seconds
+    
+    With `maxsize` set it is also a bounded LRU: reads refresh an entry and
+    the least recently used entry is evicted when the cache is full.
+    Hit, miss and eviction counters are kept for monitoring.
+    """
+    
+    def __init__(self, ttl: float, maxsize: Optional[int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: Hashable) -> Any:
+        """Get a cached value, or MISSING if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Hashable, value: Any):
+        """Store a value for `ttl` seconds"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+    
+    def invalidate(self, *keys: Hashable):
+        """Drop the given keys"""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+    
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get size and hit/miss metrics"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None
+        }
+    
+    def __len__(self):
+        return len(self._entries)
@@ -18,6 +18,7 @@ class CrystalBaySamoAPI:
         try:
             from models import SettingsService
             self.settings_service = SettingsService()
+            self.settings_version = SettingsService.get_settings_version()
             settings = self.settings_service.get_samo_settings()
             
             self.base_url = base_url or settings.get('api_url', 'https://booking.crystalbay.com/export/default.php')
@@ -26,6 +27,7 @@ class CrystalBaySamoAPI:
             self.user_agent = settings.get('user_agent', 'Crystal Bay Travel Integration/1.0')
         except ImportError:
             # Fallback if models not available
+            self.settings_version = None
             self.base_url = base_url or "https://booking.crystalbay.com/export/default.php"
             self.oauth_token = oauth_token or "27bd59a7ac67422189789f0188167379"
             self.timeout = 30
@@ -396,7 +398,14 @@ class CrystalBaySamoAPI:
 crystal_bay_api = CrystalBaySamoAPI()
 
 def get_crystal_bay_api() -> CrystalBaySamoAPI:
-    """Получить экземпляр Crystal Bay SAMO API"""
+    """Получить экземпляр Crystal Bay SAMO API (пересоздается после изменения настроек)"""
+    global crystal_bay_api
+    try:
+        from models import SettingsService
+        if crystal_bay_api.settings_version != SettingsService.get_settings_version():
+            crystal_bay_api = CrystalBaySamoAPI()
+    except ImportError:
+        pass
     return crystal_bay_api
 
 
@@ -0,0 +1,552 @@
+"""
+Durable fallback storage for Crystal Bay Travel
+SQLite stores used for leads, interactions, AI agents and settings when Supabase is not configured
+"""
+
+import os
+import re
+import json
+import sqlite3
+import logging
+import threading
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from lead_search import SIMILARITY_THRESHOLD, lead_search_text, trigrams
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT '',
+    status TEXT,
+    agent_id TEXT,
+    source TEXT,
+    external_source TEXT,
+    external_id TEXT,
+    phone_e164 TEXT,
+    email_normalized TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leads_created_idx ON leads (created_at, id);
+CREATE INDEX IF NOT EXISTS leads_status_created_idx ON leads (status, created_at, id);
+CREATE INDEX IF NOT EXISTS leads_agent_created_idx ON leads (agent_id, created_at, id);
+CREATE INDEX IF NOT EXISTS leads_source_idx ON leads (source);
+CREATE INDEX IF NOT EXISTS leads_external_idx ON leads (external_source, external_id);
+CREATE INDEX IF NOT EXISTS leads_phone_e164_idx ON leads (phone_e164);
+CREATE INDEX IF NOT EXISTS leads_email_normalized_idx ON leads (email_normalized);
+
+CREATE TABLE IF NOT EXISTS lead_interactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lead_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lead_interactions_lead_idx ON lead_interactions (lead_id, id);
+
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (collection, key)
+) WITHOUT ROWID;
+"""
+
+# Substring search over lead_search_text(); needs SQLite built with FTS5
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS leads_search USING fts5(content, tokenize='trigram');
+"""
+
+# Columns added to existing tables after their first release
+COLUMN_MIGRATIONS = {
+    'leads': [('phone_e164', 'TEXT'), ('email_normalized', 'TEXT')]
+}
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _row_id(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SQLiteFallbackDB:
+    """
+    Shared SQLite database file in WAL mode
+    
+    WAL lets every gunicorn worker read while one of them writes, so all
+    workers see the same degraded-mode data and it survives restarts.
+    Connections are opened lazily, one per thread, and reopened after fork.
+    """
+    
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self.search_enabled = False
+    
+    def connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, creating the schema on first use"""
+        if self._pid != os.getpid():
+            # Connections must not be shared with a forked child
+            self._local = threading.local()
+            self._pid = os.getpid()
+        
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode; writes use explicit transactions
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+            self._ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+    
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        with self._schema_lock:
+            if not self._schema_ready:
+                self._migrate(conn)
+                conn.executescript(SCHEMA)
+                self._create_search_index(conn)
+                self._schema_ready = True
+                logger.info(f"Fallback storage opened at {self.path}")
+    
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        # Add columns to tables created by an older schema, before their indexes are created
+        for table, columns in COLUMN_MIGRATIONS.items():
+            existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if not existing:
+                continue
+            for column, column_type in columns:
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+    
+    def _create_search_index(self, conn: sqlite3.Connection):
+        try:
+            conn.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 trigram tokenizer unavailable, lead search disabled: {e}")
+            return
+        self.search_enabled = True
+        # Index leads stored before the search table existed
+        if conn.execute('SELECT 1 FROM leads_search LIMIT 1').fetchone() is None:
+            rows = conn.execute('SELECT id, data FROM leads').fetchall()
+            if rows:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany(
+                    'INSERT INTO leads_search (rowid, content) VALUES (?, ?)',
+                    [(row['id'], lead_search_text(json.loads(row['data']))) for row in rows]
+                )
+                conn.execute('COMMIT')
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in one write transaction, taking the write lock up front"""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+class SQLiteLeadStore:
+    """
+    Lead storage backed by SQLite, interface-compatible with the in-memory store
+    
+    The filterable fields are kept in indexed columns next to the JSON
+    document, so status/agent pages, external ID lookups and grouped
+    counts are index reads instead of scans.
+    """
+    
+    def __init__(self, db: SQLiteFallbackDB):
+        self.db = db
+    
+    @staticmethod
+    def _columns(lead: Dict[str, Any]) -> tuple:
+        document = {key: value for key, value in lead.items() if key != 'id'}
+        return (
+            lead.get('created_at') or '',
+            _text(lead.get('status')),
+            _text(lead.get('agent_id')),
+            _text(lead.get('source')),
+            _text(lead.get('external_source')),
+            _text(lead.get('external_id')),
+            lead.get('phone_e164'),
+            lead.get('email_normalized'),
+            _dumps(document)
+        )
+    
+    @staticmethod
+    def _load(row: sqlite3.Row) -> Dict[str, Any]:
+        lead = json.loads(row['data'])
+        lead['id'] = str(row['id'])
+        return lead
+    
+    def _index_search(self, conn: sqlite3.Connection, row_id: int, lead: Dict[str, Any]):
+        if self.db.search_enabled:
+            conn.execute('DELETE FROM leads_search WHERE rowid = ?', (row_id,))
+            conn.execute('INSERT INTO leads_search (rowid, content) VALUES (?, ?)',
+                         (row_id, lead_search_text(lead)))
+    
+    def clear(self):
+        """Remove all leads and reset the ID sequence"""
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM leads')
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'leads'")
+            if self.db.search_enabled:
+                conn.execute('DELETE FROM leads_search')
+    
+    def __len__(self):
+        return self.db.connection().execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+    
+    def add(self, lead: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a new lead, assigning the next sequential ID"""
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO leads (created_at, status, agent_id, source, external_source, external_id, '
+                'phone_e164, email_normalized, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._columns(lead)
+            )
+            self._index_search(conn, cursor.lastrowid, lead)
+        lead['id'] = str(cursor.lastrowid)
+        return lead
+    
+    def get(self, lead_id) -> Optional[Dict[str, Any]]:
+        """Get a lead by ID"""
+        row_id = _row_id(lead_id)
+        if row_id is None:
+            return None
+        row = self.db.connection().execute('SELECT id, data FROM leads WHERE id = ?', (row_id,)).fetchone()
+        return self._load(row) if row else None
+    
+    def get_by_external_id(self, external_id, external_source) -> Optional[Dict[str, Any]]:
+        """Get the latest lead with the given (external_source, external_id)"""
+        if external_id is None or external_source is None:
+            return None
+        row = self.db.connection().execute(
+            'SELECT id, data FROM leads WHERE external_source = ? AND external_id = ? '
+            'ORDER BY id DESC LIMIT 1',
+            (str(external_source), str(external_id))
+        ).fetchone()
+        return self._load(row) if row else None
+    
+    def find_by_contact(self, keys: Dict[str, Optional[str]]) -> Optional[Dict[str, Any]]:
+        """Get the oldest lead sharing a normalized phone or email, via their indexes"""
+        clauses, params = [], []
+        for column in ('phone_e164', 'email_normalized'):
+            if keys.get(column):
+                clauses.append(f'{column} = ?')
+                params.append(keys[column])
+        if not clauses:
+            return None
+        row = self.db.connection().execute(
+            f"SELECT id, data FROM leads WHERE {' OR '.join(clauses)} ORDER BY created_at, id LIMIT 1",
+            params
+        ).fetchone()
+        return self._load(row) if row else None
+    
+    def update(self, lead_id, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Apply an update to a lead and its indexed columns"""
+        row_id = _row_id(lead_id)
+        if row_id is None:
+            return None
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT id, data FROM leads WHERE id = ?', (row_id,)).fetchone()
+            if row is None:
+                return None
+            lead = self._load(row)
+            lead.update(update_data)
+            lead['id'] = str(row_id)
+            conn.execute(
+                'UPDATE leads SET created_at = ?, status = ?, agent_id = ?, source = ?, '
+                'external_source = ?, external_id = ?, phone_e164 = ?, email_normalized = ?, '
+                'data = ? WHERE id = ?',
+                self._columns(lead) + (row_id,)
+            )
+            self._index_search(conn, row_id, lead)
+        return lead
+    
+    def list(self, limit=100, status=None, agent_id=None, before=None) -> List[Dict[str, Any]]:
+        """
+        Get leads newest first, optionally filtered by status and agent
+        
+        Pages are read from the (status|agent_id, created_at, id) indexes
+        starting at the `before` (created_at, id) cursor position.
+        
+        Raises:
+            ValueError: If the cursor ID is not a lead ID of this store
+        """
+        clauses, params = [], []
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(str(status))
+        if agent_id is not None:
+            clauses.append('agent_id = ?')
+            params.append(str(agent_id))
+        if before is not None:
+            before_id = _row_id(before[1])
+            if before_id is None:
+                raise ValueError("Invalid cursor")
+            clauses.append('(created_at, id) < (?, ?)')
+            params.extend([before[0] or '', before_id])
+        
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ''
+        rows = self.db.connection().execute(
+            f'SELECT id, data FROM leads {where}ORDER BY created_at DESC, id DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        return [self._load(row) for row in rows]
+    
+    def search(self, query: str, limit: int = 20) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Find leads by a normalized query through the FTS5 trigram index
+        
+        Leads containing every query word score 1; words of three or more
+        characters are matched through the index, shorter ones filter those
+        rows with LIKE. Only if nothing contains the query (a typo) are leads
+        sharing some of its trigrams fetched from the same index and scored
+        like TrigramIndex, as the share of query trigrams they contain.
+        
+        Returns:
+            list: (lead, score) pairs, best first, newest first among equals
+        
+        Raises:
+            RuntimeError: If SQLite was built without FTS5
+        """
+        conn = self.db.connection()
+        if not self.db.search_enabled:
+            raise RuntimeError("Lead search needs SQLite with the FTS5 trigram tokenizer")
+        
+        words = query.split()
+        indexed = [word for word in words if len(word) >= 3]
+        if indexed:
+            sql = ('SELECT l.id, l.data FROM leads_search JOIN leads l ON l.id = leads_search.rowid '
+                   'WHERE leads_search MATCH ?')
+            params = [' '.join('"' + word.replace('"', '""') + '"' for word in indexed)]
+            for word in words:
+                if len(word) < 3:
+                    sql += " AND leads_search.content LIKE ? ESCAPE '\\'"
+                    params.append('%' + re.sub(r'([%_\\])', r'\\\1', word) + '%')
+            sql += ' ORDER BY l.created_at DESC, l.id DESC LIMIT ?'
+            rows = conn.execute(sql, params + [limit]).fetchall()
+            if rows:
+                return [(self._load(row), 1.0) for row in rows]
+        
+        query_trigrams = trigrams(query)
+        inner = sorted(trigram for trigram in query_trigrams if ' ' not in trigram)
+        if not inner:
+            return []
+        
+        rows = conn.execute(
+            'SELECT l.id, l.data FROM leads_search JOIN leads l ON l.id = leads_search.rowid '
+            'WHERE leads_search MATCH ? ORDER BY rank LIMIT ?',
+            (' OR '.join(f'"{trigram}"' for trigram in inner), limit * 10)
+        ).fetchall()
+        scored = []
+        for row in rows:
+            lead = self._load(row)
+            score = len(query_trigrams & trigrams(lead_search_text(lead))) / len(query_trigrams)
+            if score >= SIMILARITY_THRESHOLD:
+                scored.append((lead, round(score, 3)))
+        scored.sort(key=lambda item: (item[1], item[0].get('created_at') or '', int(item[0]['id'])), reverse=True)
+        return scored[:limit]
+    
+    def stats(self, since_day=None) -> Dict[str, Any]:
+        """
+        Get grouped lead counts with GROUP BY queries over indexed columns
+        
+        Args:
+            since_day (str, optional): YYYY-MM-DD lower bound for by_day
+        
+        Returns:
+            dict: {'total', 'by_status', 'by_source', 'by_agent', 'by_day'}
+        """
+        conn = self.db.connection()
+        
+        def grouped(column):
+            rows = conn.execute(
+                f'SELECT {column}, COUNT(*) FROM leads WHERE {column} IS NOT NULL GROUP BY {column}'
+            ).fetchall()
+            return {row[0]: row[1] for row in rows}
+        
+        day_rows = conn.execute(
+            "SELECT substr(created_at, 1, 10) AS day, COUNT(*) FROM leads "
+            "WHERE created_at >= ? AND created_at != '' GROUP BY day ORDER BY day",
+            (since_day or '',)
+        ).fetchall()
+        return {
+            'total': conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0],
+            'by_status': grouped('status'),
+            'by_source': grouped('source'),
+            'by_agent': grouped('agent_id'),
+            'by_day': {row[0]: row[1] for row in day_rows}
+        }
+
+
+class SQLiteInteractionStore:
+    """
+    Lead interaction storage backed by SQLite
+    
+    History lives on disk, so unlike the in-memory store nothing is
+    evicted; a lead's interactions are read newest first from the
+    (lead_id, id) index.
+    """
+    
+    def __init__(self, db: SQLiteFallbackDB):
+        self.db = db
+    
+    def __len__(self):
+        return self.db.connection().execute('SELECT COUNT(*) FROM lead_interactions').fetchone()[0]
+    
+    def add(self, lead_id, interaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Store an interaction, assigning the next sequential ID"""
+        document = {key: value for key, value in interaction.items() if key != 'id'}
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO lead_interactions (lead_id, data) VALUES (?, ?)',
+                (str(lead_id), _dumps(document))
+            )
+        interaction['id'] = str(cursor.lastrowid)
+        return interaction
+    
+    def list(self, lead_id) -> List[Dict[str, Any]]:
+        """Get interactions for a lead, newest first"""
+        rows = self.db.connection().execute(
+            'SELECT id, data FROM lead_interactions WHERE lead_id = ? ORDER BY id DESC',
+            (str(lead_id),)
+        ).fetchall()
+        interactions = []
+        for row in rows:
+            interaction = json.loads(row['data'])
+            interaction['id'] = str(row['id'])
+            interactions.append(interaction)
+        return interactions
+    
+    def page(self, after_id=None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Get interactions of all leads in ID order, starting after `after_id`"""
+        rows = self.db.connection().execute(
+            'SELECT id, data FROM lead_interactions WHERE id > ? ORDER BY id LIMIT ?',
+            (int(after_id) if after_id is not None else 0, limit)
+        ).fetchall()
+        interactions = []
+        for row in rows:
+            interaction = json.loads(row['data'])
+            interaction['id'] = str(row['id'])
+            interactions.append(interaction)
+        return interactions
+
+
+class SQLiteDocumentStore(MutableMapping):
+    """
+    Dict-like collection of JSON documents backed by SQLite
+    
+    Used for AI agents, travel agents and settings. Values are copies: a document changed
+    in place has to be assigned back to be saved. `defaults` are written
+    once for keys that are not stored yet.
+    """
+    
+    def __init__(self, db: SQLiteFallbackDB, collection: str, defaults: Optional[Dict[str, Any]] = None):
+        self.db = db
+        self.collection = collection
+        self.defaults = dict(defaults or {})
+        self._seeded = not self.defaults
+    
+    def _connection(self) -> sqlite3.Connection:
+        if not self._seeded:
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO documents (collection, key, value) VALUES (?, ?, ?)',
+                    [(self.collection, str(key), _dumps(value)) for key, value in self.defaults.items()]
+                )
+            self._seeded = True
+        return self.db.connection()
+    
+    def __getitem__(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM documents WHERE collection = ? AND key = ?',
+            (self.collection, str(key))
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row['value'])
+    
+    def __setitem__(self, key, value):
+        self.update({key: value})
+    
+    def __delitem__(self, key):
+        conn = self._connection()
+        with self.db.transaction():
+            cursor = conn.execute(
+                'DELETE FROM documents WHERE collection = ? AND key = ?',
+                (self.collection, str(key))
+            )
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+    
+    def __iter__(self):
+        rows = self._connection().execute(
+            'SELECT key FROM documents WHERE collection = ? ORDER BY key',
+            (self.collection,)
+        ).fetchall()
+        return iter([row['key'] for row in rows])
+    
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM documents WHERE collection = ?',
+            (self.collection,)
+        ).fetchone()[0]
+    
+    def __contains__(self, key):
+        return self._connection().execute(
+            'SELECT 1 FROM documents WHERE collection = ? AND key = ?',
+            (self.collection, str(key))
+        ).fetchone() is not None
+    
+    def items(self):
+        """Get all (key, document) pairs with one query"""
+        rows = self._connection().execute(
+            'SELECT key, value FROM documents WHERE collection = ? ORDER BY key',
+            (self.collection,)
+        ).fetchall()
+        return [(row['key'], json.loads(row['value'])) for row in rows]
+    
+    def values(self):
+        """Get all documents with one query"""
+        return [value for _, value in self.items()]
+    
+    def update(self, other=(), **kwargs):
+        """Save several documents in one transaction"""
+        values = dict(other, **kwargs)
+        if not values:
+            return
+        conn = self._connection()
+        with self.db.transaction():
+            conn.executemany(
+                'INSERT OR REPLACE INTO documents (collection, key, value) VALUES (?, ?, ?)',
+                [(self.collection, str(key), _dumps(value)) for key, value in values.items()]
+            )
+    
+    def copy(self) -> Dict[str, Any]:
+        """Get a plain dict snapshot of the collection"""
+        return dict(self.items())
@@ -0,0 +1,300 @@
+"""
+Lead assignment for Crystal Bay Travel
+Keeps the open-lead load of every active agent in a heap and hands new leads to the least loaded one
+"""
+
+import os
+import heapq
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Leads in these statuses no longer count towards an agent's load; any
+# other status (new, contacted, in_progress, ...) is open work
+CLOSED_LEAD_STATUSES = frozenset(
+    status.strip() for status in
+    os.environ.get('CLOSED_LEAD_STATUSES', 'converted,lost,booked,canceled,cancelled,closed').split(',')
+    if status.strip()
+)
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+def is_open_lead(lead: Dict[str, Any]) -> bool:
+    """Check whether a lead counts towards its agent's load"""
+    return bool(lead.get('agent_id')) and lead.get('status') not in CLOSED_LEAD_STATUSES
+
+
+def parse_working_hours(hours: Optional[Dict[str, Any]]) -> Optional[Dict[int, Tuple[int, int]]]:
+    """
+    Parse an agent's working_hours column
+    
+    Args:
+        hours (dict): Weekday -> [start, end], e.g. {"mon": ["09:00", "18:00"]}.
+            An end before the start is an overnight shift; days that are
+            missing are days off. None means the agent is always available.
+    
+    Returns:
+        dict: weekday number (0 = Monday) -> (start, end) in minutes, or None
+    
+    Raises:
+        ValueError: If a day or time is malformed
+    """
+    if hours is None:
+        return None
+    parsed = {}
+    for day, shift in hours.items():
+        if str(day).lower()[:3] not in WEEKDAYS:
+            raise ValueError(f"Unknown weekday in working hours: {day}")
+        try:
+            start, end = (datetime.strptime(value, '%H:%M') for value in shift)
+        except (TypeError, ValueError):
+            raise ValueError(f"Working hours for {day} must be [\"HH:MM\", \"HH:MM\"]")
+        parsed[WEEKDAYS.index(str(day).lower()[:3])] = (start.hour * 60 + start.minute,
+                                                         end.hour * 60 + end.minute)
+    return parsed
+
+
+def is_on_duty(hours: Optional[Dict[int, Tuple[int, int]]], now: datetime) -> bool:
+    """Check whether parsed working hours include the given moment"""
+    if hours is None:
+        return True
+    minute = now.hour * 60 + now.minute
+    today = hours.get(now.weekday())
+    if today:
+        start, end = today
+        if start <= minute and (minute < end or end <= start):
+            return True
+    # The tail of yesterday's overnight shift
+    yesterday = hours.get((now.weekday() - 1) % 7)
+    return bool(yesterday and yesterday[1] <= yesterday[0] and minute < yesterday[1])
+
+
+def next_shift_start(hours: Optional[Dict[int, Tuple[int, int]]], now: datetime) -> Optional[datetime]:
+    """Get the start of the next shift after `now`, or None if the agent never works"""
+    if not hours:
+        return None
+    for offset in range(8):
+        day = now.date() + timedelta(days=offset)
+        shift = hours.get(day.weekday())
+        if shift:
+            start = datetime.combine(day, time(shift[0] // 60, shift[0] % 60))
+            if start > now:
+                return start
+    return None
+
+
+class LeadAssigner:
+    """
+    Least-loaded assignment of leads to agents
+    
+    Every available agent sits in a min-heap keyed by open leads / weight,
+    so picking an agent is a heap pop and push: O(log n) in the number of
+    agents. Loads change in place when leads are created, reassigned or
+    closed (observe()), using the last known agent and status of each open
+    lead, so nothing is recounted with queries. Heap entries are never
+    updated; a change pushes a fresh entry and the stale one is skipped
+    when it surfaces.
+    
+    Agents found off duty when popped are parked in a second heap ordered
+    by the start of their next shift and moved back once it begins, so an
+    agent costs O(log n) per shift change rather than per pick.
+    
+    A pick reserves a slot for its agent. The lead written with that agent
+    settles the reservation in observe() instead of counting twice;
+    release() returns it if the write fails.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+    
+    def _reset(self):
+        self._agents = {}
+        self._loads = Counter()
+        self._reserved = Counter()
+        self._open = {}
+        self._heap = []
+        self._waiting = []
+        self._parked = set()
+        self._version = {}
+        self._counter = 0
+        self.loaded_at = None
+    
+    def load(self, agents: Iterable[Dict[str, Any]], open_leads: Iterable[Tuple[Any, Any]]):
+        """
+        Replace all state with a fresh snapshot
+        
+        Args:
+            agents: Active agents with 'id' and optional 'assignment_weight'
+                and 'working_hours'
+            open_leads: (lead_id, agent_id) of every open assigned lead
+        """
+        with self._lock:
+            self._reset()
+            for lead_id, agent_id in open_leads:
+                self._open[str(lead_id)] = str(agent_id)
+                self._loads[str(agent_id)] += 1
+            for agent in agents:
+                self._set_agent(agent)
+            self.loaded_at = datetime.now()
+    
+    def set_agent(self, agent: Dict[str, Any]):
+        """Add or update an agent; inactive agents are removed"""
+        with self._lock:
+            self._set_agent(agent)
+    
+    def _set_agent(self, agent):
+        agent_id = str(agent['id'])
+        if agent.get('status', 'active') != 'active':
+            self._remove_agent(agent_id)
+            return
+        try:
+            hours = parse_working_hours(agent.get('working_hours'))
+        except ValueError as e:
+            logger.error(f"Agent {agent_id} has invalid working hours, treating as always available: {e}")
+            hours = None
+        weight = agent.get('assignment_weight')
+        self._agents[agent_id] = {
+            'weight': float(weight) if weight is not None else 1.0,
+            'hours': hours
+        }
+        self._parked.discard(agent_id)
+        self._push(agent_id)
+    
+    def remove_agent(self, agent_id):
+        """Stop assigning leads to an agent (its open leads keep counting)"""
+        with self._lock:
+            self._remove_agent(str(agent_id))
+    
+    def _remove_agent(self, agent_id):
+        self._agents.pop(agent_id, None)
+        self._parked.discard(agent_id)
+        self._version.pop(agent_id, None)
+    
+    def _push(self, agent_id):
+        agent = self._agents.get(agent_id)
+        if agent is None or agent['weight'] <= 0:
+            self._version.pop(agent_id, None)
+            return
+        self._counter += 1
+        self._version[agent_id] = self._counter
+        if agent_id in self._parked:
+            return
+        heapq.heappush(self._heap, (self._loads[agent_id] / agent['weight'], self._counter, agent_id))
+        if len(self._heap) > 4 * len(self._agents) + 64:
+            self._compact()
+    
+    def _compact(self):
+        self._heap = [(self._loads[agent_id] / self._agents[agent_id]['weight'], version, agent_id)
+                      for agent_id, version in self._version.items() if agent_id not in self._parked]
+        heapq.heapify(self._heap)
+    
+    def _change_load(self, agent_id, delta):
+        self._loads[agent_id] += delta
+        if self._loads[agent_id] <= 0:
+            del self._loads[agent_id]
+        if agent_id in self._agents:
+            self._push(agent_id)
+    
+    def pick_agent(self, now: Optional[datetime] = None) -> Optional[str]:
+        """
+        Reserve a lead slot with the least loaded agent on duty
+        
+        Args:
+            now (datetime, optional): Moment of assignment, defaults to now
+        
+        Returns:
+            str: Agent ID, or None if no agent is available
+        """
+        now = now or datetime.now()
+        with self._lock:
+            while self._waiting and self._waiting[0][0] <= now:
+                _, agent_id = heapq.heappop(self._waiting)
+                if agent_id in self._parked:
+                    self._parked.discard(agent_id)
+                    self._push(agent_id)
+            
+            while self._heap:
+                _, version, agent_id = heapq.heappop(self._heap)
+                if self._version.get(agent_id) != version:
+                    continue
+                hours = self._agents[agent_id]['hours']
+                if not is_on_duty(hours, now):
+                    self._parked.add(agent_id)
+                    start = next_shift_start(hours, now)
+                    if start is not None:
+                        heapq.heappush(self._waiting, (start, agent_id))
+                    continue
+                self._reserved[agent_id] += 1
+                self._change_load(agent_id, 1)
+                return agent_id
+            return None
+    
+    def release(self, agent_id, keep_load: bool = False):
+        """
+        Return a reservation whose lead was not written
+        
+        Args:
+            agent_id (str): Agent returned by pick_agent
+            keep_load (bool): The lead will still be written later (e.g. it
+                was queued), only drop the reservation
+        """
+        agent_id = str(agent_id)
+        with self._lock:
+            if self._reserved[agent_id] > 0:
+                self._reserved[agent_id] -= 1
+                if not keep_load:
+                    self._change_load(agent_id, -1)
+    
+    def observe(self, lead: Dict[str, Any]):
+        """
+        Account for a created or updated lead row
+        
+        Rows without both 'status' and 'agent_id' are ignored, as the new
+        state of the lead is unknown.
+        """
+        if lead is None or lead.get('id') is None or 'status' not in lead or 'agent_id' not in lead:
+            return
+        lead_id = str(lead['id'])
+        new_agent = str(lead['agent_id']) if is_open_lead(lead) else None
+        with self._lock:
+            old_agent = self._open.get(lead_id)
+            if old_agent == new_agent:
+                return
+            if old_agent is not None:
+                del self._open[lead_id]
+                self._change_load(old_agent, -1)
+            if new_agent is not None:
+                self._open[lead_id] = new_agent
+                if self._reserved[new_agent] > 0:
+                    self._reserved[new_agent] -= 1
+                else:
+                    self._change_load(new_agent, 1)
+    
+    def agent_of(self, lead_id) -> Optional[str]:
+        """Get the agent an open lead currently counts for"""
+        with self._lock:
+            return self._open.get(str(lead_id))
+    
+    def stats(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Get the load, weight and availability of every agent"""
+        now = now or datetime.now()
+        with self._lock:
+            agents = {
+                agent_id: {
+                    'open_leads': self._loads[agent_id],
+                    'weight': agent['weight'],
+                    'on_duty': is_on_duty(agent['hours'], now)
+                }
+                for agent_id, agent in self._agents.items()
+            }
+            return {
+                'agents': agents,
+                'open_leads': len(self._open),
+                'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None
+            }
@@ -0,0 +1,160 @@
+"""
+Lead duplicate detection for Crystal Bay Travel
+Normalizes contact fields into dedupe keys and clusters leads that share them
+"""
+
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+# Country code assumed for numbers written without one (Russia / Kazakhstan)
+DEFAULT_COUNTRY_CODE = os.environ.get('DEFAULT_PHONE_COUNTRY_CODE', '7')
+
+# Lead fields holding the normalized keys; indexed in every storage backend
+PHONE_KEY_FIELD = 'phone_e164'
+EMAIL_KEY_FIELD = 'email_normalized'
+
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def normalize_phone(phone: Any, default_country_code: str = DEFAULT_COUNTRY_CODE) -> Optional[str]:
+    """
+    Normalize a phone number to E.164 (+<country><number>)
+    
+    Handles the formats customers actually type: spaces, dashes and
+    brackets, a 00 international prefix, the Russian trunk prefix 8 and
+    ten-digit local numbers.
+    
+    Args:
+        phone: Raw phone value
+        default_country_code (str): Country code for numbers without one
+    
+    Returns:
+        str: E.164 number, or None if the value is not a phone number
+    """
+    if phone is None:
+        return None
+    raw = str(phone).strip()
+    digits = re.sub(r'\D', '', raw)
+    if not digits:
+        return None
+    
+    if raw.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif default_country_code == '7' and len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = default_country_code + digits
+    
+    if not 8 <= len(digits) <= 15 or digits[0] == '0':
+        return None
+    return '+' + digits
+
+
+def normalize_email(email: Any) -> Optional[str]:
+    """
+    Normalize an email address for comparison
+    
+    Returns:
+        str: Lower-cased address, or None if the value is not an email
+    """
+    if email is None:
+        return None
+    value = str(email).strip().lower()
+    return value if _EMAIL_RE.match(value) else None
+
+
+def contact_keys(lead: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Compute the dedupe key fields of a lead from its contact fields
+    
+    Returns:
+        dict: {PHONE_KEY_FIELD: str or None, EMAIL_KEY_FIELD: str or None}
+    """
+    return {
+        PHONE_KEY_FIELD: normalize_phone(lead.get('customer_phone')),
+        EMAIL_KEY_FIELD: normalize_email(lead.get('customer_email'))
+    }
+
+
+def contact_key_updates(fields: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Compute the key fields affected by a partial update
+    
+    Only keys whose contact field is present in `fields` are returned, so
+    an update of the phone does not clear the email key.
+    """
+    updates = {}
+    if 'customer_phone' in fields:
+        updates[PHONE_KEY_FIELD] = normalize_phone(fields['customer_phone'])
+    if 'customer_email' in fields:
+        updates[EMAIL_KEY_FIELD] = normalize_email(fields['customer_email'])
+    return updates
+
+
+def find_duplicate_clusters(leads: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Group leads that share a normalized phone or email
+    
+    Each lead is hashed on its keys in a single pass (a hash join of the
+    table with itself on phone and on email) and leads meeting on any key
+    are merged with union-find, so the cost is linear in the number of
+    leads instead of comparing every pair. Matching is transitive: A and C
+    end up together if A shares a phone with B and B an email with C.
+    
+    Args:
+        leads: Leads with 'id', 'created_at' and contact or key fields
+    
+    Returns:
+        list: Clusters of two or more leads, largest first:
+            {'canonical_id': oldest lead ID, 'duplicate_ids': [...], 'keys': [...]}
+    """
+    parent = {}
+    created = {}
+    first_by_key = {}
+    
+    def find(lead_id):
+        root = lead_id
+        while parent[root] != root:
+            root = parent[root]
+        while parent[lead_id] != root:
+            parent[lead_id], lead_id = root, parent[lead_id]
+        return root
+    
+    for lead in leads:
+        lead_id = str(lead['id'])
+        parent.setdefault(lead_id, lead_id)
+        created[lead_id] = lead.get('created_at') or ''
+        keys = contact_keys(lead)
+        for field, computed in keys.items():
+            key = lead.get(field) or computed
+            if not key:
+                continue
+            other = first_by_key.setdefault((field, key), lead_id)
+            if other != lead_id:
+                root_a, root_b = find(other), find(lead_id)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+    
+    members = {}
+    for lead_id in parent:
+        members.setdefault(find(lead_id), []).append(lead_id)
+    
+    keys_by_root = {}
+    for (field, key), lead_id in first_by_key.items():
+        keys_by_root.setdefault(find(lead_id), []).append(key)
+    
+    clusters = []
+    for root, lead_ids in members.items():
+        if len(lead_ids) < 2:
+            continue
+        lead_ids.sort(key=lambda lead_id: (created[lead_id], lead_id))
+        clusters.append({
+            'canonical_id': lead_ids[0],
+            'duplicate_ids': lead_ids[1:],
+            'keys': sorted(keys_by_root.get(root, []))
+        })
+    clusters.sort(key=lambda cluster: -len(cluster['duplicate_ids']))
+    return clusters
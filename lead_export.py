@@ -0,0 +1,89 @@
+"""
+Streaming writers for lead export
+Turn row iterators into CSV or NDJSON chunks without building the whole file in memory
+"""
+
+import io
+import csv
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def detect_export_format(requested: str = None, accept: str = None) -> str:
+    """Pick the export format from an explicit ?format= or the Accept header"""
+    if requested:
+        requested = requested.lower()
+        if requested in ('jsonl', 'json-lines'):
+            requested = 'ndjson'
+        if requested not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {requested}")
+        return requested
+    
+    accept = (accept or '').lower()
+    if 'text/csv' in accept:
+        return 'csv'
+    return 'ndjson'
+
+
+def _csv_value(value: Any) -> Any:
+    # Nested values (JSON columns) are written as JSON text
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+
+def iter_csv_chunks(rows: Iterable[Dict[str, Any]], fields: Optional[List[str]] = None,
+                    chunk_rows: int = 500) -> Iterator[str]:
+    """
+    Yield CSV text in chunks of `chunk_rows` records
+    
+    Args:
+        rows: Records to write
+        fields (list, optional): Column order; defaults to the keys of the
+            first record, later records' extra keys are dropped
+        chunk_rows (int): Records per yielded chunk
+    """
+    buffer = io.StringIO()
+    writer = None
+    pending = 0
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=fields or list(row), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow({key: _csv_value(value) for key, value in row.items()})
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    
+    if writer is None and fields:
+        csv.writer(buffer).writerow(fields)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson_chunks(rows: Iterable[Dict[str, Any]], chunk_rows: int = 500) -> Iterator[str]:
+    """Yield NDJSON text, one JSON object per line, in chunks of `chunk_rows` records"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False, default=str))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_export_chunks(rows: Iterable[Dict[str, Any]], export_format: str,
+                       fields: Optional[List[str]] = None) -> Iterator[str]:
+    """Yield export text for rows in the given format"""
+    if export_format == 'csv':
+        return iter_csv_chunks(rows, fields)
+    return iter_ndjson_chunks(rows)
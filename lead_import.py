@@ -0,0 +1,103 @@
+"""
+Streaming parsers for bulk lead import
+Turn CSV or NDJSON request bodies into lead rows without buffering the whole upload
+"""
+
+import csv
+import json
+import codecs
+import logging
+from typing import Dict, Iterator, List, Union
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+def detect_import_format(content_type: str, requested: str = None) -> str:
+    """Pick the import format from an explicit ?format= or the Content-Type"""
+    if requested:
+        requested = requested.lower()
+        if requested in ('jsonl', 'json-lines'):
+            requested = 'ndjson'
+        if requested not in IMPORT_FORMATS:
+            raise ValueError(f"Unsupported import format: {requested}")
+        return requested
+    
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl',
+                        'application/x-jsonlines'):
+        return 'ndjson'
+    raise ValueError("Unsupported Content-Type, use text/csv or application/x-ndjson")
+
+
+def _decode_lines(stream, errors: List[str]) -> Iterator[str]:
+    """Decode a binary stream line by line, noting lines that are not valid UTF-8 in `errors`"""
+    for number, raw in enumerate(stream, start=1):
+        if number == 1 and raw.startswith(codecs.BOM_UTF8):
+            raw = raw[len(codecs.BOM_UTF8):]
+        try:
+            yield raw.decode('utf-8')
+        except UnicodeDecodeError as e:
+            errors.append(f"Invalid UTF-8 on line {number}: {e.reason}")
+            yield raw.decode('utf-8', errors='replace')
+
+
+def iter_csv_rows(stream) -> Iterator[Union[Dict, Exception]]:
+    """
+    Yield one dict per CSV record, using the header row as field names
+    
+    Records that are malformed or not valid UTF-8 yield a ValueError and
+    reading goes on with the next record.
+    """
+    errors = []
+    reader = csv.reader(_decode_lines(stream, errors))
+    try:
+        header = next(reader, None)
+    except csv.Error as e:
+        errors.append(f"Invalid CSV header: {e}")
+    if errors:
+        yield ValueError(errors[0])
+        return
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            errors.append(f"Invalid CSV on line {reader.line_num}: {e}")
+            values = None
+        if errors:
+            yield ValueError(errors[0])
+            errors.clear()
+        elif values:
+            yield {key: value for key, value in zip(header, values) if key}
+
+
+def iter_ndjson_rows(stream) -> Iterator[Union[Dict, Exception]]:
+    """Yield one dict per NDJSON line; malformed or non-UTF-8 lines yield a ValueError"""
+    errors = []
+    for line in _decode_lines(stream, errors):
+        if errors:
+            yield ValueError(errors.pop())
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield ValueError(f"Invalid JSON: {e.msg}")
+
+
+def iter_import_rows(stream, import_format: str) -> Iterator[Union[Dict, Exception]]:
+    """Yield lead rows from a binary stream in the given format"""
+    if import_format == 'csv':
+        return iter_csv_rows(stream)
+    return iter_ndjson_rows(stream)
@@ -0,0 +1,158 @@
+"""
+Lead search for Crystal Bay Travel
+Trigram indexing shared by the pg_trgm search RPC and the in-process fallback index
+"""
+
+import re
+import heapq
+import math
+import threading
+from collections import Counter
+from itertools import chain
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+# Same default as pg_trgm.word_similarity_threshold (the <% operator)
+SIMILARITY_THRESHOLD = 0.6
+
+# Shorter queries have no full trigram and would match nearly every lead
+MIN_QUERY_LENGTH = 3
+
+_WORD_RE = re.compile(r'[^\W_]+', re.UNICODE)
+_PHONE_QUERY_RE = re.compile(r'^[\d\s()+\-.]+$')
+
+
+def lead_search_text(lead: Dict[str, Any]) -> str:
+    """
+    Build the searchable text of a lead
+    
+    Name, email and notes are lower-cased; the phone is added as digits
+    only so that fragments match however the number was formatted.
+    Must stay in sync with the search_text column in docs/SUPABASE_SCHEMA.md.
+    """
+    parts = [lead.get('customer_name'), lead.get('customer_email'), lead.get('notes')]
+    text = ' '.join(str(part) for part in parts if part)
+    phone_digits = re.sub(r'\D', '', str(lead.get('customer_phone') or ''))
+    return f'{text} {phone_digits}'.lower().strip()
+
+
+def normalize_search_query(query: str) -> str:
+    """Lower-case a query; phone-like queries are reduced to their digits"""
+    query = (query or '').strip()
+    if _PHONE_QUERY_RE.match(query) and re.search(r'\d', query):
+        return re.sub(r'\D', '', query)
+    return query.lower()
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Split text into trigrams the way pg_trgm does
+    
+    Each word is padded with two spaces in front and one behind, so short
+    words and word starts still produce trigrams.
+    """
+    result = set()
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f'  {word} '
+        for pos in range(len(padded) - 2):
+            result.add(padded[pos:pos + 3])
+    return result
+
+
+class TrigramIndex:
+    """
+    In-process inverted index from trigrams to document IDs
+    
+    A query is scored against a document by the share of the query's
+    trigrams the document contains (pg_trgm word similarity); an exact
+    substring match scores 1. Only the posting lists of the query's
+    trigrams are read: matches are counted in one pass over them, so the
+    cost depends on how common the query's trigrams are, not on the
+    number of indexed documents.
+    """
+    
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._texts = {}
+    
+    def __len__(self):
+        return len(self._texts)
+    
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._texts = {}
+    
+    def add(self, doc_id: Hashable, text: str):
+        """Index (or re-index) a document"""
+        with self._lock:
+            self._remove(doc_id)
+            self._texts[doc_id] = text
+            for trigram in trigrams(text):
+                self._postings.setdefault(trigram, set()).add(doc_id)
+    
+    def remove(self, doc_id: Hashable):
+        with self._lock:
+            self._remove(doc_id)
+    
+    def _remove(self, doc_id):
+        text = self._texts.pop(doc_id, None)
+        if text is None:
+            return
+        for trigram in trigrams(text):
+            posting = self._postings.get(trigram)
+            if posting is not None:
+                posting.discard(doc_id)
+                if not posting:
+                    del self._postings[trigram]
+    
+    def search(self, query: str, limit: int = 20,
+               tiebreak: Optional[Callable[[Hashable], Any]] = None) -> List[Tuple[Hashable, float]]:
+        """
+        Find the best matching documents
+        
+        Args:
+            query (str): Normalized search query
+            limit (int): Maximum number of results
+            tiebreak (callable, optional): doc_id -> sort key; among equal
+                scores, higher keys are kept and listed first
+        
+        Returns:
+            list: (doc_id, score) pairs, best first
+        """
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        
+        total = len(query_trigrams)
+        required = max(1, math.ceil(self.threshold * total))
+        # Trigrams of the query that do not depend on word boundaries; a
+        # document containing the query as a substring has all of them
+        inner = sum(1 for trigram in query_trigrams if ' ' not in trigram)
+        needed = min(required, inner) if inner else required
+        texts = self._texts
+        
+        with self._lock:
+            postings = sorted((self._postings.get(trigram, set()) for trigram in query_trigrams), key=len)
+            # A document with `needed` matches must be in one of the rarest
+            # lists; the common lists are only intersected with those
+            prefix = total - needed + 1
+            counts = Counter(chain.from_iterable(postings[:prefix]))
+            candidates = set(counts)
+            for posting in postings[prefix:]:
+                counts.update(candidates & posting)
+            
+            def score(item):
+                doc_id, shared = item
+                if shared >= inner and query in texts[doc_id]:
+                    return 1.0
+                return shared / total if shared >= required else 0.0
+            
+            # The tiebreak is part of the key, so it also decides which
+            # equally scored documents make the cut
+            rank = score if tiebreak is None else (lambda item: (score(item), tiebreak(item[0])))
+            best = heapq.nlargest(limit, counts.items(), key=rank)
+            results = [(doc_id, round(score((doc_id, shared)), 3)) for doc_id, shared in best]
+        
+        return [(doc_id, value) for doc_id, value in results if value > 0]
@@ -0,0 +1,102 @@
+"""
+Request-scoped batching loaders (DataLoader pattern)
+Collect the IDs a request needs and resolve each entity type with one query
+"""
+
+import logging
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchLoader:
+    """
+    Deduplicating batch loader for one entity type
+    
+    Keys are queued with prime() and resolved together by the batch function
+    on the next load()/load_many(); every key is fetched at most once per
+    loader, so repeated lookups within a request are free. Keys are
+    normalized with key_fn (str by default, matching the service methods).
+    """
+    
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Dict[Hashable, Any]],
+                 max_batch_size: int = 200, default: Any = None,
+                 key_fn: Callable[[Any], Hashable] = str):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.default = default
+        self.key_fn = key_fn
+        self._cache = {}
+        self._queue = {}
+    
+    def prime(self, keys: Iterable[Hashable]) -> 'BatchLoader':
+        """Queue keys to be fetched by the next dispatch"""
+        for key in keys:
+            if key is None:
+                continue
+            key = self.key_fn(key)
+            if key not in self._cache:
+                self._queue[key] = None
+        return self
+    
+    def dispatch(self):
+        """Resolve all queued keys with as few batch calls as possible"""
+        keys = list(self._queue)
+        self._queue.clear()
+        for start in range(0, len(keys), self.max_batch_size):
+            chunk = keys[start:start + self.max_batch_size]
+            try:
+                found = self.batch_fn(chunk) or {}
+            except Exception as e:
+                logger.error(f"Batch load failed for {len(chunk)} keys: {e}")
+                found = {}
+            for key in chunk:
+                self._cache[key] = found.get(key, self.default)
+    
+    def load(self, key: Hashable) -> Any:
+        """Get one value, dispatching the pending batch if needed"""
+        if key is None:
+            return self.default
+        key = self.key_fn(key)
+        if key not in self._cache:
+            self._queue[key] = None
+            self.dispatch()
+        return self._cache[key]
+    
+    def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        """Get values for many keys in one dispatch, in input order"""
+        keys = list(keys)
+        self.prime(keys)
+        if self._queue:
+            self.dispatch()
+        return [self._cache[self.key_fn(key)] if key is not None else self.default for key in keys]
+    
+    def clear(self, key: Optional[Hashable] = None):
+        """Forget cached values (e.g. after a write within the same request)"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(self.key_fn(key), None)
+
+
+class RequestLoaders:
+    """The set of loaders used during one request"""
+    
+    def __init__(self):
+        from models import LeadService, AgentService, AIAgentService
+        
+        self.leads = BatchLoader(lambda ids: LeadService.get_leads_by_ids(ids, view='card'))
+        self.agents = BatchLoader(lambda ids: AgentService.get_agents_by_ids(ids, view='card'))
+        self.ai_agents = BatchLoader(AIAgentService.get_ai_agents_by_ids)
+        self.interactions = BatchLoader(LeadService.get_interactions_for_leads, default=[])
+
+
+def get_loaders() -> RequestLoaders:
+    """Get the loaders of the current Flask request (a fresh set outside a request)"""
+    from flask import g, has_request_context
+    
+    if not has_request_context():
+        return RequestLoaders()
+    if 'loaders' not in g:
+        g.loaders = RequestLoaders()
+    return g.loaders
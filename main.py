@@ -58,18 +58,30 @@ def dashboard_data():
         try:
             from models import LeadService
             lead_service = LeadService()
-            leads = lead_service.get_leads(limit=10)
+            leads = lead_service.get_leads(limit=10, view='full')
             logger.info(f"Dashboard loaded {len(leads)} leads")
         except Exception as ex:
             logger.warning(f"Database error: {ex}")
             leads = []
         
-        lead_stats = {
-            'total': len(leads),
-            'new': len([l for l in leads if l.get('status') == 'new']),
-            'contacted': len([l for l in leads if l.get('status') == 'contacted']),
-            'qualified': len([l for l in leads if l.get('status') == 'qualified'])
-        }
+        # Counts are aggregated over all leads, not just the page shown
+        lead_stats = {'total': 0, 'new': 0, 'contacted': 0, 'qualified': 0}
+        try:
+            from models import LeadStatsService
+            grouped = LeadStatsService.get_lead_stats()
+            by_status = grouped.get('by_status', {})
+            lead_stats = {
+                'total': grouped.get('total', 0),
+                'new': by_status.get('new', 0),
+                'contacted': by_status.get('contacted', 0),
+                'qualified': by_status.get('qualified', 0),
+                'by_status': by_status,
+                'by_source': grouped.get('by_source', {}),
+                'by_agent': grouped.get('by_agent', {}),
+                'by_day': grouped.get('by_day', {})
+            }
+        except Exception as ex:
+            logger.warning(f"Lead stats error: {ex}")
         
         return render_template('dashboard.html', 
                              leads=leads[:10], 
@@ -0,0 +1,387 @@
+"""
+Messaging schema for Crystal Bay Travel
+Versioned migrations for the conversations and chat_messages tables, and a query-plan benchmark for them
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = 'messaging_schema_migrations'
+
+# Serializes migrations between gunicorn workers starting at the same time
+MIGRATION_LOCK_ID = 74210048
+
+# Recompute the maintained unread counters from chat_messages; run by
+# migration 3 and safe to run again if the counters ever drift
+REBUILD_UNREAD_COUNTERS = [
+    'UPDATE conversations SET unread_count = 0 WHERE unread_count <> 0',
+    '''
+    UPDATE conversations c SET unread_count = u.unread
+    FROM (
+        SELECT conversation_id, COUNT(*) AS unread FROM chat_messages
+        WHERE read_at IS NULL AND direction = 'in'
+        GROUP BY conversation_id
+    ) u
+    WHERE c.id = u.conversation_id
+    ''',
+    'DELETE FROM messaging_channel_counters',
+    '''
+    INSERT INTO messaging_channel_counters (channel, unread_count)
+    SELECT channel, COUNT(*) FROM chat_messages
+    WHERE read_at IS NULL AND direction = 'in'
+    GROUP BY channel
+    '''
+]
+
+# (version, name, statements) in order. Applied migrations are never
+# edited; schema changes go into a new version.
+MIGRATIONS = [
+    (1, 'create messaging tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS conversations (
+            id VARCHAR(255) PRIMARY KEY,
+            lead_id VARCHAR(255),
+            channel VARCHAR(50) NOT NULL,
+            external_chat_id VARCHAR(255),
+            participant_name VARCHAR(255),
+            participant_phone VARCHAR(100),
+            status VARCHAR(50) DEFAULT 'active',
+            last_message_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            metadata JSONB DEFAULT '{}'
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id VARCHAR(255) PRIMARY KEY,
+            conversation_id VARCHAR(255),
+            channel VARCHAR(50) NOT NULL,
+            external_message_id VARCHAR(255),
+            direction VARCHAR(10) NOT NULL,
+            sender_type VARCHAR(20) DEFAULT 'customer',
+            sender_id VARCHAR(255),
+            sender_name VARCHAR(255),
+            message_type VARCHAR(50) DEFAULT 'text',
+            content TEXT,
+            media_url TEXT,
+            media_type VARCHAR(50),
+            status VARCHAR(50) DEFAULT 'sent',
+            read_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            metadata JSONB DEFAULT '{}'
+        )
+        '''
+    ]),
+    (2, 'indexes for conversation lookup, message history and unread counts', [
+        # Duplicate chats were possible before the unique constraint; keep
+        # the newest one (the one find_conversation returned) and move the
+        # messages of the others onto it
+        '''
+        WITH ranked AS (
+            SELECT id, FIRST_VALUE(id) OVER (
+                       PARTITION BY channel, external_chat_id
+                       ORDER BY COALESCE(created_at, '-infinity') DESC, id DESC
+                   ) AS keep_id
+            FROM conversations
+            WHERE external_chat_id IS NOT NULL
+        )
+        UPDATE chat_messages m SET conversation_id = ranked.keep_id
+        FROM ranked
+        WHERE m.conversation_id = ranked.id AND ranked.id <> ranked.keep_id
+        ''',
+        '''
+        DELETE FROM conversations c
+        USING conversations newer
+        WHERE c.channel = newer.channel
+          AND c.external_chat_id = newer.external_chat_id
+          AND (COALESCE(newer.created_at, '-infinity'), newer.id) > (COALESCE(c.created_at, '-infinity'), c.id)
+        ''',
+        '''
+        ALTER TABLE conversations
+        ADD CONSTRAINT conversations_channel_external_chat_key UNIQUE (channel, external_chat_id)
+        ''',
+        # get_conversations, with and without a channel
+        'CREATE INDEX IF NOT EXISTS conversations_last_message_idx ON conversations (last_message_at DESC)',
+        '''
+        CREATE INDEX IF NOT EXISTS conversations_channel_last_message_idx
+        ON conversations (channel, last_message_at DESC)
+        ''',
+        # get_messages
+        '''
+        CREATE INDEX IF NOT EXISTS chat_messages_conversation_created_idx
+        ON chat_messages (conversation_id, created_at DESC)
+        ''',
+        # get_unread_count: only unread incoming messages are indexed
+        '''
+        CREATE INDEX IF NOT EXISTS chat_messages_unread_idx
+        ON chat_messages (channel)
+        WHERE read_at IS NULL AND direction = 'in'
+        '''
+    ]),
+    (3, 'maintained unread counters per conversation and channel', [
+        'ALTER TABLE conversations ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0',
+        '''
+        CREATE TABLE IF NOT EXISTS messaging_channel_counters (
+            channel VARCHAR(50) PRIMARY KEY,
+            unread_count BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+        *REBUILD_UNREAD_COUNTERS
+    ])
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def applied_versions(cursor) -> List[int]:
+    """Get the migration versions recorded in the database"""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute(f'SELECT version FROM {MIGRATIONS_TABLE} ORDER BY version')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def apply_migrations(conn, target: Optional[int] = None) -> List[int]:
+    """
+    Apply pending migrations, each in its own transaction
+    
+    Args:
+        conn: psycopg2 connection (not in autocommit mode)
+        target (int, optional): Stop after this version, defaults to the latest
+    
+    Returns:
+        list: Versions applied by this call
+    
+    Raises:
+        psycopg2.Error: If a migration fails; it is rolled back and later
+            migrations are not attempted
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version > target:
+            break
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+            if version in applied_versions(cursor):
+                conn.commit()
+                continue
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(f'INSERT INTO {MIGRATIONS_TABLE} (version, name) VALUES (%s, %s)', (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        logger.info(f"Messaging schema migrated to version {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+# The queries MessageStore runs on every messaging page load, with
+# parameters that hit the middle of the benchmark data
+HOT_QUERIES = {
+    'find_conversation': '''
+        SELECT id FROM conversations
+        WHERE channel = %(channel)s AND external_chat_id = %(chat_id)s
+        ORDER BY created_at DESC LIMIT 1
+    ''',
+    'get_conversations': '''
+        SELECT id FROM conversations WHERE channel = %(channel)s
+        ORDER BY last_message_at DESC LIMIT 50
+    ''',
+    'get_messages': '''
+        SELECT id, content, created_at FROM chat_messages WHERE conversation_id = %(conversation_id)s
+        ORDER BY created_at DESC LIMIT 50
+    ''',
+    # What get_unread_count ran before version 3
+    'count_unread': '''
+        SELECT COUNT(*) FROM chat_messages
+        WHERE read_at IS NULL AND direction = 'in' AND channel = %(channel)s
+    '''
+}
+
+# Hot queries that only exist from the latest schema on
+LATEST_HOT_QUERIES = {
+    'get_unread_count': '''
+        SELECT unread_count FROM messaging_channel_counters WHERE channel = %(channel)s
+    '''
+}
+
+_BENCHMARK_DATA = [
+    '''
+    INSERT INTO conversations (id, channel, external_chat_id, participant_name, last_message_at, created_at)
+    SELECT 'conv_' || g, (ARRAY['telegram', 'whatsapp', 'wazzup'])[1 + g %% 3], 'chat_' || g,
+           'Customer ' || g, now() - g * interval '1 minute', now() - g * interval '1 minute'
+    FROM generate_series(1, %(conversations)s) g
+    ''',
+    # Incoming and outgoing messages alternate; the last two of every
+    # conversation are unread
+    '''
+    INSERT INTO chat_messages (id, conversation_id, channel, direction, content, read_at, created_at)
+    SELECT 'msg_' || c || '_' || m, 'conv_' || c, (ARRAY['telegram', 'whatsapp', 'wazzup'])[1 + c %% 3],
+           (ARRAY['in', 'out'])[1 + m %% 2], 'Message ' || m,
+           CASE WHEN m <= %(messages)s - 2 THEN now() END,
+           now() - (c * %(messages)s - m) * interval '1 second'
+    FROM generate_series(1, %(conversations)s) c, generate_series(1, %(messages)s) m
+    '''
+]
+
+
+def _scan_nodes(plan: Dict[str, Any]) -> List[str]:
+    nodes = []
+    if 'Relation Name' in plan:
+        index = plan.get('Index Name')
+        nodes.append(f"{plan['Node Type']} on {plan['Relation Name']}" + (f" using {index}" if index else ''))
+    elif 'Index Name' in plan:
+        # Bitmap index scans name only the index
+        nodes.append(f"{plan['Node Type']} using {plan['Index Name']}")
+    for child in plan.get('Plans', []):
+        nodes.extend(_scan_nodes(child))
+    return nodes
+
+
+def explain_hot_queries(cursor, params: Dict[str, Any], runs: int = 5,
+                        queries: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Run EXPLAIN ANALYZE on every hot query
+    
+    Args:
+        cursor: psycopg2 cursor
+        params (dict): Query parameters
+        runs (int): Runs per query; the fastest is reported
+        queries (dict, optional): name -> SQL, defaults to HOT_QUERIES
+    
+    Returns:
+        dict: query name -> {'scans': [...], 'execution_ms': best of `runs`,
+            'shared_buffers': buffers touched by that run}
+    """
+    results = {}
+    for name, sql in (HOT_QUERIES if queries is None else queries).items():
+        best = None
+        for _ in range(runs):
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+            if best is None or plan['Execution Time'] < best['Execution Time']:
+                best = plan
+        root = best['Plan']
+        results[name] = {
+            'scans': _scan_nodes(root),
+            'execution_ms': round(best['Execution Time'], 3),
+            'shared_buffers': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+        }
+    return results
+
+
+def benchmark(dsn: str, conversations: int = 10000, messages: int = 20) -> Dict[str, Any]:
+    """
+    Compare query plans before and after the index migration
+    
+    Builds the version 1 schema in a throwaway PostgreSQL schema, fills it
+    with synthetic conversations, explains the hot queries, applies the
+    remaining migrations and explains them again. Nothing outside the
+    throwaway schema is touched.
+    
+    Args:
+        dsn (str): PostgreSQL connection string
+        conversations (int): Conversations to generate
+        messages (int): Messages per conversation
+    
+    Returns:
+        dict: {'rows', 'before', 'after'} with explain_hot_queries() results
+    """
+    import psycopg2
+    schema = f'messaging_benchmark_{os.getpid()}'
+    params = {
+        'channel': 'whatsapp',
+        'chat_id': f'chat_{conversations // 2 + 1}',
+        'conversation_id': f'conv_{conversations // 2}'
+    }
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'CREATE SCHEMA {schema}')
+        cursor.execute(f'SET search_path TO {schema}')
+        conn.commit()
+        apply_migrations(conn, target=1)
+        for statement in _BENCHMARK_DATA:
+            cursor.execute(statement, {'conversations': conversations, 'messages': messages})
+        conn.commit()
+        cursor.execute('ANALYZE')
+        before = explain_hot_queries(cursor, params)
+        conn.commit()
+        
+        apply_migrations(conn)
+        cursor.execute('ANALYZE')
+        after = explain_hot_queries(cursor, params, queries={**HOT_QUERIES, **LATEST_HOT_QUERIES})
+        conn.commit()
+        return {
+            'rows': {'conversations': conversations, 'chat_messages': conversations * messages},
+            'before': before,
+            'after': after
+        }
+    finally:
+        conn.rollback()
+        conn.cursor().execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        conn.commit()
+        conn.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Messaging schema migrations')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help='apply pending migrations to DATABASE_URL')
+    commands.add_parser('rebuild-unread', help='recompute the unread counters from chat_messages')
+    bench = commands.add_parser('benchmark', help='explain the hot queries before and after the indexes')
+    bench.add_argument('--conversations', type=int, default=10000)
+    bench.add_argument('--messages', type=int, default=20, help='messages per conversation')
+    args = parser.parse_args(argv)
+    
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        print('DATABASE_URL is not set', file=sys.stderr)
+        return 1
+    if args.command == 'migrate':
+        import psycopg2
+        conn = psycopg2.connect(dsn)
+        try:
+            applied = apply_migrations(conn)
+        finally:
+            conn.close()
+        print(json.dumps({'applied': applied, 'version': LATEST_VERSION}))
+    elif args.command == 'rebuild-unread':
+        import psycopg2
+        conn = psycopg2.connect(dsn)
+        try:
+            cursor = conn.cursor()
+            # Blocks message writes while recounting, so nothing is missed
+            cursor.execute('LOCK TABLE chat_messages IN SHARE MODE')
+            for statement in REBUILD_UNREAD_COUNTERS:
+                cursor.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+        print(json.dumps({'rebuilt': True}))
+    else:
+        print(json.dumps(benchmark(dsn, args.conversations, args.messages), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
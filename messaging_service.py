@@ -6,103 +6,85 @@ Handles Telegram, WhatsApp (via Wazzup24), and other messaging channels
 import os
 import json
 import logging
+import threading
 import requests
+from collections import Counter
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 
+from caching import MISSING, TTLCache
+from pg_pool import PostgresPool
+from messaging_schema import apply_migrations
+
 logger = logging.getLogger(__name__)
 
 class MessageStore:
     """In-memory message store with PostgreSQL persistence"""
     
+    POOL_MIN = int(os.environ.get('MESSAGE_DB_POOL_MIN', '1'))
+    POOL_MAX = int(os.environ.get('MESSAGE_DB_POOL_MAX', '10'))
+    POOL_TIMEOUT = float(os.environ.get('MESSAGE_DB_POOL_TIMEOUT', '5'))
+    POOL_PING_AFTER = float(os.environ.get('MESSAGE_DB_POOL_PING_AFTER', '30'))
+    POOL_RETRY_SECONDS = float(os.environ.get('MESSAGE_DB_POOL_RETRY_SECONDS', '5'))
+    STATS_CACHE_TTL = float(os.environ.get('MESSAGE_STATS_CACHE_TTL', '10'))
+    
     def __init__(self):
         self.conversations = {}
         self.messages = {}
-        self.db = None
+        # Unread incoming message IDs per conversation and counts per
+        # channel, kept in step with self.messages for memory mode
+        self._unread_ids = {}
+        self._unread = Counter()
+        self._lock = threading.Lock()
+        # Writes in this worker clear it; other workers' writes show up
+        # within the TTL
+        self._stats_cache = TTLCache(ttl=self.STATS_CACHE_TTL, maxsize=1)
+        self.pool = None
         self._init_db()
     
     def _init_db(self):
-        """Initialize database connection"""
+        """Initialize the database connection pool"""
+        database_url = os.environ.get('DATABASE_URL')
+        if not database_url:
+            return
         try:
             import psycopg2
-            database_url = os.environ.get('DATABASE_URL')
-            if database_url:
-                self.db = psycopg2.connect(database_url)
-                self._create_tables()
-                logger.info("MessageStore: Database connection established")
-        except Exception as e:
+        except ImportError as e:
             logger.warning(f"MessageStore: Using memory storage - {e}")
-    
-    def _ensure_connection(self):
-        """Ensure database connection is alive, reconnect if needed"""
-        if not self.db:
-            return False
+            return
+        
+        # Migrations are (re)checked whenever the pool recovers, so a database
+        # that was down at startup is picked up once it is reachable
+        self.pool = PostgresPool(database_url, self.POOL_MIN, self.POOL_MAX, self.POOL_TIMEOUT,
+                                 ping_after=self.POOL_PING_AFTER, retry_interval=self.POOL_RETRY_SECONDS,
+                                 on_reconnect=self._migrate_schema)
         try:
-            cursor = self.db.cursor()
-            cursor.execute("SELECT 1")
-            cursor.close()
-            return True
+            self.pool.open()
+            self._migrate_schema()
+            logger.info("MessageStore: Database connection pool established")
         except Exception as e:
-            logger.warning(f"MessageStore: Reconnecting - {e}")
-            try:
-                import psycopg2
-                database_url = os.environ.get('DATABASE_URL')
-                if database_url:
-                    self.db = psycopg2.connect(database_url)
-                    return True
-            except Exception as e2:
-                logger.error(f"MessageStore: Reconnection failed - {e2}")
-                self.db = None
-                return False
-    
-    def _create_tables(self):
-        """Create messaging tables if they don't exist"""
-        if not self.db:
+            logger.warning(f"MessageStore: Using memory storage until the database is reachable - {e}")
+    
+    def _use_db(self) -> bool:
+        # While the pool reconnects in the background, skip it rather than fail every call
+        return self.pool is not None and self.pool.available
+    
+    def pool_stats(self) -> Dict:
+        """Get connection pool metrics, or None when using memory storage"""
+        return self.pool.stats() if self.pool else None
+    
+    def _migrate_schema(self):
+        """Bring the messaging tables up to the latest schema version"""
+        if not self.pool:
             return
         
         try:
-            cursor = self.db.cursor()
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id VARCHAR(255) PRIMARY KEY,
-                    lead_id VARCHAR(255),
-                    channel VARCHAR(50) NOT NULL,
-                    external_chat_id VARCHAR(255),
-                    participant_name VARCHAR(255),
-                    participant_phone VARCHAR(100),
-                    status VARCHAR(50) DEFAULT 'active',
-                    last_message_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata JSONB DEFAULT '{}'
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS chat_messages (
-                    id VARCHAR(255) PRIMARY KEY,
-                    conversation_id VARCHAR(255),
-                    channel VARCHAR(50) NOT NULL,
-                    external_message_id VARCHAR(255),
-                    direction VARCHAR(10) NOT NULL,
-                    sender_type VARCHAR(20) DEFAULT 'customer',
-                    sender_id VARCHAR(255),
-                    sender_name VARCHAR(255),
-                    message_type VARCHAR(50) DEFAULT 'text',
-                    content TEXT,
-                    media_url TEXT,
-                    media_type VARCHAR(50),
-                    status VARCHAR(50) DEFAULT 'sent',
-                    read_at TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata JSONB DEFAULT '{}'
-                )
-            ''')
-            
-            self.db.commit()
-            logger.info("MessageStore: Tables created successfully")
+            with self.pool.connection() as conn:
+                applied = apply_migrations(conn)
+            if applied:
+                logger.info(f"MessageStore: Applied schema migrations {applied}")
         except Exception as e:
-            logger.error(f"MessageStore: Error creating tables - {e}")
+            logger.error(f"MessageStore: Error migrating tables - {e}")
     
     def _generate_id(self, prefix='msg'):
         import time
@@ -122,50 +104,61 @@ class MessageStore:
             'status': 'active',
             'last_message_at': datetime.now().isoformat(),
             'created_at': datetime.now().isoformat(),
-            'metadata': data.get('metadata', {})
+            'metadata': data.get('metadata', {}),
+            'unread_count': 0
         }
         
-        if self.db:
+        if self._use_db():
             try:
-                cursor = self.db.cursor()
-                cursor.execute('''
-                    INSERT INTO conversations (id, lead_id, channel, external_chat_id, participant_name, 
-                                             participant_phone, status, last_message_at, created_at, metadata)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (conversation['id'], conversation['lead_id'], conversation['channel'],
-                      conversation['external_chat_id'], conversation['participant_name'],
-                      conversation['participant_phone'], conversation['status'],
-                      conversation['last_message_at'], conversation['created_at'],
-                      json.dumps(conversation['metadata'])))
-                self.db.commit()
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    # A concurrent request may have created the same chat
+                    # first; reuse its row instead of failing the insert
+                    cursor.execute('''
+                        INSERT INTO conversations (id, lead_id, channel, external_chat_id, participant_name, 
+                                                 participant_phone, status, last_message_at, created_at, metadata)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (channel, external_chat_id)
+                        DO UPDATE SET last_message_at = conversations.last_message_at
+                        RETURNING id
+                    ''', (conversation['id'], conversation['lead_id'], conversation['channel'],
+                          conversation['external_chat_id'], conversation['participant_name'],
+                          conversation['participant_phone'], conversation['status'],
+                          conversation['last_message_at'], conversation['created_at'],
+                          json.dumps(conversation['metadata'])))
+                    conv_id = conversation['id'] = cursor.fetchone()[0]
             except Exception as e:
                 logger.error(f"Error saving conversation: {e}")
         
         self.conversations[conv_id] = conversation
+        self._stats_cache.clear()
         return conversation
     
     def find_conversation(self, channel: str, external_chat_id: str) -> Optional[Dict]:
         """Find conversation by channel and external chat ID"""
-        if self.db:
+        if self._use_db():
             try:
-                cursor = self.db.cursor()
-                cursor.execute('''
-                    SELECT id, lead_id, channel, external_chat_id, participant_name, 
-                           participant_phone, status, last_message_at, created_at, metadata
-                    FROM conversations 
-                    WHERE channel = %s AND external_chat_id = %s 
-                    ORDER BY created_at DESC LIMIT 1
-                ''', (channel, external_chat_id))
-                row = cursor.fetchone()
-                if row:
-                    return {
-                        'id': row[0], 'lead_id': row[1], 'channel': row[2],
-                        'external_chat_id': row[3], 'participant_name': row[4],
-                        'participant_phone': row[5], 'status': row[6],
-                        'last_message_at': row[7].isoformat() if row[7] else None,
-                        'created_at': row[8].isoformat() if row[8] else None,
-                        'metadata': row[9] if row[9] else {}
-                    }
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        SELECT id, lead_id, channel, external_chat_id, participant_name, 
+                               participant_phone, status, last_message_at, created_at, metadata,
+                               unread_count
+                        FROM conversations 
+                        WHERE channel = %s AND external_chat_id = %s 
+                        ORDER BY created_at DESC LIMIT 1
+                    ''', (channel, external_chat_id))
+                    row = cursor.fetchone()
+                    if row:
+                        return {
+                            'id': row[0], 'lead_id': row[1], 'channel': row[2],
+                            'external_chat_id': row[3], 'participant_name': row[4],
+                            'participant_phone': row[5], 'status': row[6],
+                            'last_message_at': row[7].isoformat() if row[7] else None,
+                            'created_at': row[8].isoformat() if row[8] else None,
+                            'metadata': row[9] if row[9] else {},
+                            'unread_count': row[10]
+                        }
             except Exception as e:
                 logger.error(f"Error finding conversation: {e}")
         
@@ -176,32 +169,36 @@ class MessageStore:
     
     def get_conversations(self, channel: str = None, limit: int = 50) -> List[Dict]:
         """Get all conversations optionally filtered by channel"""
-        if self.db and self._ensure_connection():
+        if self._use_db():
             try:
-                cursor = self.db.cursor()
-                if channel:
-                    cursor.execute('''
-                        SELECT id, lead_id, channel, external_chat_id, participant_name, 
-                               participant_phone, status, last_message_at, created_at, metadata
-                        FROM conversations WHERE channel = %s
-                        ORDER BY last_message_at DESC LIMIT %s
-                    ''', (channel, limit))
-                else:
-                    cursor.execute('''
-                        SELECT id, lead_id, channel, external_chat_id, participant_name, 
-                               participant_phone, status, last_message_at, created_at, metadata
-                        FROM conversations ORDER BY last_message_at DESC LIMIT %s
-                    ''', (limit,))
-                
-                rows = cursor.fetchall()
-                return [{
-                    'id': row[0], 'lead_id': row[1], 'channel': row[2],
-                    'external_chat_id': row[3], 'participant_name': row[4],
-                    'participant_phone': row[5], 'status': row[6],
-                    'last_message_at': row[7].isoformat() if row[7] else None,
-                    'created_at': row[8].isoformat() if row[8] else None,
-                    'metadata': row[9] if row[9] else {}
-                } for row in rows]
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    if channel:
+                        cursor.execute('''
+                            SELECT id, lead_id, channel, external_chat_id, participant_name, 
+                                   participant_phone, status, last_message_at, created_at, metadata,
+                                   unread_count
+                            FROM conversations WHERE channel = %s
+                            ORDER BY last_message_at DESC LIMIT %s
+                        ''', (channel, limit))
+                    else:
+                        cursor.execute('''
+                            SELECT id, lead_id, channel, external_chat_id, participant_name, 
+                                   participant_phone, status, last_message_at, created_at, metadata,
+                                   unread_count
+                            FROM conversations ORDER BY last_message_at DESC LIMIT %s
+                        ''', (limit,))
+                    
+                    rows = cursor.fetchall()
+                    return [{
+                        'id': row[0], 'lead_id': row[1], 'channel': row[2],
+                        'external_chat_id': row[3], 'participant_name': row[4],
+                        'participant_phone': row[5], 'status': row[6],
+                        'last_message_at': row[7].isoformat() if row[7] else None,
+                        'created_at': row[8].isoformat() if row[8] else None,
+                        'metadata': row[9] if row[9] else {},
+                        'unread_count': row[10]
+                    } for row in rows]
             except Exception as e:
                 logger.error(f"Error getting conversations: {e}")
         
@@ -232,84 +229,195 @@ class MessageStore:
             'metadata': data.get('metadata', {})
         }
         
-        if self.db:
+        unread = 1 if message['direction'] == 'in' else 0
+        if self._use_db():
             try:
-                cursor = self.db.cursor()
-                cursor.execute('''
-                    INSERT INTO chat_messages (id, conversation_id, channel, external_message_id, direction,
-                                              sender_type, sender_id, sender_name, message_type, content,
-                                              media_url, media_type, status, created_at, metadata)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (message['id'], message['conversation_id'], message['channel'],
-                      message['external_message_id'], message['direction'], message['sender_type'],
-                      message['sender_id'], message['sender_name'], message['message_type'],
-                      message['content'], message['media_url'], message['media_type'],
-                      message['status'], message['created_at'], json.dumps(message['metadata'])))
-                
-                cursor.execute('''
-                    UPDATE conversations SET last_message_at = %s WHERE id = %s
-                ''', (message['created_at'], message['conversation_id']))
-                
-                self.db.commit()
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        INSERT INTO chat_messages (id, conversation_id, channel, external_message_id, direction,
+                                                  sender_type, sender_id, sender_name, message_type, content,
+                                                  media_url, media_type, status, created_at, metadata)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ''', (message['id'], message['conversation_id'], message['channel'],
+                          message['external_message_id'], message['direction'], message['sender_type'],
+                          message['sender_id'], message['sender_name'], message['message_type'],
+                          message['content'], message['media_url'], message['media_type'],
+                          message['status'], message['created_at'], json.dumps(message['metadata'])))
+                    
+                    # Counters change in the same transaction as the message,
+                    # conversation row first (the order mark_read locks in)
+                    cursor.execute('''
+                        UPDATE conversations SET last_message_at = %s, unread_count = unread_count + %s
+                        WHERE id = %s
+                    ''', (message['created_at'], unread, message['conversation_id']))
+                    if unread:
+                        cursor.execute('''
+                            INSERT INTO messaging_channel_counters (channel, unread_count) VALUES (%s, 1)
+                            ON CONFLICT (channel)
+                            DO UPDATE SET unread_count = messaging_channel_counters.unread_count + 1
+                        ''', (message['channel'],))
             except Exception as e:
                 logger.error(f"Error saving message: {e}")
         
         self.messages[msg_id] = message
+        self._stats_cache.clear()
+        if unread:
+            with self._lock:
+                unread_ids = self._unread_ids.setdefault(message['conversation_id'], set())
+                unread_ids.add(msg_id)
+                self._unread[message['channel']] += 1
+                conversation = self.conversations.get(message['conversation_id'])
+                if conversation is not None:
+                    conversation['unread_count'] = len(unread_ids)
         return message
     
+    def mark_read(self, conversation_id: str) -> int:
+        """
+        Mark every unread incoming message of a conversation as read
+        
+        Returns:
+            int: Number of messages marked
+        """
+        read_at = datetime.now().isoformat()
+        self._stats_cache.clear()
+        if self._use_db():
+            try:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    # Locking the conversation first orders this against
+                    # create_message, so a message written meanwhile is
+                    # either marked here or counted after
+                    cursor.execute('SELECT id FROM conversations WHERE id = %s FOR UPDATE', (conversation_id,))
+                    cursor.execute('''
+                        WITH marked AS (
+                            UPDATE chat_messages SET read_at = %s
+                            WHERE conversation_id = %s AND read_at IS NULL AND direction = 'in'
+                            RETURNING channel
+                        ), per_channel AS (
+                            SELECT channel, COUNT(*) AS marked FROM marked GROUP BY channel
+                        ), channels AS (
+                            UPDATE messaging_channel_counters c
+                            SET unread_count = GREATEST(c.unread_count - p.marked, 0)
+                            FROM per_channel p WHERE c.channel = p.channel
+                        )
+                        SELECT COALESCE(SUM(marked), 0) FROM per_channel
+                    ''', (read_at, conversation_id))
+                    marked = int(cursor.fetchone()[0])
+                    if marked:
+                        cursor.execute('''
+                            UPDATE conversations SET unread_count = GREATEST(unread_count - %s, 0) WHERE id = %s
+                        ''', (marked, conversation_id))
+                self._mark_read_memory(conversation_id, read_at)
+                return marked
+            except Exception as e:
+                logger.error(f"Error marking messages read: {e}")
+        
+        return self._mark_read_memory(conversation_id, read_at)
+    
+    def _mark_read_memory(self, conversation_id, read_at) -> int:
+        with self._lock:
+            unread_ids = self._unread_ids.pop(conversation_id, set())
+            for msg_id in unread_ids:
+                message = self.messages[msg_id]
+                message['read_at'] = read_at
+                self._unread[message['channel']] -= 1
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                conversation['unread_count'] = 0
+            return len(unread_ids)
+    
     def get_messages(self, conversation_id: str, limit: int = 50) -> List[Dict]:
         """Get messages for a conversation"""
-        if self.db and self._ensure_connection():
+        if self._use_db():
             try:
-                cursor = self.db.cursor()
-                cursor.execute('''
-                    SELECT id, conversation_id, channel, external_message_id, direction,
-                           sender_type, sender_id, sender_name, message_type, content,
-                           media_url, media_type, status, read_at, created_at, metadata
-                    FROM chat_messages WHERE conversation_id = %s
-                    ORDER BY created_at DESC LIMIT %s
-                ''', (conversation_id, limit))
-                
-                rows = cursor.fetchall()
-                return [{
-                    'id': row[0], 'conversation_id': row[1], 'channel': row[2],
-                    'external_message_id': row[3], 'direction': row[4],
-                    'sender_type': row[5], 'sender_id': row[6], 'sender_name': row[7],
-                    'message_type': row[8], 'content': row[9], 'media_url': row[10],
-                    'media_type': row[11], 'status': row[12],
-                    'read_at': row[13].isoformat() if row[13] else None,
-                    'created_at': row[14].isoformat() if row[14] else None,
-                    'metadata': row[15] if row[15] else {}
-                } for row in rows]
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        SELECT id, conversation_id, channel, external_message_id, direction,
+                               sender_type, sender_id, sender_name, message_type, content,
+                               media_url, media_type, status, read_at, created_at, metadata
+                        FROM chat_messages WHERE conversation_id = %s
+                        ORDER BY created_at DESC LIMIT %s
+                    ''', (conversation_id, limit))
+                    
+                    rows = cursor.fetchall()
+                    return [{
+                        'id': row[0], 'conversation_id': row[1], 'channel': row[2],
+                        'external_message_id': row[3], 'direction': row[4],
+                        'sender_type': row[5], 'sender_id': row[6], 'sender_name': row[7],
+                        'message_type': row[8], 'content': row[9], 'media_url': row[10],
+                        'media_type': row[11], 'status': row[12],
+                        'read_at': row[13].isoformat() if row[13] else None,
+                        'created_at': row[14].isoformat() if row[14] else None,
+                        'metadata': row[15] if row[15] else {}
+                    } for row in rows]
             except Exception as e:
                 logger.error(f"Error getting messages: {e}")
         
         msgs = [m for m in self.messages.values() if m['conversation_id'] == conversation_id]
         return sorted(msgs, key=lambda x: x['created_at'], reverse=True)[:limit]
     
-    def get_unread_count(self, channel: str = None) -> int:
-        """Get count of unread incoming messages"""
-        if self.db and self._ensure_connection():
+    def get_channel_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get conversation and unread message totals of every channel
+        
+        One grouped query over conversations joined with the maintained
+        unread counters, cached for STATS_CACHE_TTL seconds. Totals counted
+        from memory while the database is unavailable are not cached.
+        
+        Returns:
+            dict: channel -> {'total_conversations', 'unread_messages'}
+        """
+        cached = self._stats_cache.get('channels')
+        if cached is not MISSING:
+            return {channel: dict(counts) for channel, counts in cached.items()}
+        
+        if self._use_db():
             try:
-                cursor = self.db.cursor()
-                if channel:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
                     cursor.execute('''
-                        SELECT COUNT(*) FROM chat_messages 
-                        WHERE read_at IS NULL AND direction = 'in' AND channel = %s
-                    ''', (channel,))
-                else:
-                    cursor.execute('''
-                        SELECT COUNT(*) FROM chat_messages 
-                        WHERE read_at IS NULL AND direction = 'in'
+                        SELECT COALESCE(c.channel, u.channel), COALESCE(c.total, 0), COALESCE(u.unread_count, 0)
+                        FROM (SELECT channel, COUNT(*) AS total FROM conversations GROUP BY channel) c
+                        FULL OUTER JOIN messaging_channel_counters u ON u.channel = c.channel
                     ''')
-                return cursor.fetchone()[0]
+                    stats = {row[0]: {'total_conversations': int(row[1]), 'unread_messages': int(row[2])}
+                             for row in cursor.fetchall()}
+                self._stats_cache.set('channels', stats)
+                return {channel: dict(counts) for channel, counts in stats.items()}
+            except Exception as e:
+                logger.error(f"Error getting channel stats: {e}")
+        
+        with self._lock:
+            totals = Counter(conv['channel'] for conv in self.conversations.values())
+            unread = dict(self._unread)
+        return {channel: {'total_conversations': totals[channel], 'unread_messages': unread.get(channel, 0)}
+                for channel in set(totals) | set(unread)}
+    
+    def get_unread_count(self, channel: str = None) -> int:
+        """Get count of unread incoming messages from the maintained per-channel counters"""
+        if self._use_db():
+            try:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    if channel:
+                        cursor.execute('''
+                            SELECT unread_count FROM messaging_channel_counters WHERE channel = %s
+                        ''', (channel,))
+                    else:
+                        cursor.execute('''
+                            SELECT COALESCE(SUM(unread_count), 0) FROM messaging_channel_counters
+                        ''')
+                    row = cursor.fetchone()
+                    return int(row[0]) if row else 0
             except Exception as e:
                 logger.error(f"Error getting unread count: {e}")
         
-        msgs = [m for m in self.messages.values() if m['direction'] == 'in' and not m['read_at']]
-        if channel:
-            msgs = [m for m in msgs if m['channel'] == channel]
-        return len(msgs)
+        with self._lock:
+            if channel:
+                return self._unread[channel]
+            return sum(self._unread.values())
 
 
 class TelegramConnector:
@@ -652,6 +760,9 @@ class MessagingHub:
     def get_unread_count(self, channel: str = None) -> int:
         return self.store.get_unread_count(channel)
     
+    def mark_read(self, conversation_id: str) -> int:
+        return self.store.mark_read(conversation_id)
+    
     def get_status(self) -> Dict:
         status = {
             'initialized': self.is_initialized,
@@ -659,7 +770,11 @@ class MessagingHub:
                 'telegram': self.telegram.get_status(),
                 'wazzup': self.wazzup.get_status()
             },
-            'automation_rules': len(self.automation_rules)
+            'automation_rules': len(self.automation_rules),
+            'storage': {
+                'backend': 'postgresql' if self.store._use_db() else 'memory',
+                'pool': self.store.pool_stats()
+            }
         }
         
         if self.whatsapp_free:
@@ -669,13 +784,13 @@ class MessagingHub:
     
     def get_channel_stats(self) -> Dict:
         channels = ['telegram', 'whatsapp', 'wazzup']
+        counts = self.store.get_channel_stats()
         stats = {}
         for channel in channels:
-            convs = self.store.get_conversations(channel)
-            unread = self.store.get_unread_count(channel)
+            channel_counts = counts.get(channel, {})
             stats[channel] = {
-                'total_conversations': len(convs),
-                'unread_messages': unread,
+                'total_conversations': channel_counts.get('total_conversations', 0),
+                'unread_messages': channel_counts.get('unread_messages', 0),
                 'status': 'active'
             }
         return stats
@@ -4,11 +4,29 @@ These models define the structure of the data in Supabase.
 """
 import os
 import sys
+import copy
 import json
+import time
+import atexit
+import base64
+import bisect
+import heapq
 import logging
-from datetime import datetime
+import threading
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
+from caching import TTLCache, MISSING
+from fallback_store import SQLiteFallbackDB, SQLiteLeadStore, SQLiteInteractionStore, SQLiteDocumentStore
+from outbox import WriteOutbox, CircuitBreaker, is_transient_error, new_idempotency_key
+from lead_dedupe import PHONE_KEY_FIELD, EMAIL_KEY_FIELD, contact_keys, contact_key_updates, find_duplicate_clusters
+from lead_search import MIN_QUERY_LENGTH, TrigramIndex, lead_search_text, normalize_search_query
+from lead_assignment import CLOSED_LEAD_STATUSES, LeadAssigner
+from booking_reconcile import (RECONCILED_FIELDS, booking_hash, diff_fields, extract_samo_bookings,
+                               keep_local_status, link_key, map_samo_booking, merge_by_id,
+                               normalize_booking)
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -27,7 +45,9 @@ _memory_ai_config = {
     'active': True
 }
 _memory_ai_agents = {}
-_memory_lead_interactions = []
+
+# Last known rows of travel agents, served while the database is unavailable
+_memory_agents = {}
 
 # Settings storage for SAMO API configuration
 _memory_samo_settings = {
@@ -46,9 +66,341 @@ _memory_agents_config = {
     'auto_process': False
 }
 
+class _MemoryLeadStore:
+    """
+    Indexed in-memory lead storage used when the database is unavailable
+    
+    Leads are kept in a dict by ID with secondary indexes so that lookups
+    do not scan the whole store:
+        - (external_source, external_id) -> lead ID
+        - normalized phone / email dedupe key -> lead IDs
+        - status -> ordered bucket, agent_id -> ordered bucket
+        - an ordered (created_at, id) index of all leads
+        - a trigram index of name, phone, email and notes for search
+    Ordered indexes are sorted lists of (created_at, id) keys, so the
+    newest N leads are read from the tail in O(N).
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+    
+    def _reset(self):
+        self._by_id = {}
+        self._by_external = {}
+        self._by_contact = {}
+        self._by_status = {}
+        self._by_agent = {}
+        self._order = []
+        self._last_id = 0
+        self._source_counts = Counter()
+        self._day_counts = Counter()
+        self._search = TrigramIndex()
+    
+    def clear(self):
+        """Remove all leads and reset the ID sequence"""
+        with self._lock:
+            self._reset()
+    
+    def __len__(self):
+        return len(self._by_id)
+    
+    @staticmethod
+    def _sort_key(lead):
+        return (lead.get('created_at') or '', str(lead.get('id')))
+    
+    @staticmethod
+    def _external_key(lead):
+        if lead.get('external_id') is None or lead.get('external_source') is None:
+            return None
+        return (lead.get('external_source'), lead.get('external_id'))
+    
+    @staticmethod
+    def _contact_keys(lead):
+        return [(field, lead[field]) for field in (PHONE_KEY_FIELD, EMAIL_KEY_FIELD) if lead.get(field)]
+    
+    @staticmethod
+    def _sorted_remove(keys, key):
+        pos = bisect.bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            del keys[pos]
+    
+    @staticmethod
+    def _bucket_add(buckets, name, key):
+        if name is None:
+            return
+        bisect.insort(buckets.setdefault(name, []), key)
+    
+    @staticmethod
+    def _decrement(counter, name):
+        counter[name] -= 1
+        if counter[name] <= 0:
+            del counter[name]
+    
+    @classmethod
+    def _bucket_remove(cls, buckets, name, key):
+        bucket = buckets.get(name)
+        if not bucket:
+            return
+        cls._sorted_remove(bucket, key)
+        if not bucket:
+            del buckets[name]
+    
+    def _index(self, lead):
+        key = self._sort_key(lead)
+        bisect.insort(self._order, key)
+        self._bucket_add(self._by_status, lead.get('status'), key)
+        self._bucket_add(self._by_agent, lead.get('agent_id'), key)
+        self._source_counts[lead.get('source')] += 1
+        self._day_counts[(lead.get('created_at') or '')[:10]] += 1
+        external_key = self._external_key(lead)
+        if external_key:
+            self._by_external[external_key] = lead['id']
+        for contact_key in self._contact_keys(lead):
+            self._by_contact.setdefault(contact_key, set()).add(lead['id'])
+        self._search.add(lead['id'], lead_search_text(lead))
+    
+    def _unindex(self, lead):
+        key = self._sort_key(lead)
+        self._sorted_remove(self._order, key)
+        self._bucket_remove(self._by_status, lead.get('status'), key)
+        self._bucket_remove(self._by_agent, lead.get('agent_id'), key)
+        self._decrement(self._source_counts, lead.get('source'))
+        self._decrement(self._day_counts, (lead.get('created_at') or '')[:10])
+        external_key = self._external_key(lead)
+        if external_key and self._by_external.get(external_key) == lead['id']:
+            del self._by_external[external_key]
+        for contact_key in self._contact_keys(lead):
+            lead_ids = self._by_contact.get(contact_key)
+            if lead_ids:
+                lead_ids.discard(lead['id'])
+                if not lead_ids:
+                    del self._by_contact[contact_key]
+        self._search.remove(lead['id'])
+    
+    def add(self, lead):
+        """Store a new lead, assigning the next sequential ID"""
+        with self._lock:
+            self._last_id += 1
+            lead['id'] = str(self._last_id)
+            self._by_id[lead['id']] = lead
+            self._index(lead)
+            return lead
+    
+    def get(self, lead_id):
+        """Get a lead by ID in O(1)"""
+        return self._by_id.get(str(lead_id))
+    
+    def get_by_external_id(self, external_id, external_source):
+        """Get a lead by (external_source, external_id) in O(1)"""
+        lead_id = self._by_external.get((external_source, external_id))
+        return self._by_id.get(lead_id) if lead_id is not None else None
+    
+    def find_by_contact(self, keys):
+        """
+        Get the oldest lead sharing any of the given dedupe keys in O(1)
+        
+        Args:
+            keys (dict): PHONE_KEY_FIELD / EMAIL_KEY_FIELD -> normalized value
+        """
+        with self._lock:
+            lead_ids = set()
+            for field, value in keys.items():
+                if value:
+                    lead_ids |= self._by_contact.get((field, value), set())
+            if not lead_ids:
+                return None
+            return min((self._by_id[lead_id] for lead_id in lead_ids), key=self._sort_key)
+    
+    def search(self, query, limit=20):
+        """
+        Find leads by a normalized query through the trigram index
+        
+        Returns:
+            list: (lead, score) pairs, best first, newest first among equals
+        """
+        with self._lock:
+            ranked = self._search.search(query, limit, tiebreak=lambda lead_id: self._sort_key(self._by_id[lead_id]))
+            return [(self._by_id[lead_id], score) for lead_id, score in ranked]
+    
+    def update(self, lead_id, update_data):
+        """Apply an update and move the lead between index buckets"""
+        with self._lock:
+            lead = self._by_id.get(str(lead_id))
+            if lead is None:
+                return None
+            self._unindex(lead)
+            lead.update(update_data)
+            self._index(lead)
+            return lead
+    
+    def list(self, limit=100, status=None, agent_id=None, before=None):
+        """
+        Get leads newest first, optionally filtered by status and agent
+        
+        The narrowest matching bucket is walked from its newest end (or from
+        the `before` (created_at, id) cursor position), so the cost is
+        proportional to the page size, not the store size.
+        """
+        with self._lock:
+            if status is not None and agent_id is not None:
+                by_status = self._by_status.get(status, [])
+                by_agent = self._by_agent.get(agent_id, [])
+                keys = by_status if len(by_status) <= len(by_agent) else by_agent
+            elif status is not None:
+                keys = self._by_status.get(status, [])
+            elif agent_id is not None:
+                keys = self._by_agent.get(agent_id, [])
+            else:
+                keys = self._order
+            
+            end = len(keys)
+            if before is not None:
+                end = bisect.bisect_left(keys, (before[0], str(before[1])))
+            
+            leads = []
+            for pos in range(end - 1, -1, -1):
+                key = keys[pos]
+                if len(leads) >= limit:
+                    break
+                lead = self._by_id[key[1]]
+                if status is not None and lead.get('status') != status:
+                    continue
+                if agent_id is not None and lead.get('agent_id') != agent_id:
+                    continue
+                leads.append(lead)
+            return leads
+    
+    def stats(self, since_day=None):
+        """
+        Get grouped lead counts, maintained incrementally on every write
+        
+        Args:
+            since_day (str, optional): YYYY-MM-DD lower bound for by_day
+            
+        Returns:
+            dict: {'total', 'by_status', 'by_source', 'by_agent', 'by_day'}
+        """
+        with self._lock:
+            return {
+                'total': len(self._by_id),
+                'by_status': {status: len(keys) for status, keys in self._by_status.items()},
+                'by_source': {str(source): count for source, count in self._source_counts.items()
+                              if source is not None},
+                'by_agent': {agent_id: len(keys) for agent_id, keys in self._by_agent.items()},
+                'by_day': {day: count for day, count in sorted(self._day_counts.items())
+                           if day and (since_day is None or day >= since_day)}
+            }
+
+
+class _MemoryInteractionStore:
+    """
+    Bounded in-memory lead interaction storage used when the database is unavailable
+    
+    Interactions are indexed per lead in insertion order, so a lead's history
+    is returned newest first without sorting. Memory is capped per lead and
+    globally: when a cap is exceeded the oldest interaction of the least
+    recently active lead is evicted, and appended to a JSON lines spill
+    file if FALLBACK_INTERACTIONS_SPILL_PATH is set.
+    """
+    
+    def __init__(self, per_lead_limit=500, total_limit=50000, spill_path=None):
+        self.per_lead_limit = per_lead_limit
+        self.total_limit = total_limit
+        self.spill_path = spill_path
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._by_lead = OrderedDict()  # lead_id -> deque, least recently active first
+        self._total = 0
+        self._last_id = 0
+    
+    def __len__(self):
+        return self._total
+    
+    def add(self, lead_id, interaction):
+        """Store an interaction, assigning the next sequential ID"""
+        with self._lock:
+            self._last_id += 1
+            interaction['id'] = str(self._last_id)
+            
+            history = self._by_lead.get(lead_id)
+            if history is None:
+                history = self._by_lead[lead_id] = deque()
+            else:
+                self._by_lead.move_to_end(lead_id)
+            history.append(interaction)
+            self._total += 1
+            
+            evicted = []
+            if len(history) > self.per_lead_limit:
+                evicted.append(history.popleft())
+                self._total -= 1
+            while self._total > self.total_limit:
+                oldest_lead_id, oldest_history = next(iter(self._by_lead.items()))
+                evicted.append(oldest_history.popleft())
+                self._total -= 1
+                if not oldest_history:
+                    del self._by_lead[oldest_lead_id]
+            
+            self.evicted += len(evicted)
+        
+        if evicted:
+            self._spill(evicted)
+        return interaction
+    
+    def list(self, lead_id):
+        """Get interactions for a lead, newest first"""
+        history = self._by_lead.get(lead_id)
+        if not history:
+            return []
+        return list(reversed(history))
+    
+    def page(self, after_id=None, limit=1000):
+        """Get interactions of all leads in ID order, starting after `after_id`"""
+        after = int(after_id) if after_id is not None else 0
+        with self._lock:
+            interactions = (interaction for history in self._by_lead.values() for interaction in history
+                            if int(interaction['id']) > after)
+            return heapq.nsmallest(limit, interactions, key=lambda interaction: int(interaction['id']))
+    
+    def _spill(self, interactions):
+        if not self.spill_path:
+            return
+        try:
+            with open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+                for interaction in interactions:
+                    spill_file.write(json.dumps(interaction, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            logger.error(f"Failed to spill evicted lead interactions: {e}")
+
+
 # Production: All data comes from database and SAMO API
 # Demo data removed for production deployment
-_memory_leads = []  # Empty for production
+#
+# Degraded-mode backend: 'sqlite' (default) keeps fallback data in a local
+# WAL-mode database shared by all workers and kept across restarts,
+# 'memory' keeps it in per-process structures. The file is only created
+# when a fallback path is actually used.
+FALLBACK_STORE = os.environ.get('FALLBACK_STORE', 'sqlite')
+_fallback_db = SQLiteFallbackDB(os.environ.get(
+    'FALLBACK_DB_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'fallback.sqlite3')
+))
+
+if FALLBACK_STORE == 'sqlite':
+    _memory_leads = SQLiteLeadStore(_fallback_db)
+    _memory_lead_interactions = SQLiteInteractionStore(_fallback_db)
+    _memory_ai_agents = SQLiteDocumentStore(_fallback_db, 'ai_agents')
+    _memory_agents = SQLiteDocumentStore(_fallback_db, 'agents')
+    _memory_ai_config = SQLiteDocumentStore(_fallback_db, 'ai_config', defaults=_memory_ai_config)
+    _memory_samo_settings = SQLiteDocumentStore(_fallback_db, 'samo_settings', defaults=_memory_samo_settings)
+else:
+    _memory_leads = _MemoryLeadStore()  # Empty for production
+    _memory_lead_interactions = _MemoryInteractionStore(
+        per_lead_limit=int(os.environ.get('FALLBACK_INTERACTIONS_PER_LEAD', 500)),
+        total_limit=int(os.environ.get('FALLBACK_INTERACTIONS_MAX', 50000)),
+        spill_path=os.environ.get('FALLBACK_INTERACTIONS_SPILL_PATH')
+    )
 
 supabase = None
 try:
@@ -68,55 +420,242 @@ def is_supabase_available():
     """Check if Supabase is available for database operations"""
     return supabase is not None
 
+def _replay_outbox_rows(table, rows):
+    """Write a batch of deferred rows; keys that already landed are skipped"""
+    supabase.table(table).upsert(rows, on_conflict='idempotency_key', ignore_duplicates=True,
+                                 returning='minimal').execute()
+    if table == 'leads':
+        LeadService.invalidate_lead_cache()
+
+# Inserts that fail while Supabase is unreachable are kept in the fallback
+# database and replayed in the background (see docs/SUPABASE_SCHEMA.md).
+# Leftovers from a previous run are picked up on the first insert.
+_write_outbox = WriteOutbox(
+    _fallback_db,
+    _replay_outbox_rows,
+    batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', 100)),
+    replay_interval=int(os.environ.get('OUTBOX_REPLAY_SECONDS', 10)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('SUPABASE_BREAKER_FAILURES', 3)),
+        reset_timeout=int(os.environ.get('SUPABASE_BREAKER_RESET_SECONDS', 30))
+    )
+)
+
+# Column sets selected for each view profile. List screens only render a
+# few columns, so long notes and JSON columns are not fetched for them.
+LEAD_VIEWS = {
+    'list': 'id, customer_name, customer_phone, source, status, agent_id, created_at',
+    'card': 'id, customer_name, customer_phone, customer_email, source, interest, '
+            'status, agent_id, notes, created_at, updated_at',
+    'contact': 'id, customer_name, customer_phone, customer_email, phone_e164, email_normalized, created_at',
+    'full': '*'
+}
+
+BOOKING_VIEWS = {
+    'list': 'id, customer_name, destination_country, checkin_date, nights, '
+            'price, currency, status, created_at',
+    'card': 'id, customer_name, customer_phone, customer_email, tour_id, departure_city, '
+            'destination_country, checkin_date, nights, adults, children, price, currency, '
+            'status, telegram_user_id, created_at',
+    'full': '*'
+}
+
+AGENT_VIEWS = {
+    'list': 'id, name, role, status, avatar_url',
+    'card': 'id, name, email, phone, role, status, avatar_url, created_at',
+    'assignment': 'id, status, assignment_weight, working_hours',
+    'full': '*'
+}
+
+# Interactions returned per lead by batch reads (GET /api/leads?include=interactions)
+INTERACTIONS_PER_LEAD = 20
+
+def select_columns(views, view):
+    """
+    Get the select() column list for a view profile
+    
+    Args:
+        views (dict): One of LEAD_VIEWS, BOOKING_VIEWS, AGENT_VIEWS
+        view (str): View profile name (list, card, full)
+        
+    Returns:
+        str: Comma separated column list for supabase select()
+        
+    Raises:
+        ValueError: If the view profile is unknown
+    """
+    if view not in views:
+        raise ValueError(f"Unknown view '{view}', expected one of: {', '.join(views)}")
+    return views[view]
+
+def project_record(record, views, view):
+    """
+    Reduce an in-memory record to the columns of a view profile
+    
+    Args:
+        record (dict): The full record (or None)
+        views (dict): One of LEAD_VIEWS, BOOKING_VIEWS, AGENT_VIEWS
+        view (str): View profile name (list, card, full)
+        
+    Returns:
+        dict: A copy with only the view's columns, or the record itself for 'full'
+    """
+    columns = select_columns(views, view)
+    if record is None or columns == '*':
+        return record
+    return {column: record.get(column) for column in columns.split(', ')}
+
+def encode_keyset_cursor(sort_value, record_id):
+    """
+    Build an opaque pagination cursor pointing after a row
+    
+    Args:
+        sort_value (str): The row's value of the sort column
+        record_id: The row's ID (tie-breaker)
+    
+    Returns:
+        str: URL-safe cursor encoding (sort_value, id)
+    """
+    raw = json.dumps([sort_value, record_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_keyset_cursor(cursor):
+    """
+    Decode a cursor produced by encode_keyset_cursor
+    
+    Args:
+        cursor (str): The opaque cursor
+    
+    Returns:
+        tuple: (sort_value, id)
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        sort_value, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(sort_value, str) or record_id is None:
+        raise ValueError("Invalid cursor")
+    return sort_value, record_id
+
 class SettingsService:
     """Service class for handling application settings"""
     
+    # Keys managed through the settings page
+    SAMO_SETTING_KEYS = ('api_url', 'oauth_token', 'timeout', 'user_agent')
+    
+    # Safety net for other workers that did not see our invalidation
+    CACHE_TTL_SECONDS = 60
+    
+    _samo_cache = None
+    _samo_cache_loaded_at = 0.0
+    _samo_cache_version = 0
+    _samo_cache_lock = threading.Lock()
+    
+    @classmethod
+    def get_settings_version(cls) -> int:
+        """
+        Get the current version stamp of the SAMO settings cache
+        
+        Callers that derive state from the settings (e.g. a long-lived API
+        client) can compare this number instead of re-reading the settings.
+        
+        Returns:
+            int: Version stamp, incremented on every invalidation
+        """
+        return cls._samo_cache_version
+    
+    @classmethod
+    def invalidate_samo_settings(cls):
+        """Drop the cached SAMO settings and bump the version stamp"""
+        with cls._samo_cache_lock:
+            cls._samo_cache = None
+            cls._samo_cache_loaded_at = 0.0
+            cls._samo_cache_version += 1
+    
+    @classmethod
+    def get_samo_settings(cls):
+        """Get SAMO API settings (served from the in-process cache when fresh)"""
+        cached = cls._samo_cache
+        if cached is not None and time.monotonic() - cls._samo_cache_loaded_at < cls.CACHE_TTL_SECONDS:
+            return dict(cached)
+        
+        version = cls._samo_cache_version
+        settings = cls._load_samo_settings()
+        with cls._samo_cache_lock:
+            # A save that landed during the load makes what we read stale;
+            # return it to this caller but do not cache it
+            if cls._samo_cache_version == version:
+                cls._samo_cache = settings
+                cls._samo_cache_loaded_at = time.monotonic()
+        return dict(settings)
+    
     @staticmethod
-    def get_samo_settings():
-        """Get SAMO API settings"""
+    def _load_samo_settings():
+        """Read SAMO API settings from the database or memory storage"""
         if is_supabase_available():
             try:
-                result = supabase.table('settings').select('*').eq('category', 'samo_api').execute()
+                result = supabase.table('settings').select('key, value').eq('category', 'samo_api').execute()
                 if result.data:
                     settings = {}
                     for item in result.data:
                         settings[item['key']] = item['value']
                     return settings
                 else:
-                    return _memory_samo_settings
+                    return dict(_memory_samo_settings)
             except Exception as e:
                 logger.error(f"Error getting SAMO settings from database: {e}")
-                return _memory_samo_settings
+                return dict(_memory_samo_settings)
         else:
-            return _memory_samo_settings
+            return dict(_memory_samo_settings)
     
-    @staticmethod
-    def update_samo_setting(key: str, value: str):
-        """Update a specific SAMO API setting"""
+    @classmethod
+    def update_samo_settings(cls, values: Dict[str, Any]) -> bool:
+        """
+        Save several SAMO API settings with a single bulk upsert
+        
+        Requires a unique constraint on settings (category, key),
+        see docs/SUPABASE_SCHEMA.md.
+        
+        Args:
+            values (dict): Setting key -> value
+            
+        Returns:
+            bool: True if persisted to the database (or memory when the
+                database is not configured), False if memory fallback was used
+        """
+        if not values:
+            return True
+        
+        values = {key: str(value) for key, value in values.items()}
+        saved = True
+        in_database = False
         if is_supabase_available():
             try:
-                # Check if setting exists
-                result = supabase.table('settings').select('id').eq('category', 'samo_api').eq('key', key).execute()
-                if result.data:
-                    # Update existing
-                    supabase.table('settings').update({'value': value}).eq('category', 'samo_api').eq('key', key).execute()
-                else:
-                    # Insert new
-                    supabase.table('settings').insert({
-                        'category': 'samo_api',
-                        'key': key,
-                        'value': value,
-                        'created_at': datetime.now().isoformat()
-                    }).execute()
-                logger.info(f"SAMO setting updated: {key} = {value}")
-                return True
+                rows = [{
+                    'category': 'samo_api',
+                    'key': key,
+                    'value': value
+                } for key, value in values.items()]
+                supabase.table('settings').upsert(rows, on_conflict='category,key').execute()
+                logger.info(f"SAMO settings updated: {', '.join(values.keys())}")
+                in_database = True
             except Exception as e:
-                logger.error(f"Error updating SAMO setting: {e}")
-                _memory_samo_settings[key] = value
-                return False
-        else:
-            _memory_samo_settings[key] = value
-            return True
+                logger.error(f"Error updating SAMO settings: {e}")
+                saved = False
+        
+        # Only the fallback path writes the fallback store
+        if not in_database:
+            _memory_samo_settings.update(values)
+        cls.invalidate_samo_settings()
+        return saved
+    
+    @classmethod
+    def update_samo_setting(cls, key: str, value: str):
+        """Update a specific SAMO API setting"""
+        return cls.update_samo_settings({key: value})
     
     @staticmethod
     def get_setting(category: str, key: str, default_value: Optional[str] = None):
@@ -130,6 +669,13 @@ class SettingsService:
 class BookingService:
     """Service class for handling bookings in Supabase database"""
     
+    # Columns bookings can be ranged and ordered by; each has a matching
+    # (column, id) index in docs/SUPABASE_SCHEMA.md
+    DATE_FIELDS = ('checkin_date', 'created_at')
+    
+    # Range totals are for dashboards and may lag by a few seconds
+    _totals_cache = TTLCache(ttl=int(os.environ.get('BOOKING_TOTALS_CACHE_TTL', 30)), maxsize=256)
+    
     @staticmethod
     def create_booking(booking_data):
         """
@@ -151,6 +697,7 @@ class BookingService:
                 - currency: Currency code
                 - status: Booking status (pending, confirmed, cancelled)
                 - telegram_user_id: Telegram user ID if booked via Telegram
+                - samo_booking_id: SAMO booking (claim) ID, used by reconcile_with_samo (optional)
                 
         Returns:
             dict: The created booking data with an ID
@@ -165,37 +712,386 @@ class BookingService:
         return result.data[0] if result.data else None
     
     @staticmethod
-    def get_bookings(limit=100, status=None):
+    def get_bookings(limit=100, status=None, view='full'):
         """
-        Get all bookings, optionally filtered by status
+        Get the most recent bookings, optionally filtered by status
         
         Args:
             limit (int): Maximum number of bookings to return
             status (str, optional): Filter by booking status
+            view (str): Column profile from BOOKING_VIEWS (list, card, full)
             
         Returns:
-            list: List of bookings
+            list: List of bookings, newest first; bookings without
+                created_at follow the dated ones
+        """
+        bookings = BookingService.get_bookings_page(limit=limit, date_field='created_at', status=status,
+                                                    descending=True, view=view)['bookings']
+        if len(bookings) < limit:
+            # get_bookings_page skips rows without created_at; list them last
+            query = supabase.table("bookings").select(select_columns(BOOKING_VIEWS, view)).is_("created_at", "null")
+            if status:
+                query = query.eq("status", status)
+            bookings += query.order("id").limit(limit - len(bookings)).execute().data or []
+        return bookings
+    
+    @staticmethod
+    def _date_range(date_field, date_from, date_to):
+        """Validate a booking date range; returns (from, day after to) as ISO dates"""
+        if date_field not in BookingService.DATE_FIELDS:
+            raise ValueError(f"Unknown date field '{date_field}', expected one of: "
+                             f"{', '.join(BookingService.DATE_FIELDS)}")
+        bounds = []
+        for name, value in (('date_from', date_from), ('date_to', date_to)):
+            if not value:
+                bounds.append(None)
+                continue
+            try:
+                bounds.append(datetime.strptime(value, '%Y-%m-%d').date())
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} must be a YYYY-MM-DD date")
+        start, end = bounds
+        if start and end and end < start:
+            raise ValueError("date_to is before date_from")
+        return (start.isoformat() if start else None,
+                (end + timedelta(days=1)).isoformat() if end else None)
+    
+    @staticmethod
+    def get_bookings_page(limit=50, date_field='checkin_date', date_from=None, date_to=None,
+                          status=None, cursor=None, descending=False, view='full'):
         """
-        query = supabase.table("bookings").select("*").limit(limit)
+        Get one page of bookings in a date range, ordered by that date
+        
+        Uses keyset pagination on (date_field, id), so every page is an
+        index range scan no matter how deep it is. Bookings without a value
+        in date_field are not listed.
+        
+        Args:
+            limit (int): Maximum number of bookings to return
+            date_field (str): checkin_date or created_at
+            date_from (str, optional): First day of the range, YYYY-MM-DD
+            date_to (str, optional): Last day of the range (inclusive), YYYY-MM-DD
+            status (str, optional): Filter by booking status
+            cursor (str, optional): next_cursor from the previous page
+            descending (bool): Latest dates first
+            view (str): Column profile from BOOKING_VIEWS (list, card, full)
         
+        Returns:
+            dict: {'bookings': list, 'next_cursor': str or None}
+        
+        Raises:
+            ValueError: If the date field, range, cursor or view is invalid
+        """
+        start, end = BookingService._date_range(date_field, date_from, date_to)
+        position = decode_keyset_cursor(cursor) if cursor else None
+        columns = select_columns(BOOKING_VIEWS, view)
+        if columns != '*':
+            # The cursor needs the sort key of the last row
+            columns = ', '.join(dict.fromkeys(columns.split(', ') + ['id', date_field]))
+        
+        query = supabase.table("bookings").select(columns).filter(date_field, "not.is", "null")
+        if start:
+            query = query.gte(date_field, start)
+        if end:
+            query = query.lt(date_field, end)
         if status:
             query = query.eq("status", status)
+        if position:
+            value, booking_id = position
+            op = 'lt' if descending else 'gt'
+            query = query.or_(
+                f'{date_field}.{op}."{value}",'
+                f'and({date_field}.eq."{value}",id.{op}."{booking_id}")'
+            )
+        
+        # Fetch one extra row to know whether another page exists
+        query = query.order(date_field, desc=descending).order("id", desc=descending).limit(limit + 1)
+        bookings = query.execute().data or []
+        
+        next_cursor = None
+        if len(bookings) > limit:
+            bookings = bookings[:limit]
+            next_cursor = encode_keyset_cursor(str(bookings[-1][date_field]), bookings[-1]['id'])
+        return {'bookings': [project_record(booking, BOOKING_VIEWS, view) for booking in bookings],
+                'next_cursor': next_cursor}
+    
+    @staticmethod
+    def get_booking_totals(date_field='checkin_date', date_from=None, date_to=None, status=None):
+        """
+        Get the number of bookings and revenue per currency in a date range
             
-        result = query.execute()
-        return result.data if result.data else []
+        Aggregated inside the database by the booking_totals RPC (see
+        docs/SUPABASE_SCHEMA.md) over the same indexes as get_bookings_page,
+        and cached for a short TTL.
+        
+        Args:
+            date_field (str): checkin_date or created_at
+            date_from (str, optional): First day of the range, YYYY-MM-DD
+            date_to (str, optional): Last day of the range (inclusive), YYYY-MM-DD
+            status (str, optional): Filter by booking status
+        
+        Returns:
+            dict: {'count': int, 'revenue': {currency: total}}
+        
+        Raises:
+            ValueError: If the date field or range is invalid
+        """
+        start, end = BookingService._date_range(date_field, date_from, date_to)
+        cache_key = (date_field, start, end, status)
+        cached = BookingService._totals_cache.get(cache_key)
+        if cached is not MISSING:
+            return dict(cached)
+        
+        result = supabase.rpc('booking_totals', {
+            'p_date_field': date_field,
+            'p_from': start,
+            'p_to': end,
+            'p_status': status
+        }).execute()
+        totals = result.data or {'count': 0, 'revenue': {}}
+        BookingService._totals_cache.set(cache_key, dict(totals))
+        return totals
+    
+    @staticmethod
+    def _iter_samo_linked(date_from, date_to, batch_size=1000):
+        """
+        Yield local bookings linked to SAMO created in a date range
+        
+        Only the reconciled columns are read, in keyset pages ordered by
+        samo_booking_id (COLLATE "C", so the order matches Python's).
+        """
+        start, end = BookingService._date_range('created_at', date_from, date_to)
+        columns = 'id, samo_booking_id, ' + ', '.join(RECONCILED_FIELDS)
+        after_id = None
+        while True:
+            query = supabase.table("bookings").select(columns).filter("samo_booking_id", "not.is", "null")
+            if start:
+                query = query.gte("created_at", start)
+            if end:
+                query = query.lt("created_at", end)
+            if after_id is not None:
+                query = query.gt("samo_booking_id", after_id)
+            rows = query.order("samo_booking_id").limit(batch_size).execute().data or []
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1]['samo_booking_id']
+    
+    @staticmethod
+    def _match_unlinked(date_from, date_to, samo_ids, remote, batch_size=1000):
+        """
+        Pair local bookings without samo_booking_id with SAMO bookings
+        
+        Local bookings created in the range are matched on every reconciled
+        field except status. Only unambiguous pairs (one local and one SAMO
+        booking with the same values) are returned.
+        
+        Returns:
+            list: (local row, samo_booking_id) pairs
+        """
+        wanted = {}
+        for samo_id in samo_ids:
+            key = link_key(remote[samo_id])
+            if key is not None:
+                wanted.setdefault(key, []).append(samo_id)
+        if not wanted:
+            return []
+        
+        start, end = BookingService._date_range('created_at', date_from, date_to)
+        columns = 'id, samo_booking_id, ' + ', '.join(RECONCILED_FIELDS)
+        candidates = {}
+        after_id = None
+        while True:
+            query = supabase.table("bookings").select(columns).filter("samo_booking_id", "is", "null")
+            if start:
+                query = query.gte("created_at", start)
+            if end:
+                query = query.lt("created_at", end)
+            if after_id is not None:
+                query = query.gt("id", after_id)
+            rows = query.order("id").limit(batch_size).execute().data or []
+            for row in rows:
+                key = link_key(normalize_booking(row))
+                if key in wanted:
+                    candidates.setdefault(key, []).append(row)
+            if len(rows) < batch_size:
+                break
+            after_id = rows[-1]['id']
+        
+        return [(rows[0], wanted[key][0]) for key, rows in candidates.items()
+                if len(rows) == 1 and len(wanted[key]) == 1]
+    
+    @staticmethod
+    def reconcile_with_samo(date_from=None, date_to=None, dry_run=False, max_details=500):
+        """
+        Find and repair drift between local bookings and SAMO
+        
+        SAMO bookings from GetBookings and local bookings created in the same
+        range are reduced to content hashes of the fields SAMO owns, and
+        both sides are walked once in samo_booking_id order (sorted merge).
+        Only bookings whose hashes differ are fetched in full from SAMO
+        (GetBookingDetails) and updated locally, and only in the fields
+        that differ. SAMO bookings that are not in the local range are
+        looked up by ID, and then matched to local bookings that have no
+        samo_booking_id yet (see _match_unlinked), before being reported
+        missing; matched bookings are linked and compared as usual.
+        SAMO statuses are translated with SAMO_STATUS_MAP, and unknown ones
+        are reported instead of written.
+        
+        Args:
+            date_from (str, optional): First day, YYYY-MM-DD (default 30 days ago)
+            date_to (str, optional): Last day (inclusive), YYYY-MM-DD (default today)
+            dry_run (bool): Only report, do not update local bookings
+            max_details (int): Maximum number of changed bookings listed
+        
+        Returns:
+            dict: Drift report {'samo', 'local', 'matched', 'changed_count',
+                'updated', 'failed', 'changed': [{'booking_id',
+                'samo_booking_id', 'fields': {field: [local, samo]}}],
+                'linked': [{'booking_id', 'samo_booking_id'}],
+                'missing_locally', 'missing_in_samo',
+                'unknown_samo_statuses', ...}
+        
+        Raises:
+            ValueError: If the date range is invalid
+            RuntimeError: If SAMO returned an error
+        """
+        from crystal_bay_samo_api import get_crystal_bay_api
+        
+        date_from = date_from or (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+        date_to = date_to or datetime.now().strftime('%Y-%m-%d')
+        BookingService._date_range('created_at', date_from, date_to)
+        api = get_crystal_bay_api()
+        
+        remote = {}
+        unknown_statuses = set()
+        for samo_booking in extract_samo_bookings(api.get_bookings_api(date_from, date_to)):
+            mapped = map_samo_booking(samo_booking)
+            if mapped:
+                remote[mapped['samo_booking_id']] = normalize_booking(mapped)
+                if mapped['status'] is None and mapped['samo_status'] is not None:
+                    unknown_statuses.add(str(mapped['samo_status']))
+        
+        report = {
+            'date_from': date_from,
+            'date_to': date_to,
+            'dry_run': dry_run,
+            'samo': len(remote),
+            'local': 0,
+            'matched': 0,
+            'updated': 0,
+            'failed': 0,
+            'linked': [],
+            'missing_locally': [],
+            'missing_in_samo': [],
+            'unknown_samo_statuses': sorted(unknown_statuses)
+        }
+        mismatched = []
+        
+        def compare(local_row, remote_values):
+            local_values = normalize_booking(local_row)
+            remote_values = keep_local_status(local_values, remote_values)
+            if booking_hash(local_values) == booking_hash(remote_values):
+                report['matched'] += 1
+            else:
+                mismatched.append((local_row, local_values))
+        
+        unmatched_remote = []
+        local_rows = ((row['samo_booking_id'], row)
+                      for row in BookingService._iter_samo_linked(date_from, date_to))
+        for samo_booking_id, local_row, remote_values in merge_by_id(local_rows, sorted(remote.items())):
+            if local_row is not None:
+                report['local'] += 1
+            if local_row is not None and remote_values is not None:
+                compare(local_row, remote_values)
+            elif local_row is not None:
+                report['missing_in_samo'].append(samo_booking_id)
+            else:
+                unmatched_remote.append(samo_booking_id)
+        
+        # Bookings created locally outside the range are found by ID
+        columns = 'id, samo_booking_id, ' + ', '.join(RECONCILED_FIELDS)
+        for start in range(0, len(unmatched_remote), 200):
+            chunk = unmatched_remote[start:start + 200]
+            rows = supabase.table("bookings").select(columns).in_("samo_booking_id", chunk).execute().data or []
+            found = set()
+            for row in rows:
+                found.add(row['samo_booking_id'])
+                compare(row, remote[row['samo_booking_id']])
+            report['missing_locally'].extend(samo_id for samo_id in chunk if samo_id not in found)
+        
+        # Bookings saved before they were linked to SAMO
+        linked = set()
+        for local_row, samo_booking_id in BookingService._match_unlinked(date_from, date_to,
+                                                                         report['missing_locally'], remote):
+            if not dry_run:
+                try:
+                    supabase.table("bookings").update(
+                        {'samo_booking_id': samo_booking_id}
+                    ).eq("id", local_row['id']).is_("samo_booking_id", "null").execute()
+                except Exception as e:
+                    logger.error(f"Could not link booking {local_row['id']} to SAMO {samo_booking_id}: {e}")
+                    report['failed'] += 1
+                    continue
+            linked.add(samo_booking_id)
+            report['linked'].append({'booking_id': local_row['id'], 'samo_booking_id': samo_booking_id})
+            local_row['samo_booking_id'] = samo_booking_id
+            compare(local_row, remote[samo_booking_id])
+        report['missing_locally'] = [samo_id for samo_id in report['missing_locally'] if samo_id not in linked]
+        
+        changed = []
+        for local_row, local_values in mismatched:
+            samo_booking_id = local_row['samo_booking_id']
+            remote_values = keep_local_status(local_values, remote[samo_booking_id])
+            try:
+                details = extract_samo_bookings(api.get_booking_details(samo_booking_id))
+                mapped = map_samo_booking(details[0]) if details else None
+                if mapped:
+                    remote_values = keep_local_status(local_values, normalize_booking(mapped))
+            except Exception as e:
+                logger.warning(f"SAMO details for booking {samo_booking_id} unavailable, using list data: {e}")
+            
+            fields = diff_fields(local_values, remote_values)
+            if not fields:
+                report['matched'] += 1
+                continue
+            changed.append({'booking_id': local_row['id'], 'samo_booking_id': samo_booking_id, 'fields': fields})
+            if dry_run:
+                continue
+            try:
+                supabase.table("bookings").update(
+                    {field: remote_values[field] for field in fields}
+                ).eq("id", local_row['id']).execute()
+                report['updated'] += 1
+            except Exception as e:
+                logger.error(f"Could not update booking {local_row['id']} from SAMO: {e}")
+                report['failed'] += 1
+        
+        if report['updated']:
+            BookingService._totals_cache.clear()
+        report['changed_count'] = len(changed)
+        report['changed'] = changed[:max_details]
+        logger.info(f"Booking reconciliation {date_from}..{date_to}: {report['matched']} matched, "
+                    f"{len(changed)} changed, {len(report['linked'])} linked, "
+                    f"{len(report['missing_locally'])} missing locally, "
+                    f"{len(report['missing_in_samo'])} missing in SAMO")
+        if unknown_statuses:
+            logger.warning(f"SAMO statuses without a local mapping, left unchanged: {sorted(unknown_statuses)}")
+        return report
     
     @staticmethod
-    def get_booking(booking_id):
+    def get_booking(booking_id, view='full'):
         """
         Get a specific booking by ID
         
         Args:
             booking_id (str): The booking ID
+            view (str): Column profile from BOOKING_VIEWS (list, card, full)
             
         Returns:
             dict: The booking data or None if not found
         """
-        result = supabase.table("bookings").select("*").eq("id", booking_id).execute()
+        result = supabase.table("bookings").select(select_columns(BOOKING_VIEWS, view)).eq("id", booking_id).execute()
         return result.data[0] if result.data else None
     
     @staticmethod
@@ -234,6 +1130,124 @@ class BookingService:
 class LeadService:
     """Service class for handling leads in Supabase database"""
     
+    # Lead cards are read far more often than they change: single leads are
+    # kept per (lead_id, view) and written through on update, list pages are
+    # short-lived and dropped on any write. The TTL only bounds staleness
+    # from writes made by other workers.
+    _lead_cache = TTLCache(ttl=int(os.environ.get('LEAD_CACHE_TTL', 60)),
+                           maxsize=int(os.environ.get('LEAD_CACHE_SIZE', 2000)))
+    _page_cache = TTLCache(ttl=int(os.environ.get('LEAD_PAGE_CACHE_TTL', 10)),
+                           maxsize=int(os.environ.get('LEAD_PAGE_CACHE_SIZE', 200)))
+    
+    @classmethod
+    def _cache_lead(cls, lead):
+        """Write a full lead row through to the cache for every view"""
+        lead_id = str(lead.get('id'))
+        for view in LEAD_VIEWS:
+            cls._lead_cache.set((lead_id, view), dict(project_record(lead, LEAD_VIEWS, view)))
+        cls._page_cache.clear()
+    
+    @classmethod
+    def _write_through(cls, lead_id, lead):
+        """Cache an updated row, or drop the lead if the update returned nothing"""
+        if lead:
+            cls._cache_lead(lead)
+            _lead_assigner.observe(lead)
+        else:
+            cls.invalidate_lead_cache(lead_id)
+        return lead
+    
+    @classmethod
+    def invalidate_lead_cache(cls, lead_id=None):
+        """
+        Drop cached leads and list pages
+        
+        Args:
+            lead_id (str, optional): Lead to drop; all leads if omitted
+        """
+        if lead_id is None:
+            cls._lead_cache.clear()
+        else:
+            cls._lead_cache.invalidate(*[(str(lead_id), view) for view in LEAD_VIEWS])
+        cls._page_cache.clear()
+    
+    @classmethod
+    def get_cache_stats(cls):
+        """
+        Get hit/miss metrics of the lead caches
+        
+        Returns:
+            dict: {'leads': {...}, 'pages': {...}} as returned by TTLCache.stats
+        """
+        return {
+            'leads': cls._lead_cache.stats(),
+            'pages': cls._page_cache.stats()
+        }
+    
+    @staticmethod
+    def _insert_or_defer(table, row):
+        """
+        Insert a row, or queue it in the write outbox if Supabase is unreachable
+        
+        The row gets an idempotency key, so retrying it (from the outbox or
+        by a client resending the same key) never creates a duplicate. While
+        the circuit breaker is open the database is not called at all.
+        
+        Args:
+            table (str): Target table
+            row (dict): Row to insert
+            
+        Returns:
+            dict: The stored row, or the row with id None and
+                sync_status 'pending' if it was queued
+        """
+        row.setdefault('idempotency_key', new_idempotency_key())
+        _write_outbox.resume()
+        error = None
+        if _write_outbox.breaker.allow():
+            try:
+                result = supabase.table(table).upsert(row, on_conflict='idempotency_key',
+                                                      ignore_duplicates=True).execute()
+            except Exception as e:
+                if not is_transient_error(e):
+                    _write_outbox.breaker.record_success()
+                    raise
+                _write_outbox.breaker.record_failure()
+                logger.error(f"Insert into '{table}' failed, deferring to outbox: {e}")
+                error = e
+            else:
+                _write_outbox.breaker.record_success()
+                if result.data:
+                    return result.data[0]
+                # The key was stored by an earlier attempt
+                existing = supabase.table(table).select("*").eq("idempotency_key", row['idempotency_key']).execute()
+                return existing.data[0] if existing.data else None
+        
+        _write_outbox.enqueue(table, row, error)
+        return dict(row, id=None, sync_status='pending')
+    
+    @staticmethod
+    def get_outbox_stats():
+        """
+        Get the state of the write outbox
+        
+        Returns:
+            dict: {'pending', 'dead', 'oldest_pending', 'breaker'}
+        """
+        return _write_outbox.stats()
+    
+    @staticmethod
+    def replay_outbox():
+        """
+        Replay deferred writes now instead of waiting for the background thread
+        
+        Returns:
+            int: Number of rows written
+        """
+        if not is_supabase_available():
+            return 0
+        return _write_outbox.replay()
+    
     @staticmethod
     def delete_all_leads():
         """
@@ -242,10 +1256,10 @@ class LeadService:
         Returns:
             bool: True if successful
         """
-        global _memory_leads
-        
         # Clear memory leads
-        _memory_leads = []
+        _memory_leads.clear()
+        LeadService.invalidate_lead_cache()
+        AssignmentService.invalidate()
         
         # Try to clear from database if available
         if is_supabase_available():
@@ -270,24 +1284,248 @@ class LeadService:
         Returns:
             dict: The created lead data with an ID
         """
-        global _memory_leads
-        
         # Add creation timestamp
         lead_data['created_at'] = datetime.now().isoformat()
         if 'status' not in lead_data:
             lead_data['status'] = 'new'
             
-        # Generate a unique ID (mimicking database behavior)
-        lead_data['id'] = str(len(_memory_leads) + 1)
-        
-        # Add to memory store
-        _memory_leads.append(lead_data)
+        # Add to memory store (assigns a unique ID, mimicking database behavior)
+        _memory_leads.add(lead_data)
         
         logger.info(f"Used fallback storage to create lead: {lead_data['id']}")
         return lead_data
     
     @staticmethod
-    def create_lead(lead_data):
+    def normalize_lead_data(data):
+        """
+        Validate and normalize incoming lead fields (API, widget, import rows)
+        
+        Supports both field name variations used by the forms and imports.
+        
+        Args:
+            data (dict): Raw lead fields
+            
+        Returns:
+            dict: Lead data ready for create_lead
+            
+        Raises:
+            ValueError: If the row is not usable as a lead
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Row must be an object")
+        
+        def field(*names):
+            for name in names:
+                value = data.get(name)
+                if isinstance(value, str):
+                    value = value.strip()
+                if value not in (None, ''):
+                    return value
+            return None
+        
+        customer_name = field('customer_name', 'name')
+        if not customer_name:
+            raise ValueError("Customer name is required")
+        
+        lead_data = {
+            'customer_name': str(customer_name),
+            'customer_phone': str(field('customer_phone', 'phone') or 'Не указан'),
+            'customer_email': str(field('customer_email', 'email') or 'Не указан'),
+            'source': str(field('source') or 'website'),
+            'interest': str(field('interest', 'tour_interest') or 'Общий интерес'),
+            'notes': str(field('notes', 'details') or ''),
+            'status': str(field('status') or 'new')
+        }
+        for optional in ('agent_id', 'external_id', 'external_source'):
+            value = field(optional)
+            if value is not None:
+                lead_data[optional] = str(value)
+        return lead_data
+    
+    @staticmethod
+    def create_leads_bulk(rows, chunk_size=500, max_errors=1000, dedupe=True):
+        """
+        Import many leads with batched multi-row inserts
+        
+        Rows are consumed lazily, normalized in chunks and each chunk is
+        inserted with one call. If a chunk insert fails, its rows are retried
+        one by one so that only the bad rows are reported.
+        
+        With dedupe, rows whose normalized phone or email matches an existing
+        lead (one lookup per chunk) or an earlier row of the import are
+        skipped, as create_lead would. Unlike create_lead, no repeat inquiry
+        is recorded on the existing lead.
+        
+        Args:
+            rows (iterable): Raw lead dicts; Exception items are reported
+                as errors for that row (e.g. unparseable input lines)
+            chunk_size (int): Rows per insert call
+            max_errors (int): Maximum number of row errors (and of duplicate
+                rows) kept in the report
+            dedupe (bool): Skip rows that duplicate a known phone or email
+            
+        Returns:
+            dict: {'total', 'inserted', 'failed', 'duplicates',
+                'errors': [{'row', 'error'}],
+                'duplicate_rows': [{'row', 'lead_id' or 'duplicate_of_row'}]}
+        """
+        report = {'total': 0, 'inserted': 0, 'failed': 0, 'duplicates': 0, 'errors': [], 'duplicate_rows': []}
+        
+        def fail(row_number, error):
+            report['failed'] += 1
+            if len(report['errors']) < max_errors:
+                report['errors'].append({'row': row_number, 'error': str(error)})
+        
+        def skip_duplicates(batch):
+            pairs = [(field, lead_data[field]) for _, lead_data in batch
+                     for field in (PHONE_KEY_FIELD, EMAIL_KEY_FIELD) if lead_data.get(field)]
+            try:
+                known = LeadService.find_duplicate_ids(pairs)
+            except Exception as e:
+                logger.error(f"Duplicate lookup failed, importing {len(batch)} rows anyway: {e}")
+                known = {}
+            unique = []
+            for row_number, lead_data in batch:
+                keys = [(field, lead_data[field]) for field in (PHONE_KEY_FIELD, EMAIL_KEY_FIELD) if lead_data.get(field)]
+                match = next((known[key] for key in keys if key in known), None)
+                if match is None:
+                    # Later rows of the chunk are matched against this one
+                    for key in keys:
+                        known[key] = {'duplicate_of_row': row_number}
+                    unique.append((row_number, lead_data))
+                    continue
+                report['duplicates'] += 1
+                if len(report['duplicate_rows']) < max_errors:
+                    report['duplicate_rows'].append({'row': row_number, **match})
+            return unique
+        
+        def flush(batch):
+            if dedupe:
+                batch = skip_duplicates(batch)
+            if not batch:
+                return
+            if not is_supabase_available():
+                for _, lead_data in batch:
+                    _memory_leads.add(lead_data)
+                report['inserted'] += len(batch)
+                return
+            try:
+                supabase.table("leads").insert([lead_data for _, lead_data in batch],
+                                               returning='minimal').execute()
+                report['inserted'] += len(batch)
+            except Exception as e:
+                logger.warning(f"Bulk lead insert failed, retrying {len(batch)} rows one by one: {e}")
+                for row_number, lead_data in batch:
+                    try:
+                        supabase.table("leads").insert(lead_data, returning='minimal').execute()
+                        report['inserted'] += 1
+                    except Exception as row_error:
+                        fail(row_number, row_error)
+        
+        batch = []
+        for row_number, row in enumerate(rows, start=1):
+            report['total'] += 1
+            if isinstance(row, Exception):
+                fail(row_number, row)
+                continue
+            try:
+                lead_data = LeadService.normalize_lead_data(row)
+            except ValueError as e:
+                fail(row_number, e)
+                continue
+            lead_data['created_at'] = datetime.now().isoformat()
+            lead_data.update(contact_keys(lead_data))
+            batch.append((row_number, lead_data))
+            if len(batch) >= chunk_size:
+                flush(batch)
+                batch = []
+        flush(batch)
+        if report['inserted']:
+            LeadService.invalidate_lead_cache()
+            # Imported rows may carry agents; recount instead of tracking each
+            AssignmentService.invalidate()
+        
+        logger.info(f"Bulk lead import: {report['inserted']} inserted, {report['failed']} failed, "
+                    f"{report['duplicates']} duplicates skipped")
+        return report
+    
+    @staticmethod
+    def find_duplicate_ids(pairs, lookup_size=100):
+        """
+        Find the existing leads for many normalized phone/email keys
+        
+        Keys are looked up with one in (...) query per lookup_size keys
+        instead of one find_duplicate call per row.
+        
+        Args:
+            pairs (iterable): (PHONE_KEY_FIELD or EMAIL_KEY_FIELD, value) pairs
+            lookup_size (int): Keys per query
+            
+        Returns:
+            dict: (field, value) -> {'lead_id': ID of the oldest matching lead},
+                for the keys that match a lead
+        """
+        pairs = list(dict.fromkeys(pair for pair in pairs if pair[1]))
+        found = {}
+        if not pairs:
+            return found
+        
+        if not is_supabase_available():
+            for field, value in pairs:
+                lead = _memory_leads.find_by_contact({field: value})
+                if lead:
+                    found[(field, value)] = {'lead_id': lead['id']}
+            return found
+        
+        # Do not wait on a database that is already known to be failing
+        if _write_outbox.breaker.state != 'closed':
+            return found
+        for start in range(0, len(pairs), lookup_size):
+            wanted = set(pairs[start:start + lookup_size])
+            values = {}
+            for field, value in wanted:
+                values.setdefault(field, []).append(f'"{value}"')
+            filters = [f'{field}.in.({",".join(field_values)})' for field, field_values in values.items()]
+            result = (supabase.table("leads").select(f"id, created_at, {PHONE_KEY_FIELD}, {EMAIL_KEY_FIELD}")
+                      .or_(",".join(filters)).order("created_at").order("id").execute())
+            for lead in (result.data or []):
+                for field in (PHONE_KEY_FIELD, EMAIL_KEY_FIELD):
+                    pair = (field, lead.get(field))
+                    if pair in wanted:
+                        found.setdefault(pair, {'lead_id': lead['id']})
+        return found
+    
+    @staticmethod
+    def find_duplicate(lead_data):
+        """
+        Find an existing lead with the same normalized phone or email
+        
+        The lookup is a single index probe on phone_e164 / email_normalized
+        (see docs/SUPABASE_SCHEMA.md) in every storage backend.
+        
+        Args:
+            lead_data (dict): Lead fields with customer_phone / customer_email
+            
+        Returns:
+            dict: The oldest matching lead or None
+        """
+        keys = contact_keys(lead_data)
+        if not any(keys.values()):
+            return None
+        
+        if not is_supabase_available():
+            return _memory_leads.find_by_contact(keys)
+        
+        # Do not wait on a database that is already known to be failing
+        if _write_outbox.breaker.state != 'closed':
+            return None
+        filters = [f'{field}.eq."{value}"' for field, value in keys.items() if value]
+        query = supabase.table("leads").select("*").or_(",".join(filters))
+        result = query.order("created_at").order("id").limit(1).execute()
+        return result.data[0] if result.data else None
+    
+    @staticmethod
+    def create_lead(lead_data, dedupe=True):
         """
         Create a new lead in the Supabase database
         
@@ -301,10 +1539,32 @@ class LeadService:
                 - status: Lead status (new, contacted, qualified, converted, lost)
                 - agent_id: ID of the assigned agent (optional)
                 - notes: Additional notes (optional)
+                - idempotency_key: Client key that makes retries safe (optional)
+            dedupe (bool): Return the existing lead instead of creating a
+                new one when the phone or email is already known; the
+                new inquiry is recorded as an interaction on that lead
                 
         Returns:
-            dict: The created lead data with an ID
+            dict: The created lead data with an ID, the existing lead with
+                duplicate True, or the lead with id None and sync_status
+                'pending' if the insert was queued in the outbox
         """
+        lead_data.update(contact_keys(lead_data))
+        if dedupe:
+            try:
+                existing = LeadService.find_duplicate(lead_data)
+            except Exception as e:
+                logger.error(f"Duplicate lookup failed, creating lead anyway: {e}")
+                existing = None
+            key = lead_data.get('idempotency_key')
+            if existing and key and existing.get('idempotency_key') == key:
+                # A retry of the request that created this lead
+                return existing
+            if existing:
+                logger.info(f"Lead matches existing lead {existing.get('id')}, not creating a duplicate")
+                LeadService._record_repeat_inquiry(existing['id'], lead_data)
+                return dict(existing, duplicate=True)
+        
         # Проверка доступности Supabase, если недоступен - используем резервное хранилище
         if not is_supabase_available():
             return LeadService.create_lead_fallback(lead_data)
@@ -314,14 +1574,77 @@ class LeadService:
         if 'status' not in lead_data:
             lead_data['status'] = 'new'
         
-        # Insert into Supabase
-        result = supabase.table("leads").insert(lead_data).execute()
+        # Hand unassigned leads to the least loaded agent on duty
+        reserved_agent = None
+        if AssignmentService.AUTO_ASSIGN and not lead_data.get('agent_id'):
+            reserved_agent = AssignmentService.pick_agent()
+            if reserved_agent:
+                lead_data['agent_id'] = reserved_agent
         
-        # Return the created lead
-        return result.data[0] if result.data else None
+        # Insert into Supabase, or queue the insert while it is unreachable
+        try:
+            lead = LeadService._insert_or_defer("leads", lead_data)
+        except Exception:
+            if reserved_agent:
+                _lead_assigner.release(reserved_agent)
+            raise
+        if lead and lead.get('id') is not None:
+            LeadService._cache_lead(lead)
+            _lead_assigner.observe(lead)
+        elif reserved_agent:
+            # Queued: the lead still counts, its ID is picked up by the next resync
+            _lead_assigner.release(reserved_agent, keep_load=True)
+        return lead
+    
+    @staticmethod
+    def _record_repeat_inquiry(lead_id, lead_data):
+        # Keep what the customer asked this time on the lead they already have
+        lines = [f"Повторное обращение ({lead_data.get('source') or 'website'})"]
+        interest = lead_data.get('interest')
+        if interest and interest != 'Общий интерес':
+            lines.append(f"Интерес: {interest}")
+        if lead_data.get('notes'):
+            lines.append(str(lead_data['notes']))
+        interaction = {'type': 'repeat_inquiry', 'notes': '\n'.join(lines)}
+        if lead_data.get('idempotency_key'):
+            # A retried request must not record the inquiry twice
+            interaction['idempotency_key'] = lead_data['idempotency_key']
+        try:
+            LeadService.add_lead_interaction(lead_id, interaction)
+        except Exception as e:
+            logger.error(f"Could not record repeat inquiry on lead {lead_id}: {e}")
+    
+    @staticmethod
+    def encode_cursor(lead):
+        """
+        Build an opaque pagination cursor pointing after the given lead
+        
+        Args:
+            lead (dict): The last lead of the current page
+            
+        Returns:
+            str: URL-safe cursor encoding (created_at, id)
+        """
+        return encode_keyset_cursor(lead.get('created_at'), lead.get('id'))
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Decode a cursor produced by encode_cursor
+        
+        Args:
+            cursor (str): The opaque cursor
+            
+        Returns:
+            tuple: (created_at, id)
+            
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        return decode_keyset_cursor(cursor)
     
     @staticmethod
-    def get_leads_fallback(limit=100, status=None, agent_id=None):
+    def get_leads_fallback(limit=100, status=None, agent_id=None, cursor=None):
         """
         Get all leads from memory storage when database is unavailable
         
@@ -329,28 +1652,87 @@ class LeadService:
             limit (int): Maximum number of leads to return
             status (str, optional): Filter by lead status
             agent_id (str, optional): Filter by assigned agent
+            cursor (tuple, optional): Decoded (created_at, id) to start after
             
         Returns:
             list: List of leads sorted by created_at (newest first)
         """
-        global _memory_leads
-        filtered_leads = _memory_leads.copy()
+        return _memory_leads.list(limit, status=status or None, agent_id=agent_id or None,
+                                  before=cursor)
+    
+    @staticmethod
+    def get_leads_page(limit=100, status=None, agent_id=None, cursor=None, view='full', use_cache=True):
+        """
+        Get one page of leads ordered by (created_at, id), newest first
         
-        # Apply filters
-        if status:
-            filtered_leads = [lead for lead in filtered_leads if lead.get('status') == status]
+        Uses keyset pagination, so deep pages cost the same as the first
+        one. Backed by the (created_at, id) indexes in docs/SUPABASE_SCHEMA.md.
         
-        if agent_id:
-            filtered_leads = [lead for lead in filtered_leads if lead.get('agent_id') == agent_id]
+        Args:
+            limit (int): Maximum number of leads to return
+            status (str, optional): Filter by lead status
+            agent_id (str, optional): Filter by assigned agent
+            cursor (str, optional): next_cursor from the previous page
+            view (str): Column profile from LEAD_VIEWS (list, card, full)
+            use_cache (bool): Read and fill the short-lived page cache
+            
+        Returns:
+            dict: {'leads': list, 'next_cursor': str or None}
+            
+        Raises:
+            ValueError: If the cursor or view is invalid, or limit is below 1
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        position = LeadService.decode_cursor(cursor) if cursor else None
+        columns = select_columns(LEAD_VIEWS, view)
         
-        # Sort by created_at, newest first
-        filtered_leads.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+        # Fetch one extra row to know whether another page exists
+        page_key = None
+        if not is_supabase_available():
+            leads = LeadService.get_leads_fallback(limit + 1, status, agent_id, position)
+            leads = [project_record(lead, LEAD_VIEWS, view) for lead in leads]
+        else:
+            if use_cache:
+                page_key = (limit, status, agent_id, cursor, view)
+                cached = LeadService._page_cache.get(page_key)
+                if cached is not MISSING:
+                    return {'leads': [dict(lead) for lead in cached['leads']],
+                            'next_cursor': cached['next_cursor']}
+            
+            query = supabase.table("leads").select(columns)
             
-        # Apply limit
-        return filtered_leads[:limit]
+            if status:
+                query = query.eq("status", status)
+            
+            if agent_id:
+                query = query.eq("agent_id", agent_id)
+            
+            if position:
+                created_at, lead_id = position
+                query = query.or_(
+                    f'created_at.lt."{created_at}",'
+                    f'and(created_at.eq."{created_at}",id.lt."{lead_id}")'
+                )
+            
+            query = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+            result = query.execute()
+            leads = result.data if result.data else []
+        
+        next_cursor = None
+        if len(leads) > limit:
+            leads = leads[:limit]
+            next_cursor = LeadService.encode_cursor(leads[-1])
+        
+        if page_key is not None:
+            LeadService._page_cache.set(page_key, {
+                'leads': [dict(lead) for lead in leads],
+                'next_cursor': next_cursor
+            })
+        return {'leads': leads, 'next_cursor': next_cursor}
     
     @staticmethod
-    def get_leads(limit=100, status=None, agent_id=None):
+    def get_leads(limit=100, status=None, agent_id=None, cursor=None, view='full'):
         """
         Get all leads, optionally filtered by status or agent
         
@@ -358,24 +1740,38 @@ class LeadService:
             limit (int): Maximum number of leads to return
             status (str, optional): Filter by lead status
             agent_id (str, optional): Filter by assigned agent
+            cursor (str, optional): Cursor from get_leads_page to continue after
+            view (str): Column profile from LEAD_VIEWS (list, card, full)
             
         Returns:
-            list: List of leads
+            list: List of leads, newest first
         """
-        # Проверка доступности Supabase
-        if not is_supabase_available():
-            return LeadService.get_leads_fallback(limit, status, agent_id)
-            
-        query = supabase.table("leads").select("*").limit(limit)
+        return LeadService.get_leads_page(limit, status, agent_id, cursor, view)['leads']
+    
+    @staticmethod
+    def iter_leads(batch_size=1000, status=None, agent_id=None, view='full'):
+        """
+        Iterate over all matching leads, newest first, one keyset page at a time
         
-        if status:
-            query = query.eq("status", status)
+        Only one page is held in memory and pages bypass the page cache, so
+        scanning the whole table costs the same memory as reading one page.
         
-        if agent_id:
-            query = query.eq("agent_id", agent_id)
-            
-        result = query.execute()
-        return result.data if result.data else []
+        Args:
+            batch_size (int): Leads fetched per query
+            status (str, optional): Filter by lead status
+            agent_id (str, optional): Filter by assigned agent
+            view (str): Column profile from LEAD_VIEWS (list, card, full)
+        
+        Yields:
+            dict: Lead data
+        """
+        cursor = None
+        while True:
+            page = LeadService.get_leads_page(batch_size, status, agent_id, cursor, view, use_cache=False)
+            yield from page['leads']
+            cursor = page['next_cursor']
+            if not cursor:
+                return
     
     @staticmethod
     def get_lead_fallback(lead_id):
@@ -388,32 +1784,74 @@ class LeadService:
         Returns:
             dict: The lead data or None if not found
         """
-        global _memory_leads
-        
-        # Find lead by ID
-        for lead in _memory_leads:
-            if lead.get('id') == lead_id:
-                return lead
-                
-        return None
+        return _memory_leads.get(lead_id)
     
     @staticmethod
-    def get_lead(lead_id):
+    def get_lead(lead_id, view='full'):
         """
         Get a specific lead by ID
         
         Args:
             lead_id (str): The lead ID
+            view (str): Column profile from LEAD_VIEWS (list, card, full)
             
         Returns:
             dict: The lead data or None if not found
         """
         # Проверка доступности Supabase
         if not is_supabase_available():
-            return LeadService.get_lead_fallback(lead_id)
+            return project_record(LeadService.get_lead_fallback(lead_id), LEAD_VIEWS, view)
             
-        result = supabase.table("leads").select("*").eq("id", lead_id).execute()
-        return result.data[0] if result.data else None
+        cache_key = (str(lead_id), view)
+        cached = LeadService._lead_cache.get(cache_key)
+        if cached is not MISSING:
+            return dict(cached)
+        
+        result = supabase.table("leads").select(select_columns(LEAD_VIEWS, view)).eq("id", lead_id).execute()
+        lead = result.data[0] if result.data else None
+        if lead:
+            LeadService._lead_cache.set(cache_key, dict(lead))
+        return lead
+    
+    @staticmethod
+    def search_leads(query, limit=20, view='list'):
+        """
+        Search leads by partial name, phone, email or notes
+        
+        Matching is trigram based: a query contained in the lead scores 1,
+        otherwise leads sharing most of the query's trigrams are returned
+        too, so typos still match. Supabase runs the search_leads RPC over
+        a pg_trgm GIN index (see docs/SUPABASE_SCHEMA.md); the fallback
+        stores keep their own trigram index.
+        
+        Args:
+            query (str): Search text; phone-like queries match by digits
+            limit (int): Maximum number of results
+            view (str): Column profile from LEAD_VIEWS (list, card, full)
+        
+        Returns:
+            list: Leads with a 'score' between 0 and 1, best match first
+        
+        Raises:
+            ValueError: If the query is shorter than MIN_QUERY_LENGTH or the view is invalid
+        """
+        select_columns(LEAD_VIEWS, view)
+        normalized = normalize_search_query(query)
+        if len(normalized) < MIN_QUERY_LENGTH:
+            raise ValueError(f"Search query must be at least {MIN_QUERY_LENGTH} characters")
+        
+        if not is_supabase_available():
+            matches = _memory_leads.search(normalized, limit)
+        else:
+            result = supabase.rpc('search_leads', {'p_query': normalized, 'p_limit': limit}).execute()
+            matches = [(row['lead'], row['score']) for row in result.data or []]
+        
+        leads = []
+        for lead, score in matches:
+            lead = dict(project_record(lead, LEAD_VIEWS, view))
+            lead['score'] = score
+            leads.append(lead)
+        return leads
     
     @staticmethod
     def update_lead_fallback(lead_id, update_data):
@@ -427,19 +1865,11 @@ class LeadService:
         Returns:
             dict: The updated lead data or None if not found
         """
-        global _memory_leads
+        # Add updated timestamp
+        update_data['updated_at'] = datetime.now().isoformat()
+        update_data.update(contact_key_updates(update_data))
         
-        # Find the lead to update
-        for i, lead in enumerate(_memory_leads):
-            if lead.get('id') == lead_id:
-                # Add updated timestamp
-                update_data['updated_at'] = datetime.now().isoformat()
-                
-                # Update the lead data
-                _memory_leads[i].update(update_data)
-                return _memory_leads[i]
-                
-        return None
+        return _memory_leads.update(lead_id, update_data)
     
     @staticmethod
     def update_lead_status_fallback(lead_id, status):
@@ -472,8 +1902,9 @@ class LeadService:
             return LeadService.update_lead_fallback(lead_id, update_data)
             
         update_data['updated_at'] = datetime.now().isoformat()
+        update_data.update(contact_key_updates(update_data))
         result = supabase.table("leads").update(update_data).eq("id", lead_id).execute()
-        return result.data[0] if result.data else None
+        return LeadService._write_through(lead_id, result.data[0] if result.data else None)
     
     @staticmethod
     def update_lead_status(lead_id, status):
@@ -497,8 +1928,80 @@ class LeadService:
         }
         
         result = supabase.table("leads").update(update_data).eq("id", lead_id).execute()
-        return result.data[0] if result.data else None
+        return LeadService._write_through(lead_id, result.data[0] if result.data else None)
+        
+    @staticmethod
+    def update_lead_statuses(transitions, chunk_size=200):
+        """
+        Apply many status transitions with as few statements as possible
         
+        Transitions are grouped by target status and each group is written
+        with one update ... in (ids) statement per chunk of IDs. When the same
+        lead appears more than once, its last transition wins.
+        
+        Args:
+            transitions (iterable): (lead_id, status) pairs
+            chunk_size (int): Maximum number of IDs per statement
+            
+        Returns:
+            list: Per-item results in input order:
+                {'lead_id', 'status', 'success', 'error' (on failure)}
+        """
+        items = []
+        latest = {}
+        for lead_id, status in transitions:
+            lead_id = str(lead_id) if lead_id is not None else ''
+            status = status if isinstance(status, str) else ''
+            items.append((lead_id, status))
+            if lead_id and status:
+                latest[lead_id] = status
+        
+        by_status = {}
+        for lead_id, status in latest.items():
+            by_status.setdefault(status, []).append(lead_id)
+        
+        updated_at = datetime.now().isoformat()
+        outcome = {}
+        for status, lead_ids in by_status.items():
+            for start in range(0, len(lead_ids), chunk_size):
+                chunk = lead_ids[start:start + chunk_size]
+                if not is_supabase_available():
+                    for lead_id in chunk:
+                        found = _memory_leads.update(lead_id, {'status': status, 'updated_at': updated_at})
+                        outcome[lead_id] = None if found else 'Lead not found'
+                    continue
+                try:
+                    result = supabase.table("leads").update({
+                        'status': status,
+                        'updated_at': updated_at
+                    }).in_("id", chunk).execute()
+                    found_ids = set()
+                    for row in (result.data or []):
+                        found_ids.add(str(row.get('id')))
+                        LeadService._cache_lead(row)
+                        _lead_assigner.observe(row)
+                    for lead_id in chunk:
+                        outcome[lead_id] = None if lead_id in found_ids else 'Lead not found'
+                except Exception as e:
+                    logger.error(f"Bulk status update to '{status}' failed: {e}")
+                    for lead_id in chunk:
+                        outcome[lead_id] = str(e)
+        
+        results = []
+        for lead_id, status in items:
+            if not lead_id or not status:
+                results.append({'lead_id': lead_id, 'status': status, 'success': False,
+                                'error': 'lead_id and status are required'})
+            elif latest[lead_id] != status:
+                results.append({'lead_id': lead_id, 'status': status, 'success': False,
+                                'error': f"Superseded by a later transition to '{latest[lead_id]}'"})
+            elif outcome.get(lead_id):
+                results.append({'lead_id': lead_id, 'status': status, 'success': False,
+                                'error': outcome[lead_id]})
+            else:
+                results.append({'lead_id': lead_id, 'status': status, 'success': True})
+        return results
+    
     @staticmethod
     def add_lead_interaction_fallback(lead_id, interaction_data):
         """
@@ -511,17 +2014,12 @@ class LeadService:
         Returns:
             dict: The created interaction data
         """
-        global _memory_lead_interactions
-        
         # Add lead ID and creation timestamp
         interaction_data['lead_id'] = lead_id
         interaction_data['created_at'] = datetime.now().isoformat()
         
-        # Generate a unique ID
-        interaction_data['id'] = str(len(_memory_lead_interactions) + 1)
-        
-        # Add to memory store
-        _memory_lead_interactions.append(interaction_data)
+        # Add to memory store (assigns a unique ID)
+        _memory_lead_interactions.add(lead_id, interaction_data)
         
         logger.info(f"Used fallback storage to add interaction to lead {lead_id}")
         return interaction_data
@@ -539,7 +2037,8 @@ class LeadService:
                 - agent_id: ID of the agent who performed the interaction
                 
         Returns:
-            dict: The created interaction data
+            dict: The created interaction data (id None and sync_status
+                'pending' if the insert was queued in the outbox)
         """
         # Проверка доступности Supabase
         if not is_supabase_available():
@@ -548,8 +2047,7 @@ class LeadService:
         interaction_data['lead_id'] = lead_id
         interaction_data['created_at'] = datetime.now().isoformat()
         
-        result = supabase.table("lead_interactions").insert(interaction_data).execute()
-        return result.data[0] if result.data else None
+        return LeadService._insert_or_defer("lead_interactions", interaction_data)
     
     @staticmethod
     def add_interaction(lead_id, interaction_data):
@@ -572,12 +2070,7 @@ class LeadService:
         """
         # Проверка доступности Supabase
         if not is_supabase_available():
-            global _memory_leads
-            for lead in _memory_leads:
-                if (lead.get('external_id') == external_id and 
-                    lead.get('external_source') == external_source):
-                    return lead
-            return None
+            return _memory_leads.get_by_external_id(external_id, external_source)
             
         try:
             result = supabase.table("leads").select("*").eq("external_id", external_id).eq("external_source", external_source).execute()
@@ -595,18 +2088,10 @@ class LeadService:
             lead_id (str): The lead ID
             
         Returns:
-            list: List of interactions
+            list: List of interactions, newest first
         """
-        global _memory_lead_interactions
-        
-        # Filter interactions by lead ID
-        interactions = [interaction for interaction in _memory_lead_interactions 
-                      if interaction.get('lead_id') == lead_id]
-                      
-        # Sort by created_at, descending
-        interactions.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        
-        return interactions
+        # Per-lead history is kept in insertion order, newest first on read
+        return _memory_lead_interactions.list(lead_id)
     
     @staticmethod
     def get_lead_interactions(lead_id):
@@ -626,6 +2111,244 @@ class LeadService:
         result = supabase.table("lead_interactions").select("*").eq("lead_id", lead_id).order("created_at", desc=True).execute()
         return result.data if result.data else []
 
+    @staticmethod
+    def get_interactions_page(after_id=None, limit=1000):
+        """
+        Get interactions of all leads in ID order, one keyset page
+        
+        Args:
+            after_id (str, optional): Last interaction ID of the previous page
+            limit (int): Maximum number of interactions
+        
+        Returns:
+            list: Interactions with IDs greater than after_id, lowest first
+        """
+        if not is_supabase_available():
+            return _memory_lead_interactions.page(after_id, limit)
+        
+        query = supabase.table("lead_interactions").select("*")
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        result = query.order("id").limit(limit).execute()
+        return result.data if result.data else []
+    
+    @staticmethod
+    def iter_interactions(batch_size=1000):
+        """
+        Iterate over the interactions of all leads in ID order, one page at a time
+        
+        Yields:
+            dict: Interaction data
+        """
+        after_id = None
+        while True:
+            interactions = LeadService.get_interactions_page(after_id, batch_size)
+            yield from interactions
+            if len(interactions) < batch_size:
+                return
+            after_id = interactions[-1]['id']
+    
+    @staticmethod
+    def get_leads_by_ids(lead_ids, view='full'):
+        """
+        Get many leads with a single id in (...) query
+        
+        Args:
+            lead_ids (list): Lead IDs
+            view (str): Column profile from LEAD_VIEWS (list, card, full)
+        
+        Returns:
+            dict: lead ID -> lead data, for the leads that exist
+        """
+        lead_ids = [str(lead_id) for lead_id in dict.fromkeys(lead_ids) if lead_id is not None]
+        if not lead_ids:
+            return {}
+        
+        if is_supabase_available():
+            try:
+                result = supabase.table("leads").select(select_columns(LEAD_VIEWS, view)).in_("id", lead_ids).execute()
+                return {str(lead['id']): lead for lead in (result.data or [])}
+            except Exception as e:
+                logger.error(f"Failed to get leads from database: {e}")
+        
+        leads = (LeadService.get_lead_fallback(lead_id) for lead_id in lead_ids)
+        return {lead['id']: project_record(lead, LEAD_VIEWS, view) for lead in leads if lead}
+    
+    @staticmethod
+    def get_interactions_for_leads(lead_ids, limit_per_lead=INTERACTIONS_PER_LEAD):
+        """
+        Get the latest interactions of many leads with a single lead_id in (...) query
+        
+        The query is capped at limit_per_lead rows per requested lead,
+        newest first across all of them, and each lead keeps at most
+        limit_per_lead. A lead whose interactions are all older than the
+        capped window can therefore come back with fewer (or none); use
+        get_lead_interactions for one lead's full history.
+        
+        Args:
+            lead_ids (list): Lead IDs
+            limit_per_lead (int): Maximum interactions returned per lead
+            
+        Returns:
+            dict: lead ID -> list of interactions, newest first
+        """
+        lead_ids = [str(lead_id) for lead_id in dict.fromkeys(lead_ids) if lead_id is not None]
+        if not lead_ids:
+            return {}
+        
+        if not is_supabase_available():
+            return {lead_id: LeadService.get_lead_interactions_fallback(lead_id)[:limit_per_lead]
+                    for lead_id in lead_ids}
+        
+        result = (supabase.table("lead_interactions").select("*").in_("lead_id", lead_ids)
+                  .order("created_at", desc=True).limit(limit_per_lead * len(lead_ids)).execute())
+        interactions = {lead_id: [] for lead_id in lead_ids}
+        for interaction in (result.data or []):
+            lead_interactions = interactions.setdefault(str(interaction['lead_id']), [])
+            if len(lead_interactions) < limit_per_lead:
+                lead_interactions.append(interaction)
+        return interactions
+
+    @staticmethod
+    def backfill_dedupe_keys(batch_size=1000, dry_run=False):
+        """
+        Fill normalized phone/email keys on existing leads and report duplicates
+        
+        All leads are read once in keyset pages of the 'contact' view. Rows
+        whose stored keys are missing or stale get an update of just the
+        key columns (unless dry_run); a lead deleted since it was read is
+        simply not updated. Duplicates are clustered with a hash join on the
+        keys instead of comparing every pair of leads.
+        
+        Args:
+            batch_size (int): Leads read per page
+            dry_run (bool): Only report, do not write keys
+            
+        Returns:
+            dict: {'scanned', 'updated', 'failed', 'duplicate_leads', 'clusters'}
+        """
+        report = {'scanned': 0, 'updated': 0, 'failed': 0}
+        contacts = []
+        
+        def write(lead, keys):
+            try:
+                if is_supabase_available():
+                    # An update never inserts, unlike an upsert on id
+                    supabase.table("leads").update(keys, returning='minimal').eq("id", lead['id']).execute()
+                else:
+                    _memory_leads.update(lead['id'], keys)
+                report['updated'] += 1
+            except Exception as e:
+                logger.error(f"Could not backfill dedupe keys for lead {lead['id']}: {e}")
+                report['failed'] += 1
+        
+        for lead in LeadService.iter_leads(batch_size=batch_size, view='contact'):
+            report['scanned'] += 1
+            keys = contact_keys(lead)
+            contacts.append({'id': lead['id'], 'created_at': lead.get('created_at'), **keys})
+            if not dry_run and any(lead.get(field) != value for field, value in keys.items()):
+                write(lead, keys)
+        
+        if report['updated']:
+            LeadService.invalidate_lead_cache()
+        clusters = find_duplicate_clusters(contacts)
+        report['duplicate_leads'] = sum(len(cluster['duplicate_ids']) for cluster in clusters)
+        report['clusters'] = clusters
+        logger.info(f"Dedupe backfill: {report['scanned']} scanned, {report['updated']} updated, "
+                    f"{len(clusters)} duplicate clusters")
+        return report
+
+
+class LeadStatsService:
+    """Service class for aggregated lead statistics (dashboard counters)"""
+    
+    # Dashboard numbers may lag by a few seconds
+    _stats_cache = TTLCache(ttl=int(os.environ.get('LEAD_STATS_CACHE_TTL', 30)))
+    # Counting in the app reads every lead, so its result is kept much longer
+    _fallback_cache = TTLCache(ttl=int(os.environ.get('LEAD_STATS_FALLBACK_TTL', 900)))
+    _fallback_lock = threading.Lock()
+    
+    @staticmethod
+    def get_lead_stats(days=30):
+        """
+        Get lead counts grouped by status, source, agent and creation day
+        
+        Counts are computed inside the database by the lead_stats RPC (see
+        docs/SUPABASE_SCHEMA.md) or read from the incrementally maintained
+        counters of the fallback store, and cached for a short TTL. If the
+        RPC is missing or fails, an error is logged and the leads are
+        scanned and counted here; that result is reused for
+        LEAD_STATS_FALLBACK_TTL seconds (15 minutes by default).
+        
+        Args:
+            days (int): Number of recent days included in by_day
+            
+        Returns:
+            dict: {'total', 'by_status', 'by_source', 'by_agent', 'by_day',
+                   'days', 'generated_at'}
+        """
+        cached = LeadStatsService._stats_cache.get(days)
+        if cached is not MISSING:
+            return dict(cached)
+        
+        since_day = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        if is_supabase_available():
+            try:
+                result = supabase.rpc('lead_stats', {'p_since': since_day}).execute()
+                stats = result.data or {}
+                stats = {
+                    'total': stats.get('total', 0),
+                    'by_status': stats.get('by_status') or {},
+                    'by_source': stats.get('by_source') or {},
+                    'by_agent': stats.get('by_agent') or {},
+                    'by_day': stats.get('by_day') or {}
+                }
+            except Exception as e:
+                logger.error(f"lead_stats RPC failed, counting leads in the app, which reads every lead; "
+                             f"install the function from docs/SUPABASE_SCHEMA.md - {e}")
+                stats = LeadStatsService._count_leads_cached(since_day)
+        else:
+            stats = _memory_leads.stats(since_day=since_day)
+        
+        stats['days'] = days
+        stats['generated_at'] = datetime.now().isoformat()
+        LeadStatsService._stats_cache.set(days, stats)
+        return dict(stats)
+    
+    @staticmethod
+    def _count_leads_cached(since_day):
+        # One worker thread scans at a time; the others wait for its result
+        with LeadStatsService._fallback_lock:
+            stats = LeadStatsService._fallback_cache.get(since_day)
+            if stats is MISSING:
+                stats = LeadStatsService._count_leads(since_day)
+                LeadStatsService._fallback_cache.set(since_day, stats)
+            return copy.deepcopy(stats)
+    
+    @staticmethod
+    def _count_leads(since_day):
+        # Slow path for databases without the lead_stats function: one
+        # keyset scan of the 'list' view, counted in Python
+        stats = {'total': 0, 'by_status': {}, 'by_source': {}, 'by_agent': {}, 'by_day': {}}
+        for lead in LeadService.iter_leads(view='list'):
+            stats['total'] += 1
+            for group, field in (('by_status', 'status'), ('by_source', 'source'), ('by_agent', 'agent_id')):
+                value = lead.get(field)
+                if value is not None:
+                    stats[group][str(value)] = stats[group].get(str(value), 0) + 1
+            day = (lead.get('created_at') or '')[:10]
+            if day and day >= since_day:
+                stats['by_day'][day] = stats['by_day'].get(day, 0) + 1
+        stats['by_day'] = dict(sorted(stats['by_day'].items()))
+        return stats
+    
+    @staticmethod
+    def invalidate():
+        """Drop cached statistics"""
+        LeadStatsService._stats_cache.clear()
+        LeadStatsService._fallback_cache.clear()
+
+
 class AgentService:
     """Service class for handling travel agents in Supabase database"""
     
@@ -653,21 +2376,26 @@ class AgentService:
         result = supabase.table("agents").insert(agent_data).execute()
         
         # Return the created agent
-        return result.data[0] if result.data else None
+        agent = result.data[0] if result.data else None
+        if agent:
+            _lead_assigner.set_agent(agent)
+            AgentService._remember(agent)
+        return agent
     
     @staticmethod
-    def get_agents(limit=100, status='active'):
+    def get_agents(limit=100, status='active', view='full'):
         """
         Get all agents, optionally filtered by status
         
         Args:
             limit (int): Maximum number of agents to return
             status (str, optional): Filter by agent status
+            view (str): Column profile from AGENT_VIEWS (list, card, full)
             
         Returns:
             list: List of agents
         """
-        query = supabase.table("agents").select("*").limit(limit)
+        query = supabase.table("agents").select(select_columns(AGENT_VIEWS, view)).limit(limit)
         
         if status:
             query = query.eq("status", status)
@@ -676,19 +2404,59 @@ class AgentService:
         return result.data if result.data else []
     
     @staticmethod
-    def get_agent(agent_id):
+    def get_agent(agent_id, view='full'):
         """
         Get a specific agent by ID
         
         Args:
             agent_id (str): The agent ID
+            view (str): Column profile from AGENT_VIEWS (list, card, full)
             
         Returns:
             dict: The agent data or None if not found
         """
-        result = supabase.table("agents").select("*").eq("id", agent_id).execute()
+        result = supabase.table("agents").select(select_columns(AGENT_VIEWS, view)).eq("id", agent_id).execute()
         return result.data[0] if result.data else None
     
+    @staticmethod
+    def get_agents_by_ids(agent_ids, view='full'):
+        """
+        Get many agents with a single id in (...) query
+        
+        Args:
+            agent_ids (list): Agent IDs
+            view (str): Column profile from AGENT_VIEWS (list, card, full)
+            
+        Returns:
+            dict: agent ID -> agent data, for the agents that exist
+        """
+        agent_ids = [str(agent_id) for agent_id in dict.fromkeys(agent_ids) if agent_id is not None]
+        if not agent_ids:
+            return {}
+        
+        if is_supabase_available():
+            try:
+                result = supabase.table("agents").select(select_columns(AGENT_VIEWS, view)).in_("id", agent_ids).execute()
+                agents = {str(agent['id']): agent for agent in (result.data or [])}
+                for agent in agents.values():
+                    AgentService._remember(agent)
+                return agents
+            except Exception as e:
+                logger.error(f"Failed to get agents from database: {e}")
+        
+        # Serve the last known rows
+        return {agent_id: project_record(_memory_agents[agent_id], AGENT_VIEWS, view)
+                for agent_id in agent_ids if agent_id in _memory_agents}
+    
+    @staticmethod
+    def _remember(agent):
+        # Merge into the fallback copy, writing only when something changed
+        agent_id = str(agent['id'])
+        known = _memory_agents.get(agent_id) or {}
+        merged = {**known, **agent}
+        if merged != known:
+            _memory_agents[agent_id] = merged
+    
     @staticmethod
     def update_agent(agent_id, update_data):
         """
@@ -703,12 +2471,285 @@ class AgentService:
         """
         update_data['updated_at'] = datetime.now().isoformat()
         result = supabase.table("agents").update(update_data).eq("id", agent_id).execute()
-        return result.data[0] if result.data else None
+        agent = result.data[0] if result.data else None
+        if agent:
+            _lead_assigner.set_agent(agent)
+            AgentService._remember(agent)
+        return agent
+
+
+# Open-lead load of every active agent, maintained in place by lead writes
+_lead_assigner = LeadAssigner()
+
+class AssignmentService:
+    """Service class for automatic lead assignment to the least loaded agent"""
+    
+    AUTO_ASSIGN = os.environ.get('AUTO_ASSIGN_LEADS', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Leads written by other workers or directly in the database are only
+    # seen by a full reload, so loads are rebuilt this often
+    RESYNC_SECONDS = int(os.environ.get('ASSIGNMENT_RESYNC_SECONDS', 300))
+    
+    _sync_lock = threading.Lock()
+    _synced_at = None
+    
+    @staticmethod
+    def resync():
+        """
+        Reload active agents and open-lead counts from the database
+        
+        Open assigned leads are read in keyset pages of (id, agent_id) from
+        the leads_open_agent_idx partial index (see docs/SUPABASE_SCHEMA.md).
+        
+        Returns:
+            dict: The new assignment state, as returned by get_agent_loads
+        """
+        if not is_supabase_available():
+            return _lead_assigner.stats()
+        
+        agents = supabase.table("agents").select(select_columns(AGENT_VIEWS, 'assignment')).eq("status", "active").execute()
+        closed = ','.join(f'"{status}"' for status in sorted(CLOSED_LEAD_STATUSES))
+        open_leads = []
+        after_id = None
+        while True:
+            query = supabase.table("leads").select("id, agent_id").filter("agent_id", "not.is", "null")
+            query = query.or_(f"status.is.null,status.not.in.({closed})")
+            if after_id is not None:
+                query = query.gt("id", after_id)
+            rows = query.order("id").limit(1000).execute().data or []
+            open_leads.extend((row['id'], row['agent_id']) for row in rows)
+            if len(rows) < 1000:
+                break
+            after_id = rows[-1]['id']
+        
+        _lead_assigner.load(agents.data or [], open_leads)
+        AssignmentService._synced_at = time.monotonic()
+        logger.info(f"Assignment state loaded: {len(agents.data or [])} agents, {len(open_leads)} open leads")
+        return _lead_assigner.stats()
+    
+    @staticmethod
+    def invalidate():
+        """Rebuild loads from the database before the next assignment"""
+        AssignmentService._synced_at = None
+    
+    @staticmethod
+    def _ensure_synced():
+        synced_at = AssignmentService._synced_at
+        if synced_at is not None and time.monotonic() - synced_at < AssignmentService.RESYNC_SECONDS:
+            return
+        with AssignmentService._sync_lock:
+            if AssignmentService._synced_at is synced_at:
+                AssignmentService.resync()
+    
+    @staticmethod
+    def pick_agent():
+        """
+        Reserve the next lead for the least loaded active agent on duty
+        
+        The reservation is settled when a lead with that agent is written;
+        callers that end up not writing it must call _lead_assigner.release.
+        
+        Returns:
+            str: Agent ID, or None if no agent is available
+        """
+        if not is_supabase_available():
+            return None
+        try:
+            AssignmentService._ensure_synced()
+        except Exception as e:
+            logger.error(f"Could not load assignment state, lead left unassigned: {e}")
+            return None
+        return _lead_assigner.pick_agent()
+    
+    @staticmethod
+    def assign_lead(lead_id):
+        """
+        Assign an existing lead to the least loaded agent on duty
+        
+        Args:
+            lead_id (str): The lead ID
+        
+        Returns:
+            dict: The updated lead, or None if no agent is available or the
+                lead does not exist
+        """
+        agent_id = AssignmentService.pick_agent()
+        if not agent_id:
+            return None
+        previous_agent = _lead_assigner.agent_of(lead_id)
+        try:
+            lead = LeadService.update_lead(lead_id, {'agent_id': agent_id})
+        except Exception:
+            _lead_assigner.release(agent_id)
+            raise
+        # The write settles the reservation only if it opened the lead for
+        # this agent; a closed lead or a lead already held by the agent
+        # leaves it outstanding
+        if previous_agent == agent_id or _lead_assigner.agent_of(lead_id) != agent_id:
+            _lead_assigner.release(agent_id)
+        return lead
+    
+    @staticmethod
+    def get_agent_loads():
+        """
+        Get the open-lead load, weight and availability of every active agent
+        
+        Returns:
+            dict: {'agents': {agent_id: {...}}, 'open_leads', 'loaded_at'}
+        """
+        if is_supabase_available():
+            AssignmentService._ensure_synced()
+        return _lead_assigner.stats()
+
+
+class _AgentUsageBuffer:
+    """
+    Write-behind buffer for AI agent usage counters
+    
+    Counters are accumulated in memory per agent and flushed periodically
+    by a daemon thread as atomic increments (increment_ai_agent_usage RPC,
+    see docs/SUPABASE_SCHEMA.md), plus a final flush at interpreter exit.
+    Request threads only touch the in-memory dict.
+    """
+    
+    def __init__(self, flush_interval=30):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+    
+    def record(self, agent_id, successful=True):
+        """Count one call for an agent"""
+        with self._lock:
+            counters = self._pending.setdefault(agent_id, {
+                'total_calls': 0,
+                'successful_calls': 0,
+                'failed_calls': 0,
+                'last_used': None
+            })
+            counters['total_calls'] += 1
+            if successful:
+                counters['successful_calls'] += 1
+            else:
+                counters['failed_calls'] += 1
+            counters['last_used'] = datetime.now().isoformat()
+            self._ensure_flusher()
+        return dict(counters)
+    
+    def pending(self):
+        """Get a snapshot of counters not yet flushed"""
+        with self._lock:
+            return {agent_id: dict(counters) for agent_id, counters in self._pending.items()}
+    
+    def _ensure_flusher(self):
+        # Threads do not survive fork, so (re)start per worker process
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='ai-usage-flusher', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """Write all pending counters; failed increments are kept for the next flush"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
         
+        for agent_id, counters in pending.items():
+            try:
+                if is_supabase_available():
+                    supabase.rpc('increment_ai_agent_usage', {
+                        'p_agent_id': agent_id,
+                        'p_total': counters['total_calls'],
+                        'p_successful': counters['successful_calls'],
+                        'p_failed': counters['failed_calls'],
+                        'p_last_used': counters['last_used']
+                    }).execute()
+                    # Cached rows predate the increment
+                    AIAgentService.invalidate_agent_cache(agent_id)
+                elif agent_id in _memory_ai_agents:
+                    agent = _memory_ai_agents[agent_id]
+                    usage = agent.setdefault('usage', {})
+                    for key in ('total_calls', 'successful_calls', 'failed_calls'):
+                        usage[key] = usage.get(key, 0) + counters[key]
+                    usage['last_used'] = counters['last_used']
+                    _memory_ai_agents[agent_id] = agent
+            except Exception as e:
+                logger.error(f"Failed to flush usage for AI agent {agent_id}: {e}")
+                self._merge_back(agent_id, counters)
+    
+    def _merge_back(self, agent_id, counters):
+        with self._lock:
+            current = self._pending.get(agent_id)
+            if current is None:
+                self._pending[agent_id] = counters
+                return
+            for key in ('total_calls', 'successful_calls', 'failed_calls'):
+                current[key] += counters[key]
+            current['last_used'] = max(filter(None, [current['last_used'], counters['last_used']]), default=None)
+
+
+_agent_usage_buffer = _AgentUsageBuffer(flush_interval=int(os.environ.get('AI_USAGE_FLUSH_SECONDS', 30)))
+
 
 class AIAgentService:
     """Service class for handling AI agents in Supabase database"""
     
+    # Agent configs change a few times a week; cache them with parsed usage
+    _agent_cache = TTLCache(ttl=int(os.environ.get('AI_AGENT_CACHE_TTL', 300)))
+    _agent_cache_version = 0
+    _agent_cache_lock = threading.Lock()
+    _ALL_AGENTS_KEY = ('__all__',)
+    
+    @staticmethod
+    def _default_usage():
+        return {
+            'total_calls': 0,
+            'successful_calls': 0,
+            'failed_calls': 0,
+            'last_used': None
+        }
+    
+    @staticmethod
+    def _parse_usage(agent):
+        """Parse the JSON usage column of an agent row in place"""
+        if 'usage' in agent and agent['usage'] and isinstance(agent['usage'], str):
+            try:
+                agent['usage'] = json.loads(agent['usage'])
+            except json.JSONDecodeError:
+                agent['usage'] = AIAgentService._default_usage()
+        return agent
+    
+    @classmethod
+    def invalidate_agent_cache(cls, agent_id=None):
+        """
+        Drop cached agent configs
+        
+        Args:
+            agent_id (str, optional): Agent to drop; all agents if omitted
+        """
+        with cls._agent_cache_lock:
+            if agent_id is None:
+                cls._agent_cache.clear()
+            else:
+                cls._agent_cache.invalidate(agent_id, cls._ALL_AGENTS_KEY)
+            cls._agent_cache_version += 1
+    
+    @classmethod
+    def _cache_agents(cls, entries, version):
+        # A write that landed during the read makes what we read stale;
+        # the caller still returns it, but it is not cached
+        with cls._agent_cache_lock:
+            if cls._agent_cache_version == version:
+                for key, value in entries.items():
+                    cls._agent_cache.set(key, value)
+    
     @staticmethod
     def save_config(config_data):
         """
@@ -750,9 +2791,8 @@ class AIAgentService:
         global _memory_ai_config
         
         # Update in-memory config
-        for key, value in config_data.items():
-            if key not in ['updated_at', 'created_at']:
-                _memory_ai_config[key] = value
+        _memory_ai_config.update({key: value for key, value in config_data.items()
+                                  if key not in ['updated_at', 'created_at']})
         
         return _memory_ai_config.copy()
     
@@ -806,12 +2846,7 @@ class AIAgentService:
                 
         # Add creation timestamp and initialize usage stats
         agent_data['created_at'] = datetime.now().isoformat()
-        usage_stats = {
-            'total_calls': 0,
-            'successful_calls': 0,
-            'failed_calls': 0,
-            'last_used': None
-        }
+        usage_stats = AIAgentService._default_usage()
         agent_data['usage'] = json.dumps(usage_stats)
         
         # Check if Supabase is available
@@ -819,17 +2854,11 @@ class AIAgentService:
             try:
                 # Insert into Supabase
                 result = supabase.table("ai_agents").insert(agent_data).execute()
+                AIAgentService.invalidate_agent_cache(agent_data['id'])
                 
                 # Return the created agent
                 if result.data and len(result.data) > 0:
-                    created_agent = result.data[0]
-                    # Parse usage JSON
-                    if 'usage' in created_agent and created_agent['usage']:
-                        try:
-                            created_agent['usage'] = json.loads(created_agent['usage'])
-                        except json.JSONDecodeError:
-                            created_agent['usage'] = usage_stats
-                    return created_agent
+                    return AIAgentService._parse_usage(result.data[0])
             except Exception as e:
                 logger.error(f"Failed to create AI agent in database: {e}")
                 # Fall back to memory storage
@@ -839,6 +2868,7 @@ class AIAgentService:
         # Convert JSON string back to dict for in-memory storage
         agent_data['usage'] = usage_stats
         _memory_ai_agents[agent_data['id']] = agent_data
+        AIAgentService.invalidate_agent_cache(agent_data['id'])
         return agent_data.copy()
     
     @staticmethod
@@ -851,24 +2881,20 @@ class AIAgentService:
         """
         # Check if Supabase is available
         if is_supabase_available():
+            cached = AIAgentService._agent_cache.get(AIAgentService._ALL_AGENTS_KEY)
+            if cached is not MISSING:
+                return copy.deepcopy(cached)
+            version = AIAgentService._agent_cache_version
             try:
                 result = supabase.table("ai_agents").select("*").execute()
                 
                 # Parse usage JSON for each agent
                 agents = result.data if result.data else []
                 for agent in agents:
-                    if 'usage' in agent and agent['usage']:
-                        try:
-                            agent['usage'] = json.loads(agent['usage'])
-                        except json.JSONDecodeError:
-                            agent['usage'] = {
-                                'total_calls': 0,
-                                'successful_calls': 0,
-                                'failed_calls': 0,
-                                'last_used': None
-                            }
+                    AIAgentService._parse_usage(agent)
                 
-                return agents
+                AIAgentService._cache_agents({AIAgentService._ALL_AGENTS_KEY: agents}, version)
+                return copy.deepcopy(agents)
             except Exception as e:
                 logger.error(f"Failed to get AI agents from database: {e}")
                 # Fall back to memory storage
@@ -890,23 +2916,20 @@ class AIAgentService:
         """
         # Check if Supabase is available
         if is_supabase_available():
+            cached = AIAgentService._agent_cache.get(agent_id)
+            if cached is not MISSING:
+                return copy.deepcopy(cached)
+            version = AIAgentService._agent_cache_version
             try:
                 result = supabase.table("ai_agents").select("*").eq("id", agent_id).execute()
                 
                 if result.data and len(result.data) > 0:
-                    agent = result.data[0]
-                    # Parse usage JSON
-                    if 'usage' in agent and agent['usage']:
-                        try:
-                            agent['usage'] = json.loads(agent['usage'])
-                        except json.JSONDecodeError:
-                            agent['usage'] = {
-                                'total_calls': 0,
-                                'successful_calls': 0,
-                                'failed_calls': 0,
-                                'last_used': None
-                            }
-                    return agent
+                    agent = AIAgentService._parse_usage(result.data[0])
+                else:
+                    # Cache misses too: built-in agents are looked up on every reply
+                    agent = _memory_ai_agents.get(agent_id)
+                AIAgentService._cache_agents({agent_id: agent}, version)
+                return copy.deepcopy(agent)
             except Exception as e:
                 logger.error(f"Failed to get AI agent from database: {e}")
                 # Fall back to memory storage
@@ -915,6 +2938,47 @@ class AIAgentService:
         logger.info(f"Looking for agent {agent_id} in memory storage")
         return _memory_ai_agents.get(agent_id)
     
+    @staticmethod
+    def get_ai_agents_by_ids(agent_ids):
+        """
+        Get many AI agents, querying only the ones not already cached
+        
+        Args:
+            agent_ids (list): AI agent IDs
+        
+        Returns:
+            dict: agent ID -> agent data, for the agents that exist
+        """
+        agents = {}
+        missing = []
+        for agent_id in dict.fromkeys(agent_ids):
+            if agent_id is None:
+                continue
+            cached = AIAgentService._agent_cache.get(agent_id) if is_supabase_available() else MISSING
+            if cached is MISSING:
+                missing.append(agent_id)
+            elif cached is not None:
+                agents[agent_id] = copy.deepcopy(cached)
+        
+        if missing and is_supabase_available():
+            version = AIAgentService._agent_cache_version
+            try:
+                result = supabase.table("ai_agents").select("*").in_("id", missing).execute()
+                found = {agent['id']: AIAgentService._parse_usage(agent) for agent in (result.data or [])}
+                fetched = {agent_id: found.get(agent_id, _memory_ai_agents.get(agent_id)) for agent_id in missing}
+                AIAgentService._cache_agents(fetched, version)
+                for agent_id, agent in fetched.items():
+                    if agent is not None:
+                        agents[agent_id] = copy.deepcopy(agent)
+                return agents
+            except Exception as e:
+                logger.error(f"Failed to get AI agents from database: {e}")
+        
+        for agent_id in missing:
+            if agent_id in _memory_ai_agents:
+                agents[agent_id] = _memory_ai_agents[agent_id]
+        return agents
+    
     @staticmethod
     def update_ai_agent(agent_id, update_data):
         """
@@ -928,6 +2992,7 @@ class AIAgentService:
             dict: The updated agent data
         """
         update_data['updated_at'] = datetime.now().isoformat()
+        AIAgentService.invalidate_agent_cache(agent_id)
         
         # Check if Supabase is available
         if is_supabase_available():
@@ -946,19 +3011,9 @@ class AIAgentService:
                 result = supabase.table("ai_agents").update(update_data).eq("id", agent_id).execute()
                 
                 # Parse usage JSON in the result
+                AIAgentService.invalidate_agent_cache(agent_id)
                 if result.data and len(result.data) > 0:
-                    agent = result.data[0]
-                    if 'usage' in agent and agent['usage']:
-                        try:
-                            agent['usage'] = json.loads(agent['usage'])
-                        except json.JSONDecodeError:
-                            agent['usage'] = {
-                                'total_calls': 0,
-                                'successful_calls': 0,
-                                'failed_calls': 0,
-                                'last_used': None
-                            }
-                    return agent
+                    return AIAgentService._parse_usage(result.data[0])
             except Exception as e:
                 logger.error(f"Failed to update AI agent in database: {e}")
                 # Fall back to memory storage
@@ -981,44 +3036,36 @@ class AIAgentService:
                 else:
                     agent['usage'] = update_data['usage']
             
+            _memory_ai_agents[agent_id] = agent
             return agent
         return None
     
     @staticmethod
-    def track_agent_usage(agent_id, successful=True):
+    def track_usage(agent_id, success=True):
         """
         Track usage statistics for an AI agent
         
+        Counts are buffered in memory and written as atomic increments in
+        the background, so this never waits on the database.
+        
         Args:
             agent_id (str): The agent ID
-            successful (bool): Whether the call was successful
+            success (bool): Whether the call was successful
             
         Returns:
-            dict: The updated agent data or None if not found
+            dict: Counters for this agent not yet written to storage
         """
-        # Get current agent data
-        agent = AIAgentService.get_ai_agent(agent_id)
-        if not agent:
-            return None
-        
-        # Update usage statistics
-        usage = agent.get('usage', {
-            'total_calls': 0,
-            'successful_calls': 0,
-            'failed_calls': 0,
-            'last_used': None
-        })
-        
-        usage['total_calls'] = usage.get('total_calls', 0) + 1
-        if successful:
-            usage['successful_calls'] = usage.get('successful_calls', 0) + 1
-        else:
-            usage['failed_calls'] = usage.get('failed_calls', 0) + 1
-        
-        usage['last_used'] = datetime.now().isoformat()
-        
-        # Update agent with new usage data
-        return AIAgentService.update_ai_agent(agent_id, {'usage': usage})
+        return _agent_usage_buffer.record(agent_id, successful=success)
+    
+    @staticmethod
+    def track_agent_usage(agent_id, successful=True):
+        """Alias for track_usage kept for existing callers"""
+        return AIAgentService.track_usage(agent_id, success=successful)
+    
+    @staticmethod
+    def flush_usage():
+        """Write buffered usage counters now (e.g. before shutdown or reporting)"""
+        _agent_usage_buffer.flush()
     
     @staticmethod
     def get_agent_usage_stats():
@@ -1029,6 +3076,7 @@ class AIAgentService:
             dict: Aggregated usage statistics
         """
         agents = AIAgentService.get_ai_agents()
+        pending = _agent_usage_buffer.pending()
         
         stats = {
             'total_processed': 0,
@@ -1038,7 +3086,14 @@ class AIAgentService:
         }
         
         for agent in agents:
-            usage = agent.get('usage', {})
+            usage = dict(agent.get('usage') or {})
+            buffered = pending.get(agent['id'])
+            if buffered:
+                # Include counts that have not been flushed yet
+                for key in ('total_calls', 'successful_calls', 'failed_calls'):
+                    usage[key] = usage.get(key, 0) + buffered[key]
+                usage['last_used'] = buffered['last_used']
+            
             stats['total_processed'] += usage.get('total_calls', 0)
             stats['total_successful'] += usage.get('successful_calls', 0)
             stats['total_failed'] += usage.get('failed_calls', 0)
@@ -0,0 +1,359 @@
+"""
+Write outbox for Crystal Bay Travel
+Persists inserts that could not reach Supabase and replays them in batches once it is healthy again
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from postgrest.exceptions import APIError
+except ImportError:
+    APIError = None
+
+# Errors raised when the database could not be reached at all (socket
+# errors, including ConnectionError and TimeoutError, are OSErrors)
+NETWORK_ERRORS = [OSError]
+try:
+    import httpx
+    NETWORK_ERRORS.append(httpx.TransportError)
+except ImportError:
+    pass
+NETWORK_ERRORS = tuple(NETWORK_ERRORS)
+
+try:
+    from requests.exceptions import HTTPError as RequestsHTTPError
+except ImportError:
+    RequestsHTTPError = None
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    table_name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    claimed_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (state, next_attempt_at, id);
+"""
+
+# PostgREST answers with these codes when it cannot reach Postgres
+TRANSIENT_API_CODES = ('PGRST000', 'PGRST001', 'PGRST002', 'PGRST003', '57P01', '57P03', '53300')
+
+
+def new_idempotency_key() -> str:
+    """Generate a key that makes a replayed insert a no-op if it already landed"""
+    return uuid.uuid4().hex
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Tell database outages apart from rejected writes
+    
+    Network errors and PostgREST connection errors are worth retrying;
+    anything else (API errors, bad payloads, bugs) is treated as the row
+    being refused, so it is not queued for replay forever.
+    """
+    if APIError is not None and isinstance(error, APIError):
+        return str(getattr(error, 'code', '') or '') in TRANSIENT_API_CODES
+    if RequestsHTTPError is not None and isinstance(error, RequestsHTTPError):
+        # An HTTP status answer, even though requests derives it from OSError
+        return False
+    return isinstance(error, NETWORK_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while
+    
+    After `failure_threshold` consecutive failures the breaker opens and
+    allow() returns False until `reset_timeout` seconds have passed. Then a
+    single probe call is let through: success closes the breaker, failure
+    opens it again.
+    """
+    
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+    
+    def allow(self) -> bool:
+        """Check whether a call may be made now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self._failures
+        }
+
+
+class WriteOutbox:
+    """
+    Durable queue of inserts deferred while the database is unavailable
+    
+    Entries are stored in the local fallback SQLite database, so they
+    survive restarts and are shared by all workers. A daemon thread replays
+    them oldest first, in batches of consecutive rows for the same table,
+    through `writer(table, rows)`. Every row carries an idempotency key and
+    the writer must ignore keys that already exist, so a row is never
+    inserted twice even if a write timed out after it was committed or two
+    workers raced. Batches are leased while being sent and back off
+    exponentially (up to `max_backoff` seconds) while the database is
+    down; rows the database rejects are parked as 'dead' for inspection.
+    """
+    
+    def __init__(self, db, writer: Callable[[str, List[Dict[str, Any]]], None],
+                 batch_size: int = 100, replay_interval: float = 10.0, max_backoff: float = 300.0,
+                 breaker: Optional[CircuitBreaker] = None, lease_seconds: float = 60.0):
+        self.db = db
+        self.writer = writer
+        self.batch_size = batch_size
+        self.replay_interval = replay_interval
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._thread = None
+        self._pid = None
+        self._resumed_pid = None
+    
+    def _connection(self):
+        conn = self.db.connection()
+        if not self._schema_ready:
+            conn.executescript(OUTBOX_SCHEMA)
+            self._schema_ready = True
+        return conn
+    
+    def enqueue(self, table: str, row: Dict[str, Any], error: Optional[Exception] = None) -> str:
+        """
+        Persist an insert for later replay
+        
+        Args:
+            table (str): Target Supabase table
+            row (dict): Row to insert; an idempotency_key is added if missing
+            error (Exception, optional): Why the row could not be written now
+        
+        Returns:
+            str: The row's idempotency key
+        """
+        key = row.setdefault('idempotency_key', new_idempotency_key())
+        conn = self._connection()
+        with self.db.transaction():
+            conn.execute(
+                'INSERT OR IGNORE INTO outbox (idempotency_key, table_name, payload, last_error, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, table, json.dumps(row, ensure_ascii=False, default=str),
+                 str(error) if error else None, datetime.now().isoformat())
+            )
+        logger.warning(f"Deferred write to '{table}' queued in outbox ({key})")
+        self._ensure_replayer()
+        return key
+    
+    def _ensure_replayer(self):
+        # Threads do not survive fork, so (re)start per worker process
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='outbox-replayer', daemon=True)
+            self._thread.start()
+    
+    def resume(self):
+        """
+        Start replaying entries left over from a previous run, if any
+        
+        Checked once per process. Nothing is opened while the fallback
+        database file does not exist, as then nothing can be pending.
+        """
+        if self._resumed_pid == os.getpid():
+            return
+        self._resumed_pid = os.getpid()
+        path = getattr(self.db, 'path', None)
+        if path and not os.path.exists(path):
+            return
+        try:
+            if self.stats()['pending']:
+                self._ensure_replayer()
+        except Exception as e:
+            logger.error(f"Could not check the outbox for pending writes: {e}")
+    
+    def _run(self):
+        while True:
+            time.sleep(self.replay_interval)
+            try:
+                self.replay()
+            except Exception as e:
+                logger.error(f"Outbox replay failed: {e}")
+    
+    def _claim(self) -> List[Any]:
+        now = time.time()
+        conn = self._connection()
+        with self.db.transaction():
+            rows = conn.execute(
+                "SELECT id, table_name, payload, attempts FROM outbox "
+                "WHERE state = 'pending' AND next_attempt_at <= ? AND claimed_until <= ? "
+                "ORDER BY id LIMIT ?",
+                (now, now, self.batch_size)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    'UPDATE outbox SET claimed_until = ? WHERE id = ?',
+                    [(now + self.lease_seconds, row['id']) for row in rows]
+                )
+        return rows
+    
+    def _complete(self, entry_ids: List[int]):
+        conn = self._connection()
+        with self.db.transaction():
+            conn.executemany('DELETE FROM outbox WHERE id = ?', [(entry_id,) for entry_id in entry_ids])
+    
+    def _release(self, entry_ids: List[int]):
+        conn = self._connection()
+        with self.db.transaction():
+            conn.executemany('UPDATE outbox SET claimed_until = 0 WHERE id = ?',
+                             [(entry_id,) for entry_id in entry_ids])
+    
+    def _fail(self, entries: List[Any], error: Exception, dead: bool):
+        now = time.time()
+        conn = self._connection()
+        with self.db.transaction():
+            conn.executemany(
+                'UPDATE outbox SET attempts = attempts + 1, last_error = ?, state = ?, '
+                'next_attempt_at = ?, claimed_until = 0 WHERE id = ?',
+                [(str(error), 'dead' if dead else 'pending',
+                  now + min(2 ** (entry['attempts'] + 1), self.max_backoff), entry['id'])
+                 for entry in entries]
+            )
+        if dead:
+            logger.error(f"Outbox entry {entries[0]['id']} for '{entries[0]['table_name']}' rejected: {error}")
+    
+    def _send(self, table: str, entries: List[Any]):
+        """
+        Send one same-table group
+        
+        An outage backs off the whole group and stops replay. A rejected
+        batch is split so that only the offending rows are parked as dead.
+        
+        Returns:
+            tuple: (rows written, whether replay may continue)
+        """
+        if not self.breaker.allow():
+            self._release([entry['id'] for entry in entries])
+            return 0, False
+        try:
+            self.writer(table, [json.loads(entry['payload']) for entry in entries])
+        except Exception as e:
+            if is_transient_error(e):
+                self.breaker.record_failure()
+                self._fail(entries, e, dead=False)
+                return 0, False
+            # The database answered, it just refused a row
+            self.breaker.record_success()
+            if len(entries) == 1:
+                self._fail(entries, e, dead=True)
+                return 0, True
+            logger.warning(f"Outbox batch of {len(entries)} for '{table}' rejected, retrying rows: {e}")
+            written = 0
+            for pos, entry in enumerate(entries):
+                sent, healthy = self._send(table, [entry])
+                written += sent
+                if not healthy:
+                    self._release([later['id'] for later in entries[pos + 1:]])
+                    return written, False
+            return written, True
+        self.breaker.record_success()
+        self._complete([entry['id'] for entry in entries])
+        return len(entries), True
+    
+    def replay(self) -> int:
+        """
+        Replay due entries until the queue is drained or the database fails
+        
+        Returns:
+            int: Number of entries written
+        """
+        written = 0
+        while self.breaker.state != 'open':
+            entries = self._claim()
+            if not entries:
+                break
+            
+            groups = []
+            for entry in entries:
+                if groups and groups[-1][0] == entry['table_name']:
+                    groups[-1][1].append(entry)
+                else:
+                    groups.append((entry['table_name'], [entry]))
+            
+            for pos, (table, group) in enumerate(groups):
+                sent, healthy = self._send(table, group)
+                written += sent
+                if not healthy:
+                    self._release([entry['id'] for _, rest in groups[pos + 1:] for entry in rest])
+                    return written
+            
+            if len(entries) < self.batch_size:
+                break
+        
+        if written:
+            logger.info(f"Outbox replayed {written} deferred writes")
+        return written
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get queue depth by state and the circuit breaker state"""
+        rows = self._connection().execute(
+            'SELECT state, COUNT(*), MIN(created_at) FROM outbox GROUP BY state'
+        ).fetchall()
+        by_state = {row[0]: {'count': row[1], 'oldest': row[2]} for row in rows}
+        return {
+            'pending': by_state.get('pending', {}).get('count', 0),
+            'dead': by_state.get('dead', {}).get('count', 0),
+            'oldest_pending': by_state.get('pending', {}).get('oldest'),
+            'breaker': self.breaker.stats()
+        }
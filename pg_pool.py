@@ -0,0 +1,328 @@
+"""
+PostgreSQL connection pool for Crystal Bay Travel
+Bounded, thread-safe pool of psycopg2 connections that is rebuilt in every forked worker
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _is_connection_error(error: Exception) -> bool:
+    """Check whether an error leaves the connection itself in doubt"""
+    try:
+        import psycopg2
+    except ImportError:
+        return False
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+class PostgresPool:
+    """
+    Thread-safe pool of PostgreSQL connections
+    
+    Each operation checks a connection out, runs in its own transaction
+    and hands the connection back, so requests no longer queue behind a
+    single shared connection and a failed transaction only affects the
+    operation that ran it. At most `maxconn` connections are open; callers
+    beyond that wait up to `timeout` seconds for one to be returned.
+    
+    Returned connections stay open (psycopg2's own pools close everything
+    above `minconn`) and are reused most recently returned first, so the
+    same few connections stay warm under light load.
+    
+    Liveness is checked at checkout, and only for connections that sat
+    idle longer than `ping_after` seconds or whose last operation failed;
+    a dead one is dropped and the next is tried, so callers never see a
+    stale connection and busy connections cost no extra round trip.
+    Connection-level errors close the connection instead of returning it
+    and mark every idle connection for a ping, as a server restart or
+    network drop usually takes them all down together.
+    When the server cannot be reached the pool is marked unavailable and
+    fails fast, while a background thread reconnects every
+    `retry_interval` seconds and keeps `minconn` connections open.
+    
+    State is per process: after fork the child starts an empty pool and
+    never uses (or closes) the sockets it inherited from its parent.
+    """
+    
+    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 10, timeout: float = 5.0,
+                 ping_after: float = 30.0, retry_interval: float = 5.0,
+                 on_reconnect: Optional[Callable[[], Any]] = None):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("Pool sizes must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.retry_interval = retry_interval
+        self.on_reconnect = on_reconnect
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started = False
+        self._thread = None
+        self._thread_pid = None
+        self._reset()
+    
+    def _reset(self):
+        # (connection, monotonic time it was returned); 0 forces a ping
+        self._idle = []
+        self.available = True
+        self._open = 0
+        self._in_use = 0
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._metrics = {
+            'checkouts': 0,
+            'connects': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'timeouts': 0,
+            'errors': 0,
+            'discarded': 0,
+            'pings': 0,
+            'failed_pings': 0,
+            'reconnects': 0
+        }
+    
+    def _check_pid(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Inherited connections belong to the parent; drop them
+                # without closing, closing would end the parent's sessions
+                self._reset()
+                self._pid = os.getpid()
+        if self._started:
+            self._ensure_maintainer()
+    
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn, connect_timeout=max(1, int(self.timeout)))
+        with self._lock:
+            self._open += 1
+            self._metrics['connects'] += 1
+        return conn
+    
+    def open(self):
+        """
+        Open `minconn` connections and start background maintenance
+        
+        Raises:
+            psycopg2.Error: If the database cannot be reached; the pool
+                stays unavailable and keeps reconnecting in the background
+        """
+        self._started = True
+        self._check_pid()
+        self._ensure_maintainer()
+        try:
+            self._fill()
+        except Exception:
+            self.available = False
+            raise
+        logger.info(f"PostgreSQL pool ready ({self.minconn}-{self.maxconn} connections)")
+    
+    def _fill(self):
+        with self._lock:
+            missing = self.minconn - self._open
+        for _ in range(max(0, missing)):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+    
+    def _ensure_maintainer(self):
+        # Threads do not survive fork, so (re)start per worker process
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self._maintain, name='pg-pool-maintainer', daemon=True)
+        self._thread.start()
+    
+    def _maintain(self):
+        while True:
+            time.sleep(self.retry_interval)
+            recovering = not self.available
+            try:
+                self._fill()
+                if recovering:
+                    # Prove the server is back even when minconn is 0
+                    with self.connection(force=True):
+                        pass
+            except Exception as e:
+                if recovering:
+                    logger.debug(f"PostgreSQL still unavailable - {e}")
+                else:
+                    logger.warning(f"PostgreSQL pool refill failed - {e}")
+                continue
+            if recovering:
+                self.available = True
+                with self._lock:
+                    self._metrics['reconnects'] += 1
+                logger.info("PostgreSQL connection restored")
+                if self.on_reconnect:
+                    try:
+                        self.on_reconnect()
+                    except Exception as e:
+                        logger.error(f"PostgreSQL reconnect hook failed - {e}")
+    
+    def _acquire_slot(self, slots):
+        if slots.acquire(blocking=False):
+            return
+        started = time.monotonic()
+        acquired = slots.acquire(timeout=self.timeout)
+        waited = time.monotonic() - started
+        with self._lock:
+            self._metrics['waits'] += 1
+            self._metrics['wait_seconds'] += waited
+            self._metrics['max_wait_seconds'] = max(self._metrics['max_wait_seconds'], waited)
+            if not acquired:
+                self._metrics['timeouts'] += 1
+        if not acquired:
+            raise RuntimeError(f"No PostgreSQL connection available within {self.timeout}s "
+                               f"({self.maxconn} in use)")
+    
+    def _ping(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            ok = True
+        except Exception as e:
+            logger.warning(f"PostgreSQL connection failed pre-ping, replacing it - {e}")
+            ok = False
+        with self._lock:
+            self._metrics['pings'] += 1
+            if not ok:
+                self._metrics['failed_pings'] += 1
+        return ok
+    
+    def _checkout(self):
+        while True:
+            with self._lock:
+                conn, returned_at = self._idle.pop() if self._idle else (None, None)
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    if self.available:
+                        logger.error("PostgreSQL unreachable, reconnecting in the background")
+                    self.available = False
+                    raise
+            if time.monotonic() - returned_at < self.ping_after or self._ping(conn):
+                return conn
+            self._discard(conn)
+    
+    def _discard(self, conn):
+        with self._lock:
+            self._open -= 1
+            self._metrics['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    def _mark_idle_suspect(self):
+        with self._lock:
+            self._idle = [(conn, 0.0) for conn, _ in self._idle]
+    
+    def _checkin(self, conn, broken: bool, suspect: bool):
+        if broken:
+            with self._lock:
+                self._in_use -= 1
+            self._discard(conn)
+            self._mark_idle_suspect()
+            return
+        with self._lock:
+            self._in_use -= 1
+            self._idle.append((conn, 0.0 if suspect else time.monotonic()))
+    
+    @contextmanager
+    def connection(self, force: bool = False):
+        """
+        Check out a connection for one transaction
+        
+        The transaction is committed when the block exits normally and
+        rolled back if it raises. Connections that were lost are closed
+        instead of going back to the pool.
+        
+        Args:
+            force (bool): Try the server even while the pool is unavailable
+        
+        Raises:
+            RuntimeError: If the pool is unavailable or no connection is
+                free within the timeout
+            psycopg2.Error: If a new connection cannot be opened
+        """
+        self._check_pid()
+        if not self.available and not force:
+            raise RuntimeError("PostgreSQL is unavailable, reconnecting in the background")
+        pid, slots = self._pid, self._slots
+        self._acquire_slot(slots)
+        try:
+            conn = self._checkout()
+        except Exception:
+            slots.release()
+            raise
+        with self._lock:
+            self._metrics['checkouts'] += 1
+            self._in_use += 1
+        
+        broken = suspect = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            suspect = True
+            broken = _is_connection_error(e)
+            with self._lock:
+                self._metrics['errors'] += 1
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except Exception as rollback_error:
+                logger.warning(f"PostgreSQL rollback failed, discarding connection - {rollback_error}")
+                broken = True
+            raise
+        finally:
+            # A connection checked out before fork is not returned to the
+            # child's fresh pool
+            if pid == os.getpid():
+                self._checkin(conn, broken or bool(conn.closed), suspect)
+                slots.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get pool size and checkout metrics for this process"""
+        self._check_pid()
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['wait_seconds'] = round(metrics['wait_seconds'], 3)
+            metrics['max_wait_seconds'] = round(metrics['max_wait_seconds'], 3)
+            return {
+                'pid': self._pid,
+                'available': self.available,
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                **metrics
+            }
+    
+    def closeall(self):
+        """Close the idle connections of this process"""
+        self._check_pid()
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
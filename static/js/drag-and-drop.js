@@ -47,6 +47,7 @@ const CONFIG = {
      */
     api: {
         updateStatus: '/api/leads/{id}/status',
+        bulkUpdateStatus: '/api/leads/bulk-status',
         fetchLead: '/api/leads/{id}',
         fetchInteractions: '/api/leads/{id}/interactions',
     },
@@ -58,6 +59,7 @@ const CONFIG = {
     timing: {
         visualFeedback: 1000,
         toastDisplay: 5000,
+        statusBatchDelay: 400,
     },
     
     /**
@@ -95,6 +97,9 @@ function initDragAndDrop() {
         // Update column counts initially
         updateColumnCounts();
         
+        // Remember where each card is saved, so failed moves can be undone
+        rememberSavedColumns();
+        
         console.log('Drag and drop initialized successfully');
     } catch (error) {
         console.error('Error initializing drag and drop:', error);
@@ -338,7 +343,7 @@ function handleColumnDrop(e) {
             showSuccessIndicator(draggedCardElement);
             
             // Update the status on the server
-            updateLeadStatus(leadId, newStatus);
+            queueLeadStatusUpdate(leadId, newStatus);
         } else {
             console.log('Same column drop, not moving');
         }
@@ -582,25 +587,103 @@ function formatDate(dateStr) {
     }
 }
 
+// Status changes waiting to be sent in one bulk request (leadId -> status)
+const pendingStatusUpdates = new Map();
+let statusFlushTimer = null;
+
+// Lead list each card was in when its status was last saved (card -> list)
+const savedCardLists = new WeakMap();
+
 /**
- * Update the lead status on the server
+ * Find the card of a lead on the board
+ * @param {string} leadId - The ID of the lead
+ * @returns {HTMLElement|null} The card element
+ */
+function findLeadCard(leadId) {
+    return document.querySelector(`${CONFIG.selectors.leadCard}[data-lead-id="${CSS.escape(String(leadId))}"]`);
+}
+
+/**
+ * Record the current list of every card without an unsaved move
+ */
+function rememberSavedColumns() {
+    document.querySelectorAll(`${CONFIG.selectors.leadCard}[data-lead-id]`).forEach(card => {
+        if (!pendingStatusUpdates.has(card.getAttribute('data-lead-id')) && card.parentElement) {
+            savedCardLists.set(card, card.parentElement);
+        }
+    });
+}
+
+/**
+ * Move the cards of leads whose status was not saved back to their saved lists
+ * @param {Array<string>} leadIds - IDs of the leads to move back
+ */
+function revertLeadCards(leadIds) {
+    let moved = false;
+    leadIds.forEach(leadId => {
+        const card = findLeadCard(leadId);
+        const list = card && savedCardLists.get(card);
+        if (!list || !list.isConnected || card.parentElement === list) return;
+        
+        const addButton = list.querySelector(CONFIG.selectors.newLeadBtn);
+        if (addButton) {
+            list.insertBefore(card, addButton);
+        } else {
+            list.appendChild(card);
+        }
+        moved = true;
+    });
+    if (moved) {
+        updateColumnCounts();
+    }
+}
+
+/**
+ * Queue a lead status update; queued moves are sent together by flushLeadStatusUpdates
  * @param {string} leadId - The ID of the lead
  * @param {string} newStatus - The new status
  */
-async function updateLeadStatus(leadId, newStatus) {
+function queueLeadStatusUpdate(leadId, newStatus) {
+    pendingStatusUpdates.set(leadId, newStatus);
+    
+    if (statusFlushTimer) {
+        clearTimeout(statusFlushTimer);
+    }
+    statusFlushTimer = setTimeout(flushLeadStatusUpdates, CONFIG.timing.statusBatchDelay);
+}
+
+/**
+ * Send all queued lead status updates in a single bulk request
+ * 
+ * Cards of updates that were not applied are moved back to the column
+ * of their last saved status.
+ * @param {Object} [options] - Flush options
+ * @param {boolean} [options.keepalive=false] - Let the request outlive the page
+ * @returns {Promise<boolean>} Whether every queued update was applied
+ */
+async function flushLeadStatusUpdates(options = {}) {
+    if (statusFlushTimer) {
+        clearTimeout(statusFlushTimer);
+        statusFlushTimer = null;
+    }
+    if (pendingStatusUpdates.size === 0) return true;
+    
+    const updates = Array.from(pendingStatusUpdates, ([leadId, status]) => ({ lead_id: leadId, status: status }));
+    pendingStatusUpdates.clear();
+    const leadIds = updates.map(update => update.lead_id);
+    
     try {
-        const url = CONFIG.api.updateStatus.replace('{id}', leadId);
-        
         // Notify that update is in progress
-        showToast(`Обновление статуса обращения #${leadId}...`, 'info');
+        showToast(`Обновление статуса обращений: ${updates.length}...`, 'info');
         
         // Send API request
-        const response = await fetch(url, {
-            method: 'PUT',
+        const response = await fetch(CONFIG.api.bulkUpdateStatus, {
+            method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ status: newStatus })
+            body: JSON.stringify({ updates: updates }),
+            keepalive: Boolean(options.keepalive)
         });
         
         if (!response.ok) {
@@ -608,15 +691,44 @@ async function updateLeadStatus(leadId, newStatus) {
         }
         
         const data = await response.json();
+        const failedResults = (data.results || []).filter(result => !result.success);
+        const failedIds = new Set(failedResults.map(result => String(result.lead_id)));
+        
+        // Without per-lead results nothing is known to be saved
+        if (!data.success && !data.results) {
+            leadIds.forEach(leadId => failedIds.add(String(leadId)));
+        }
+        revertLeadCards(leadIds.filter(leadId => failedIds.has(String(leadId))));
+        rememberSavedColumns();
         
         if (data.success) {
-            showToast(`Статус обращения #${leadId} изменен на "${getStatusName(newStatus)}"`, 'success');
+            if (updates.length === 1) {
+                showToast(`Статус обращения #${updates[0].lead_id} изменен на "${getStatusName(updates[0].status)}"`, 'success');
+            } else {
+                showToast(`Статус изменен у ${updates.length} обращений`, 'success');
+            }
+        } else if (failedResults.length > 0) {
+            failedResults.forEach(result => {
+                showToast(`Ошибка при обновлении статуса #${result.lead_id}: ${result.error || 'Неизвестная ошибка'}`, 'danger');
+            });
         } else {
             showToast(`Ошибка при обновлении статуса: ${data.error || 'Неизвестная ошибка'}`, 'danger');
         }
+        return Boolean(data.success);
     } catch (error) {
         console.error('Error updating lead status:', error);
+        revertLeadCards(leadIds);
         showToast(`Ошибка при обновлении статуса: ${error.message}`, 'danger');
+        return false;
+    }
+}
+
+/**
+ * Send queued status updates before the page is hidden or unloaded
+ */
+function flushLeadStatusUpdatesOnHide() {
+    if (pendingStatusUpdates.size > 0) {
+        flushLeadStatusUpdates({ keepalive: true });
     }
 }
 
@@ -766,10 +878,20 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Queued moves would be lost when the tab is closed or navigated away
+window.addEventListener('pagehide', flushLeadStatusUpdatesOnHide);
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+        flushLeadStatusUpdatesOnHide();
+    }
+});
+
 // Expose functions for external use
 window.kanbanBoard = {
     initDragAndDrop,
     openLeadModal,
     updateColumnCounts,
-    showToast
+    showToast,
+    queueLeadStatusUpdate,
+    flushLeadStatusUpdates
 };
\ No newline at end of file
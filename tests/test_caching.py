@@ -0,0 +1,73 @@
+"""Tests for caching.TTLCache"""
+
+import pytest
+
+import caching
+from caching import MISSING, TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable replacement for time.monotonic"""
+    now = [1000.0]
+    monkeypatch.setattr(caching.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_get_returns_missing_for_unknown_key():
+    cache = TTLCache(ttl=10)
+    assert cache.get('a') is MISSING
+
+
+def test_none_is_a_cacheable_value():
+    cache = TTLCache(ttl=10)
+    cache.set('a', None)
+    assert cache.get('a') is None
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1)
+    clock[0] += 9.9
+    assert cache.get('a') == 1
+    clock[0] += 0.1
+    assert cache.get('a') is MISSING
+    assert len(cache) == 0
+
+
+def test_lru_evicts_least_recently_used():
+    cache = TTLCache(ttl=10, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_invalidate_and_clear():
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('c', 3)
+    cache.invalidate('a', 'missing')
+    assert cache.get('a') is MISSING
+    assert cache.get('b') == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_stats_count_hits_and_misses():
+    cache = TTLCache(ttl=10, maxsize=5)
+    assert cache.stats()['hit_rate'] is None
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('b')
+    stats = cache.stats()
+    assert stats['size'] == 1
+    assert stats['maxsize'] == 5
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
@@ -0,0 +1,91 @@
+"""Tests for lead_assignment"""
+
+from datetime import datetime
+
+import pytest
+
+from lead_assignment import LeadAssigner, is_on_duty, next_shift_start, parse_working_hours
+
+# 2024-01-01 is a Monday
+MONDAY_NOON = datetime(2024, 1, 1, 12, 0)
+
+
+def test_parse_working_hours():
+    assert parse_working_hours(None) is None
+    assert parse_working_hours({'mon': ['09:00', '18:00'], 'Friday': ['22:00', '06:00']}) == {
+        0: (540, 1080), 4: (1320, 360)
+    }
+    with pytest.raises(ValueError):
+        parse_working_hours({'someday': ['09:00', '18:00']})
+    with pytest.raises(ValueError):
+        parse_working_hours({'mon': ['9am', '6pm']})
+
+
+def test_is_on_duty_handles_overnight_shifts():
+    hours = parse_working_hours({'mon': ['22:00', '06:00']})
+    assert not is_on_duty(hours, MONDAY_NOON)
+    assert is_on_duty(hours, datetime(2024, 1, 1, 23, 0))
+    assert is_on_duty(hours, datetime(2024, 1, 2, 5, 59))
+    assert not is_on_duty(hours, datetime(2024, 1, 2, 6, 0))
+    assert is_on_duty(None, MONDAY_NOON)
+
+
+def test_next_shift_start():
+    hours = parse_working_hours({'tue': ['09:00', '18:00']})
+    assert next_shift_start(hours, MONDAY_NOON) == datetime(2024, 1, 2, 9, 0)
+    assert next_shift_start({}, MONDAY_NOON) is None
+
+
+def test_picks_least_loaded_agent_by_weight():
+    assigner = LeadAssigner()
+    assigner.load([{'id': 'a'}, {'id': 'b', 'assignment_weight': 2}],
+                  [('l1', 'a'), ('l2', 'b'), ('l3', 'b')])
+    # Loads per weight start equal (1/1 and 2/2); b takes twice as many leads
+    picks = [assigner.pick_agent(MONDAY_NOON) for _ in range(3)]
+    assert picks == ['a', 'b', 'b']
+    assert assigner.stats(MONDAY_NOON)['agents']['a']['open_leads'] == 2
+    assert assigner.stats(MONDAY_NOON)['agents']['b']['open_leads'] == 4
+
+
+def test_off_duty_agents_are_skipped_until_their_shift():
+    assigner = LeadAssigner()
+    assigner.load([{'id': 'day', 'working_hours': {'mon': ['09:00', '18:00']}},
+                   {'id': 'night', 'working_hours': {'mon': ['20:00', '23:00']}}], [])
+    assert assigner.pick_agent(MONDAY_NOON) == 'day'
+    assert assigner.pick_agent(MONDAY_NOON) == 'day'
+    assert assigner.pick_agent(datetime(2024, 1, 1, 21, 0)) == 'night'
+    assert assigner.pick_agent(datetime(2024, 1, 2, 12, 0)) is None
+
+
+def test_observe_settles_reservations_and_tracks_moves():
+    assigner = LeadAssigner()
+    assigner.load([{'id': 'a'}, {'id': 'b'}], [])
+    agent = assigner.pick_agent(MONDAY_NOON)
+    assigner.observe({'id': 'l1', 'status': 'new', 'agent_id': agent})
+    assert assigner.stats()['agents'][agent]['open_leads'] == 1
+    
+    other = 'b' if agent == 'a' else 'a'
+    assigner.observe({'id': 'l1', 'status': 'new', 'agent_id': other})
+    assert assigner.agent_of('l1') == other
+    assert assigner.stats()['agents'][agent]['open_leads'] == 0
+    
+    assigner.observe({'id': 'l1', 'status': 'booked', 'agent_id': other})
+    assert assigner.agent_of('l1') is None
+    assert assigner.stats()['open_leads'] == 0
+
+
+def test_release_returns_the_reserved_slot():
+    assigner = LeadAssigner()
+    assigner.load([{'id': 'a'}], [])
+    assigner.pick_agent(MONDAY_NOON)
+    assigner.release('a')
+    assert assigner.stats()['agents']['a']['open_leads'] == 0
+    # A second release without a reservation changes nothing
+    assigner.release('a')
+    assert assigner.stats()['agents']['a']['open_leads'] == 0
+
+
+def test_inactive_agents_are_not_picked():
+    assigner = LeadAssigner()
+    assigner.load([{'id': 'a', 'status': 'inactive'}, {'id': 'b', 'assignment_weight': 0}], [])
+    assert assigner.pick_agent(MONDAY_NOON) is None
@@ -0,0 +1,66 @@
+"""Tests for lead_dedupe"""
+
+import pytest
+
+from lead_dedupe import (EMAIL_KEY_FIELD, PHONE_KEY_FIELD, contact_key_updates, contact_keys,
+                         find_duplicate_clusters, normalize_email, normalize_phone)
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('+7 (912) 345-67-89', '+79123456789'),
+    ('8 912 345 67 89', '+79123456789'),
+    ('9123456789', '+79123456789'),
+    ('0044 20 7946 0958', '+442079460958'),
+    ('+66 81 234 5678', '+66812345678'),
+    ('12345', None),
+    ('no phone', None),
+    (None, None),
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+def test_normalize_phone_uses_default_country_code():
+    assert normalize_phone('89123456789', default_country_code='66') == '+89123456789'
+    assert normalize_phone('8123456789', default_country_code='66') == '+668123456789'
+
+
+def test_normalize_email():
+    assert normalize_email('  Ivan.Petrov@Mail.RU ') == 'ivan.petrov@mail.ru'
+    assert normalize_email('not an email') is None
+    assert normalize_email(None) is None
+
+
+def test_contact_keys_and_partial_updates():
+    lead = {'customer_phone': '8 912 345 67 89', 'customer_email': 'A@B.com'}
+    assert contact_keys(lead) == {PHONE_KEY_FIELD: '+79123456789', EMAIL_KEY_FIELD: 'a@b.com'}
+    assert contact_key_updates({'customer_email': 'C@D.com', 'notes': 'x'}) == {EMAIL_KEY_FIELD: 'c@d.com'}
+
+
+def test_clusters_are_transitive_and_keep_the_oldest_lead():
+    leads = [
+        {'id': 3, 'created_at': '2024-03-01', 'customer_email': 'ivan@mail.ru'},
+        {'id': 1, 'created_at': '2024-01-01', 'customer_phone': '+7 912 345 67 89'},
+        {'id': 2, 'created_at': '2024-02-01', 'customer_phone': '89123456789',
+         'customer_email': 'IVAN@mail.ru'},
+        {'id': 4, 'created_at': '2024-04-01', 'customer_phone': '+66812345678'},
+    ]
+    clusters = find_duplicate_clusters(leads)
+    assert clusters == [{
+        'canonical_id': '1',
+        'duplicate_ids': ['2', '3'],
+        'keys': ['+79123456789', 'ivan@mail.ru']
+    }]
+
+
+def test_clusters_prefer_stored_key_fields():
+    leads = [
+        {'id': 'a', 'created_at': '2024-01-01', PHONE_KEY_FIELD: '+79123456789'},
+        {'id': 'b', 'created_at': '2024-01-02', PHONE_KEY_FIELD: '+79123456789'},
+    ]
+    assert find_duplicate_clusters(leads)[0]['duplicate_ids'] == ['b']
+
+
+def test_no_clusters_without_shared_keys():
+    leads = [{'id': 1, 'customer_phone': None}, {'id': 2, 'customer_email': 'x@y.com'}]
+    assert find_duplicate_clusters(leads) == []
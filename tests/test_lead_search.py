@@ -0,0 +1,58 @@
+"""Tests for lead_search"""
+
+from lead_search import TrigramIndex, lead_search_text, normalize_search_query, trigrams
+
+
+def test_trigrams_pad_words_like_pg_trgm():
+    assert trigrams('Ann') == {'  a', ' an', 'ann', 'nn '}
+    assert trigrams('') == set()
+
+
+def test_lead_search_text_keeps_phone_digits_only():
+    lead = {'customer_name': 'Ivan Petrov', 'customer_email': 'Ivan@Mail.ru',
+            'customer_phone': '+7 (912) 345-67-89', 'notes': None}
+    assert lead_search_text(lead) == 'ivan petrov ivan@mail.ru 79123456789'
+
+
+def test_normalize_search_query():
+    assert normalize_search_query('  +7 (912) 345 ') == '7912345'
+    assert normalize_search_query(' Petrov ') == 'petrov'
+    assert normalize_search_query(None) == ''
+
+
+def test_search_ranks_substring_matches_first():
+    index = TrigramIndex()
+    index.add('a', 'ivan petrov')
+    index.add('b', 'ivan petrovsky')
+    index.add('c', 'maria sidorova')
+    results = index.search('petrov')
+    assert [doc_id for doc_id, _ in results] in (['a', 'b'], ['b', 'a'])
+    assert all(score == 1.0 for _, score in results)
+
+
+def test_search_tolerates_typos_and_skips_unrelated():
+    index = TrigramIndex()
+    index.add('a', 'alexander smirnov')
+    index.add('b', 'maria sidorova')
+    results = dict(index.search('smirnof'))
+    assert 0.6 <= results['a'] < 1.0
+    assert 'b' not in results
+
+
+def test_tiebreak_decides_which_equal_scores_make_the_cut():
+    index = TrigramIndex()
+    for doc_id in range(10):
+        index.add(doc_id, f'lead {doc_id} petrov')
+    results = index.search('petrov', limit=3, tiebreak=lambda doc_id: doc_id)
+    assert [doc_id for doc_id, _ in results] == [9, 8, 7]
+
+
+def test_remove_and_reindex():
+    index = TrigramIndex()
+    index.add('a', 'ivan petrov')
+    index.add('a', 'maria sidorova')
+    assert index.search('petrov') == []
+    assert [doc_id for doc_id, _ in index.search('sidorova')] == ['a']
+    index.remove('a')
+    assert len(index) == 0
+    assert index.search('sidorova') == []
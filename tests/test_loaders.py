@@ -0,0 +1,74 @@
+"""Tests for loaders.BatchLoader"""
+
+from loaders import BatchLoader
+
+
+class BatchFn:
+    """Records every batch call and returns {key: key.upper()} for known keys"""
+    
+    def __init__(self, known=('a', 'b', 'c', 'd'), fail=False):
+        self.calls = []
+        self.known = set(known)
+        self.fail = fail
+    
+    def __call__(self, keys):
+        self.calls.append(list(keys))
+        if self.fail:
+            raise RuntimeError('database unavailable')
+        return {key: key.upper() for key in keys if key in self.known}
+
+
+def test_load_many_batches_and_dedupes_keys():
+    batch_fn = BatchFn()
+    loader = BatchLoader(batch_fn)
+    assert loader.load_many(['a', 'b', 'a', None, 'x']) == ['A', 'B', 'A', None, None]
+    assert batch_fn.calls == [['a', 'b', 'x']]
+
+
+def test_loaded_keys_are_not_fetched_again():
+    batch_fn = BatchFn()
+    loader = BatchLoader(batch_fn)
+    loader.load('a')
+    assert loader.load_many(['a', 'b']) == ['A', 'B']
+    assert loader.load('b') == 'B'
+    assert batch_fn.calls == [['a'], ['b']]
+
+
+def test_primed_keys_are_fetched_with_the_next_load():
+    batch_fn = BatchFn()
+    loader = BatchLoader(batch_fn)
+    loader.prime(['a', 'b', None])
+    assert loader.load('c') == 'C'
+    assert loader.load('a') == 'A'
+    assert batch_fn.calls == [['a', 'b', 'c']]
+
+
+def test_keys_are_normalized():
+    batch_fn = BatchFn(known={'1', '2'})
+    loader = BatchLoader(batch_fn)
+    assert loader.load_many([1, '1', 2]) == ['1', '1', '2']
+    assert batch_fn.calls == [['1', '2']]
+
+
+def test_large_requests_are_split_into_batches():
+    batch_fn = BatchFn(known=[])
+    loader = BatchLoader(batch_fn, max_batch_size=2)
+    loader.load_many(['a', 'b', 'c', 'd', 'e'])
+    assert batch_fn.calls == [['a', 'b'], ['c', 'd'], ['e']]
+
+
+def test_missing_keys_and_failures_get_the_default():
+    loader = BatchLoader(BatchFn(fail=True), default=[])
+    assert loader.load_many(['a', 'b']) == [[], []]
+    assert loader.load(None) == []
+
+
+def test_clear_forgets_cached_values():
+    batch_fn = BatchFn()
+    loader = BatchLoader(batch_fn)
+    loader.load_many(['a', 'b'])
+    loader.clear('a')
+    loader.load_many(['a', 'b'])
+    loader.clear()
+    loader.load('b')
+    assert batch_fn.calls == [['a', 'b'], ['a'], ['b']]
@@ -0,0 +1,107 @@
+"""Tests for outbox"""
+
+import pytest
+
+import outbox
+from fallback_store import SQLiteFallbackDB
+from outbox import CircuitBreaker, WriteOutbox, is_transient_error
+
+
+class Writer:
+    """Records written batches; rows whose 'name' is in `reject` are refused"""
+    
+    def __init__(self):
+        self.batches = []
+        self.reject = set()
+        self.down = False
+    
+    def __call__(self, table, rows):
+        if self.down:
+            raise ConnectionError('database unreachable')
+        if any(row.get('name') in self.reject for row in rows):
+            raise ValueError('row refused')
+        self.batches.append((table, [row['name'] for row in rows]))
+
+
+@pytest.fixture
+def writer():
+    return Writer()
+
+
+@pytest.fixture
+def box(tmp_path, writer):
+    # The background replayer sleeps for replay_interval; tests call replay() directly
+    return WriteOutbox(SQLiteFallbackDB(str(tmp_path / 'fallback.sqlite3')), writer,
+                       batch_size=3, replay_interval=3600, breaker=CircuitBreaker(failure_threshold=1))
+
+
+def test_is_transient_error():
+    assert is_transient_error(ConnectionError())
+    assert is_transient_error(TimeoutError())
+    assert not is_transient_error(ValueError())
+    assert not is_transient_error(KeyError('id'))
+
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(outbox.time, 'monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    
+    now[0] += 30
+    assert breaker.allow()
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_replay_writes_batches_per_table_in_order(box, writer):
+    for name, table in [('a', 'leads'), ('b', 'leads'), ('c', 'interactions'), ('d', 'leads')]:
+        box.enqueue(table, {'name': name})
+    assert box.stats()['pending'] == 4
+    assert box.replay() == 4
+    assert writer.batches == [('leads', ['a', 'b']), ('interactions', ['c']), ('leads', ['d'])]
+    assert box.stats()['pending'] == 0
+
+
+def test_enqueue_keeps_the_idempotency_key(box):
+    row = {'name': 'a', 'idempotency_key': 'fixed'}
+    assert box.enqueue('leads', row) == 'fixed'
+    box.enqueue('leads', dict(row))
+    assert box.stats()['pending'] == 1
+    assert box.enqueue('leads', {'name': 'b'}) != 'fixed'
+
+
+def test_outage_keeps_rows_pending(box, writer):
+    box.enqueue('leads', {'name': 'a'})
+    writer.down = True
+    assert box.replay() == 0
+    assert box.stats()['pending'] == 1
+    assert box.breaker.state == 'open'
+
+
+def test_rejected_rows_are_parked_as_dead(box, writer):
+    for name in 'abc':
+        box.enqueue('leads', {'name': name})
+    writer.reject = {'b'}
+    assert box.replay() == 2
+    assert writer.batches == [('leads', ['a']), ('leads', ['c'])]
+    stats = box.stats()
+    assert stats['pending'] == 0
+    assert stats['dead'] == 1
+
+
+def test_resume_skips_a_missing_database(tmp_path, writer):
+    box = WriteOutbox(SQLiteFallbackDB(str(tmp_path / 'missing.sqlite3')), writer, replay_interval=3600)
+    box.resume()
+    assert not (tmp_path / 'missing.sqlite3').exists()